@@ -0,0 +1,211 @@
+# core/activity.py
+"""
+Activity log: writing entries, and the "Recent Activity" feed on the main
+dashboard.
+
+``log()`` does not insert in the request. Entries are queued once the
+request's transaction commits and a background thread writes them with
+one ``bulk_create`` when ACTIVITY_LOG_BATCH_SIZE are waiting or after
+ACTIVITY_LOG_FLUSH_INTERVAL seconds, whichever comes first; what is still
+queued is written at interpreter exit. Entries that must not be lost with
+the process (payments) are logged with ``critical=True`` and inserted at
+once, inside the caller's transaction.
+
+For the feed, each activity type maps to a ``Presentation`` once, here;
+the icons are symbols in one static sprite (static/img/activity-icons.svg)
+that the browser downloads and caches once, so a row is a ``<use>``
+reference instead of a copy of the SVG. The rendered feed is cached under
+a version kept in the ``Sequence`` table, which is bumped whenever
+ActivityLog rows are written or deleted (see core/signals.py and
+``ActivityWriter.flush``). Every process reads the version, one small
+query, so even with a per-process cache none of them serves a feed older
+than the last write.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import ActivityLog, Sequence
+from .sequences import next_value
+
+logger = logging.getLogger(__name__)
+
+FEED_CACHE_KEY = 'activity:feed:{}'
+FEED_VERSION_SEQUENCE = 'activity_feed'
+FEED_SIZE = 8
+
+# icon: symbol id in the sprite; color: the icon tile's background
+Presentation = namedtuple('Presentation', ['icon', 'color'])
+
+CREATED = 'rgba(14, 116, 144, 0.2)'
+DELETED = 'rgba(239, 68, 68, 0.2)'
+ORDER = 'rgba(59, 130, 246, 0.2)'
+PAYMENT = 'rgba(16, 185, 129, 0.2)'
+MATERIAL = 'rgba(245, 158, 11, 0.2)'
+
+PRESENTATION = {
+    'client_created': Presentation('activity-client', CREATED),
+    'client_updated': Presentation('activity-client', CREATED),
+    'client_deleted': Presentation('activity-deleted', DELETED),
+    'order_created': Presentation('activity-order', ORDER),
+    'order_updated': Presentation('activity-order-updated', ORDER),
+    'order_deleted': Presentation('activity-deleted', DELETED),
+    'payment_recorded': Presentation('activity-payment', PAYMENT),
+    'material_created': Presentation('activity-material', MATERIAL),
+    'material_updated': Presentation('activity-material-updated', MATERIAL),
+    'material_deleted': Presentation('activity-material-deleted', DELETED),
+    'reorder_created': Presentation('activity-reorder', MATERIAL),
+}
+DEFAULT = Presentation('activity-default', 'rgba(107, 114, 128, 0.2)')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# === FEED ===
+
+def feed_rows(limit=FEED_SIZE):
+    rows = []
+    for log in ActivityLog.objects.order_by('-created_at')[:limit]:
+        presentation = PRESENTATION.get(log.activity_type, DEFAULT)
+        rows.append({
+            'description': log.description,
+            'timestamp': log.created_at.strftime('%b %d'),
+            'icon': presentation.icon,
+            'icon_color': presentation.color,
+        })
+    return rows
+
+
+def feed_version():
+    return Sequence.objects.filter(name=FEED_VERSION_SEQUENCE).values_list('last_value', flat=True).first() or 0
+
+
+def recent_feed():
+    """The rendered feed fragment, from the cache when it is current"""
+    key = FEED_CACHE_KEY.format(feed_version())
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('activity_feed.html', {'activities': feed_rows()})
+        cache.set(key, html, _setting('ACTIVITY_FEED_TIMEOUT', 300))
+    return mark_safe(html)
+
+
+def invalidate_feed():
+    """Retire the cached feed in every process (the old entries just expire)"""
+    next_value(FEED_VERSION_SEQUENCE)
+
+
+# === WRITING ===
+
+class ActivityWriter:
+    """
+    In-process queue of unsaved ActivityLog rows. With ``background`` a
+    daemon thread flushes it; otherwise only ``flush()`` and ``close()`` do.
+    """
+
+    def __init__(self, background=True):
+        self.background = background
+        self.lock = threading.Lock()
+        self.entries = []
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.pid = os.getpid()
+
+    def add(self, entry):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked: the parent writes what it had queued, and the
+                # thread did not survive the fork
+                self.pid = os.getpid()
+                self.entries = []
+                self.thread = None
+            if self.background and self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='activity-writer', daemon=True)
+                self.thread.start()
+            self.entries.append(entry)
+            full = len(self.entries) >= _setting('ACTIVITY_LOG_BATCH_SIZE', 100)
+        if full:
+            self.wake.set()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.wake.wait(_setting('ACTIVITY_LOG_FLUSH_INTERVAL', 2.0))
+            self.wake.clear()
+            self.flush()
+            # This thread's own connection, as after a request
+            close_old_connections()
+
+    def flush(self):
+        """Write every queued entry; returns how many were written"""
+        with self.lock:
+            entries, self.entries = self.entries, []
+        if not entries:
+            return 0
+        try:
+            ActivityLog.objects.bulk_create(entries, batch_size=_setting('ACTIVITY_LOG_BATCH_SIZE', 100))
+        except IntegrityError:
+            # E.g. the user was deleted meanwhile; don't lose the whole batch
+            entries = self._save_one_by_one(entries)
+        except DatabaseError:
+            logger.exception("Could not write %d activity log entries", len(entries))
+            with self.lock:
+                # Try again with the next batch, but don't grow without bound
+                # while the database is unavailable
+                room = _setting('ACTIVITY_LOG_MAX_QUEUE', 10000) - len(self.entries)
+                self.entries[:0] = entries[:max(room, 0)]
+            return 0
+        try:
+            invalidate_feed()
+        except DatabaseError:
+            # The entries are written; the feed catches up with the next write
+            logger.exception("Could not invalidate the activity feed")
+        return len(entries)
+
+    def _save_one_by_one(self, entries):
+        saved = []
+        for entry in entries:
+            try:
+                with transaction.atomic():
+                    entry.save()
+            except IntegrityError:
+                logger.exception("Dropped activity log entry %r", entry.description)
+            else:
+                saved.append(entry)
+        return saved
+
+    def close(self):
+        """Stop the thread and write what is left (at exit)"""
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=5)
+        self.flush()
+
+
+writer = ActivityWriter()
+atexit.register(writer.close)
+
+
+def log(activity_type, description, user=None, critical=False, **object_ids):
+    """
+    Record an activity (``object_ids``: client_id, order_id, material_id,
+    reorder_id). Queued once the current transaction commits, and dropped
+    if it rolls back; ``critical`` entries are saved right away instead.
+    """
+    entry = ActivityLog(activity_type=activity_type, description=description, user=user, **object_ids)
+    if critical:
+        entry.save()
+    else:
+        transaction.on_commit(lambda: writer.add(entry))
+    return entry
@@ -0,0 +1,185 @@
+# core/activity_archive.py
+"""
+Retention for ActivityLog (``manage.py archive_activity``).
+
+Entries older than ACTIVITY_RETENTION_DAYS (whole days, local time) are
+moved out of the table in batches. Each batch goes to gzip JSON-lines
+files in the directory of its month,
+``ACTIVITY_ARCHIVE_DIR/activity-YYYY-MM/<first id>-<last id>.jsonl.gz``,
+and only then is deleted. The rows a run deletes, and only those, are
+counted in ActivityRollup per day and type in the same transaction, so
+overlapping runs never count an entry twice.
+
+A file is written under a temporary name and renamed into place once it
+is on disk, so a run that dies half way leaves no torn file behind (and
+nothing a concurrent run could trip over), and runs are incremental and
+can stop anywhere (``max_rows``). If a run dies between writing a batch
+and deleting its rows, or two runs archive the same rows, those entries
+are written again; ``read_archive()`` skips the duplicates by id.
+
+``daily_counts()`` reports from the rollups together with the entries
+still in the table.
+"""
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, time, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .activity import invalidate_feed
+from .models import ActivityLog, ActivityRollup
+
+FIELDS = [
+    'id', 'activity_type', 'description', 'user_id', 'created_at',
+    'client_id', 'order_id', 'material_id', 'reorder_id',
+]
+
+
+def archive_dir():
+    return Path(getattr(settings, 'ACTIVITY_ARCHIVE_DIR', settings.BASE_DIR / 'archive' / 'activity'))
+
+
+def month_dir(month):
+    return archive_dir() / f"activity-{month:%Y-%m}"
+
+
+def cutoff(days=None, now=None):
+    """Start of the oldest local day that is kept"""
+    if days is None:
+        days = getattr(settings, 'ACTIVITY_RETENTION_DAYS', 90)
+    today = timezone.localdate(now)
+    return timezone.make_aware(datetime.combine(today - timedelta(days=days), time.min))
+
+
+# Temporary files older than this were left by a run that died
+STALE_TMP_SECONDS = 3600
+
+
+def _fsync_dir(path):
+    if hasattr(os, 'O_DIRECTORY'):  # not on Windows
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _write(month, rows):
+    directory = month_dir(month)
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(gzip.compress(b''.join(json.dumps(row).encode() + b'\n' for row in rows)))
+        f.flush()
+        # On disk before the rows are deleted
+        os.fsync(f.fileno())
+    os.replace(tmp, directory / f"{rows[0]['id']:012d}-{rows[-1]['id']:012d}.jsonl.gz")
+    _fsync_dir(directory)
+
+
+def _remove_stale_tmp():
+    for path in archive_dir().glob('activity-*/.tmp-*'):
+        try:
+            if timezone.now().timestamp() - path.stat().st_mtime > STALE_TMP_SECONDS:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _delete(ids):
+    """Delete the entries of ``ids`` that are still there; returns how many were"""
+    # Plain SQL: no post_delete per row (it would only drop the feed cache
+    # once per row), and the row count says what this run really removed
+    table = connection.ops.quote_name(ActivityLog._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+        return cursor.rowcount
+
+
+def _archive_batch(rows):
+    """Archive ``rows``; returns how many of them this run removed from the table"""
+    months, groups = {}, {}
+    for row in rows:
+        day = timezone.localdate(row['created_at'])
+        months.setdefault(day.replace(day=1), []).append({**row, 'created_at': row['created_at'].isoformat()})
+        groups.setdefault((day, row['activity_type']), []).append(row['id'])
+
+    for month, month_rows in sorted(months.items()):
+        _write(month, month_rows)
+
+    moved = 0
+    with transaction.atomic():
+        for (day, activity_type), ids in groups.items():
+            # Delete first and count only what was deleted: rows that an
+            # overlapping run got to first are already in its rollups
+            count = _delete(ids)
+            if not count:
+                continue
+            rollup, created = ActivityRollup.objects.get_or_create(
+                day=day, activity_type=activity_type, defaults={'count': count},
+            )
+            if not created:
+                ActivityRollup.objects.filter(pk=rollup.pk).update(count=F('count') + count)
+            moved += count
+    return moved
+
+
+def archive(days=None, batch_size=1000, max_rows=None, dry_run=False, now=None):
+    """
+    Move entries from before ``cutoff(days)`` to the archive; returns how
+    many were (or, with ``dry_run``, would be) moved
+    """
+    old = ActivityLog.objects.filter(created_at__lt=cutoff(days, now))
+    if dry_run:
+        total = old.count()
+        return min(total, max_rows) if max_rows is not None else total
+
+    _remove_stale_tmp()
+    moved = 0
+    while max_rows is None or moved < max_rows:
+        size = batch_size if max_rows is None else min(batch_size, max_rows - moved)
+        rows = list(old.order_by('created_at', 'id').values(*FIELDS)[:size])
+        if not rows:
+            break
+        moved += _archive_batch(rows)
+    if moved:
+        invalidate_feed()
+    return moved
+
+
+def read_archive(month):
+    """The archived entries of ``month`` (any date in it), oldest first"""
+    rows = {}
+    for path in sorted(month_dir(month).glob('*.jsonl.gz')):
+        with gzip.open(path, 'rt') as archive:
+            for line in archive:
+                row = json.loads(line)
+                rows.setdefault(row['id'], row)
+    return sorted(rows.values(), key=lambda row: (row['created_at'], row['id']))
+
+
+def daily_counts(start=None, end=None):
+    """``{(day, activity_type): count}``, archived and live entries together"""
+    rollups = ActivityRollup.objects.all()
+    live = ActivityLog.objects.all()
+    if start:
+        rollups = rollups.filter(day__gte=start)
+        live = live.filter(created_at__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        rollups = rollups.filter(day__lte=end)
+        live = live.filter(created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+
+    counts = {}
+    for day, activity_type, count in rollups.values_list('day', 'activity_type', 'count'):
+        counts[day, activity_type] = counts.get((day, activity_type), 0) + count
+    live = live.annotate(day=TruncDate('created_at')).values('day', 'activity_type').annotate(n=Count('id'))
+    for day, activity_type, count in live.values_list('day', 'activity_type', 'n'):
+        counts[day, activity_type] = counts.get((day, activity_type), 0) + count
+    return counts
@@ -1,6 +1,6 @@
 # core/admin.py
 from django.contrib import admin
-from .models import Client, Order, Material, Vendor, Reorder, Invoice, ActivityLog
+from .models import Client, Order, Material, Vendor, Reorder, Invoice, ActivityLog, ActivityRollup
 
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
@@ -37,4 +37,10 @@ class InvoiceAdmin(admin.ModelAdmin):
 class ActivityLogAdmin(admin.ModelAdmin):
     list_display = ('activity_type', 'description', 'user', 'created_at')
     list_filter = ('activity_type', 'created_at')
-    search_fields = ('description',)
\ No newline at end of file
+    search_fields = ('description',)
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'activity_type', 'count')
+    list_filter = ('activity_type',)
+    date_hierarchy = 'day'
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the signal handlers)
+        from .profiling import install_template_timer
+        install_template_timer()
@@ -0,0 +1,147 @@
+# core/avatars.py
+"""
+Thumbnail variants of client avatars.
+
+Uploads are phone photos of several MB, but the dashboards only ever show
+them in 36-50px circles. When an avatar is saved we render small WebP and
+JPEG copies next to it (``avatars/thumbs/``), already rotated upright and
+without EXIF metadata, and the templates use those instead of the original.
+
+Originals are content-addressed (core/storage.py) and may be shared by
+several clients, so a file is only deleted once no client refers to it
+and no upload has shared it for AVATAR_GC_GRACE seconds: a save that is
+about to point a client at it may not have committed yet. Files spared
+for that reason are left to ``manage.py gc_avatars``.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+AVATAR_DIR = 'avatars'
+THUMBNAIL_DIR = 'avatars/thumbs'
+
+# Avatars are shown in circles of at most 50px; 80px keeps them sharp on
+# high-DPI screens.
+THUMBNAIL_SIZE = 80
+
+# format -> (Pillow format, file extension, save options)
+VARIANTS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_name(name, fmt='jpeg', size=THUMBNAIL_SIZE):
+    base, _ = os.path.splitext(os.path.basename(name))
+    return f"{THUMBNAIL_DIR}/{base}_{size}.{VARIANTS[fmt][1]}"
+
+
+def has_variants(avatar, size=THUMBNAIL_SIZE):
+    return all(default_storage.exists(variant_name(avatar.name, fmt, size)) for fmt in VARIANTS)
+
+
+def create_variants(avatar, size=THUMBNAIL_SIZE):
+    """
+    Render every variant of ``avatar`` (overwriting stale ones) and return
+    ``{format: storage name}``. Raises ``OSError`` if the original is
+    missing or not an image.
+    """
+    with avatar.storage.open(avatar.name, 'rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.fit(image.convert('RGB'), (size, size), Image.LANCZOS)
+
+    names = {}
+    for fmt, (pil_format, _, options) in VARIANTS.items():
+        buffer = BytesIO()
+        # A freshly created image carries no EXIF unless it is passed in
+        image.save(buffer, pil_format, **options)
+        name = variant_name(avatar.name, fmt, size)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        names[fmt] = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return names
+
+
+def get_or_create_thumbnail(avatar, fmt='jpeg', size=THUMBNAIL_SIZE):
+    """Storage name of one variant, rendering the variants if they are missing"""
+    name = variant_name(avatar.name, fmt, size)
+    if default_storage.exists(name):
+        return name
+    return create_variants(avatar, size)[fmt]
+
+
+# === GARBAGE COLLECTION ===
+
+def _delete(storage, name):
+    """Delete ``name`` if it exists; returns the bytes freed"""
+    if not storage.exists(name):
+        return 0
+    size = storage.size(name)
+    storage.delete(name)
+    return size
+
+
+def gc_grace():
+    return getattr(settings, 'AVATAR_GC_GRACE', 3600)
+
+
+def release_avatar(name, storage):
+    """
+    Delete the avatar file ``name`` and its variants if no client uses it
+    any more (it was replaced, or its client deleted). Returns bytes freed.
+    """
+    from .models import Client
+
+    if not name or Client.objects.filter(avatar=name).exists():
+        return 0
+    reclaimed = storage.delete_unused(name, gc_grace())
+    if storage.exists(name):
+        # Shared by a recent upload
+        return 0
+    for fmt in VARIANTS:
+        reclaimed += _delete(default_storage, variant_name(name, fmt))
+    if reclaimed:
+        logger.info("Released avatar %s (%d bytes)", name, reclaimed)
+    return reclaimed
+
+
+def avatars_in_use():
+    from .models import Client
+
+    return set(Client.objects.exclude(avatar='').exclude(avatar__isnull=True)
+               .values_list('avatar', flat=True).distinct())
+
+
+def find_orphans(storage, in_use=None):
+    """
+    ``[(name, size)]`` of files under avatars/ that no client refers to:
+    originals nobody uses and variants of originals that are gone.
+    """
+    if in_use is None:
+        in_use = avatars_in_use()
+    live_variants = {variant_name(name, fmt) for name in in_use for fmt in VARIANTS}
+
+    orphans = []
+    if not storage.exists(AVATAR_DIR):
+        return orphans
+    _, files = storage.listdir(AVATAR_DIR)
+    for filename in files:
+        name = f"{AVATAR_DIR}/{filename}"
+        if name not in in_use:
+            orphans.append((name, storage.size(name)))
+    if default_storage.exists(THUMBNAIL_DIR):
+        _, files = default_storage.listdir(THUMBNAIL_DIR)
+        for filename in files:
+            name = f"{THUMBNAIL_DIR}/{filename}"
+            if name not in live_variants:
+                orphans.append((name, default_storage.size(name)))
+    return orphans
+
@@ -0,0 +1,176 @@
+# core/counters.py
+"""
+Materialized dashboard counters.
+
+Every counter is a Q filter over one model. The same definitions are used
+to rebuild a counter from scratch (one aggregate per model) and to work out
+how a single row changes the counters (the same aggregate on that one row),
+so the incremental path and the rebuild can never disagree about what a
+counter means.
+"""
+import threading
+
+from django.db.models import Count, F, Q
+
+from .models import Client, Invoice, KPICounter, Material, Order, Reorder
+
+
+COUNTERS = {
+    Client: {
+        'clients_total': None,
+        'clients_active': Q(is_active=True),
+        'clients_inactive': Q(is_active=False),
+    },
+    Order: {
+        'orders_total': None,
+        'orders_pending': ~Q(status='completed'),
+        'orders_shipped': Q(status='shipped'),
+        'orders_completed': Q(status='completed'),
+        'orders_unpaid': Q(remaining_amount__gt=0),
+    },
+    Material: {
+        'materials_total': None,
+        'materials_in_stock': Q(quantity__gt=0),
+        'materials_empty': Q(quantity=0),
+        'materials_out_of_stock': Q(quantity__lte=0),
+        'materials_low_stock': Q(quantity__gt=0, quantity__lt=F('threshold')),
+        'materials_below_threshold': Q(quantity__lte=F('threshold')),
+        'materials_reorder_low_stock': Q(quantity__gt=0, quantity__lte=F('threshold')),
+    },
+    Invoice: {
+        'invoices_total': None,
+    },
+    Reorder: {
+        'reorders_total': None,
+        'reorders_pending': Q(status='pending'),
+    },
+}
+
+COUNTER_NAMES = [name for rules in COUNTERS.values() for name in rules]
+
+
+def _aggregate(model, queryset):
+    rules = COUNTERS[model]
+    return queryset.aggregate(**{
+        name: Count('pk', filter=q) for name, q in rules.items()
+    })
+
+
+def compute_counters():
+    """Count every counter from the base tables (one query per model)"""
+    values = {}
+    for model in COUNTERS:
+        values.update(_aggregate(model, model.objects.all()))
+    return values
+
+
+def row_state(model, pk):
+    """Which counters the stored row ``pk`` currently contributes to (0/1)"""
+    if pk is None:
+        return {name: 0 for name in COUNTERS[model]}
+    return _aggregate(model, model.objects.filter(pk=pk))
+
+
+def apply_delta(old, new):
+    """Shift counters by ``new - old`` with atomic ``F()`` updates"""
+    for name, value in new.items():
+        delta = value - old.get(name, 0)
+        if delta:
+            KPICounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+def rebuild_counters():
+    """
+    Overwrite every counter with its true value.
+
+    Returns ``{name: (stored, actual)}`` for the counters that had drifted.
+    """
+    actual = compute_counters()
+    stored = dict(KPICounter.objects.values_list('name', 'value'))
+    drift = {}
+    for name, value in actual.items():
+        if stored.get(name) != value:
+            drift[name] = (stored.get(name), value)
+            KPICounter.objects.update_or_create(name=name, defaults={'value': value})
+    KPICounter.objects.exclude(name__in=COUNTER_NAMES).delete()
+    return drift
+
+
+def check_counters():
+    """Return ``{name: (stored, actual)}`` for counters that have drifted"""
+    actual = compute_counters()
+    stored = dict(KPICounter.objects.values_list('name', 'value'))
+    return {
+        name: (stored.get(name), value)
+        for name, value in actual.items()
+        if stored.get(name) != value
+    }
+
+
+def get_counters():
+    """
+    All counters in a single query. Missing rows (fresh database, or a
+    counter added in a later release) trigger a one-off rebuild.
+    """
+    values = dict(KPICounter.objects.values_list('name', 'value'))
+    if any(name not in values for name in COUNTER_NAMES):
+        rebuild_counters()
+        values = dict(KPICounter.objects.values_list('name', 'value'))
+    return values
+
+
+# --- Bookkeeping for the signal handlers in core/signals.py ---
+#
+# pre_save/pre_delete record what a row counted for before the write, and
+# post_save/post_delete apply the difference. Invoices also move their
+# order in or out of ``orders_unpaid``, so an invoice write snapshots the
+# parent order as well. The state is thread-local because one request's
+# pre/post pairs must not see another's.
+
+_local = threading.local()
+
+
+def _pending():
+    if not hasattr(_local, 'snapshots'):
+        _local.snapshots = {}
+        _local.deleting = set()
+    return _local.snapshots, _local.deleting
+
+
+def snapshot(model, pk, deleting=False):
+    # Always re-read: within one delete cascade every pre_delete runs before
+    # any row is removed, so siblings record the same state anyway.
+    snapshots, deleting_keys = _pending()
+    key = (model, pk)
+    snapshots[key] = row_state(model, pk)
+    if deleting:
+        deleting_keys.add(key)
+
+
+def settle_create(model, pk):
+    """Apply the change for a newly inserted row"""
+    apply_delta({}, row_state(model, pk))
+
+
+def settle(model, pk):
+    """Apply the change for a row that was updated (and still exists)"""
+    snapshots, deleting_keys = _pending()
+    key = (model, pk)
+    if key in deleting_keys:
+        # Parent row is being deleted in the same cascade; its own
+        # post_delete removes whatever it was counted for.
+        return
+    if key not in snapshots:
+        # Already settled by a sibling in the same bulk delete.
+        return
+    apply_delta(snapshots.pop(key), row_state(model, pk))
+
+
+def settle_delete(model, pk):
+    """Apply the change for a row that was deleted"""
+    snapshots, deleting_keys = _pending()
+    key = (model, pk)
+    deleting_keys.discard(key)
+    old = snapshots.pop(key, None)
+    if old is not None:
+        apply_delta(old, {name: 0 for name in old})
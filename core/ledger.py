@@ -0,0 +1,111 @@
+# core/ledger.py
+"""
+Per-order payment balances, stored on the order itself.
+
+``Order.paid_amount`` is the sum of the order's invoices,
+``remaining_amount`` is ``payment - paid_amount`` and ``payment_state`` is
+pending / partial / paid. The finance page filters and counts on these
+columns instead of aggregating every invoice on every request.
+
+The invoice signal handlers in core/signals.py keep them current inside
+the writing transaction. A new invoice adds its amount, a deleted one
+subtracts it and an edit moves the difference. These are relative
+``paid_amount = paid_amount + delta`` updates, so concurrent payments on
+one order cannot overwrite each other. ``manage.py reconcile_ledger``
+checks (and repairs) the stored balances against the raw invoices.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+
+from .models import Invoice, Order
+
+CENT = Decimal('0.01')
+
+
+def balance(paid):
+    """
+    ``update()`` kwargs setting all three ledger columns from the ``paid``
+    expression; the SQL twin of ``Order.payment_state_for()``
+    """
+    remaining = F('payment') - paid
+    return {
+        'paid_amount': paid,
+        'remaining_amount': remaining,
+        'payment_state': Case(
+            When(LessThanOrEqual(remaining, 0), then=Value(Order.PAYMENT_PAID)),
+            When(GreaterThan(paid, 0), then=Value(Order.PAYMENT_PARTIAL)),
+            default=Value(Order.PAYMENT_PENDING),
+        ),
+    }
+
+
+def paid_total(order_ref='pk'):
+    """Total of all invoices for the order referenced by ``order_ref``"""
+    invoices = (
+        Invoice.objects.filter(order=OuterRef(order_ref))
+        .order_by()
+        .values('order')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    return Coalesce(Subquery(invoices), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+def latest_invoice_id(order_ref='pk'):
+    """Id of the newest invoice of the order referenced by ``order_ref``, or None"""
+    return Subquery(
+        Invoice.objects.filter(order=OuterRef(order_ref)).order_by('-created_at', '-id').values('id')[:1]
+    )
+
+
+# === INCREMENTAL UPDATES ===
+
+def record(order_id, delta):
+    """Add ``delta`` (negative for refunds/deletions) to an order's payments"""
+    if delta:
+        Order.objects.filter(pk=order_id).update(**balance(F('paid_amount') + Value(delta)))
+
+
+def refresh(order_id):
+    """Recompute remaining/state after the order's own ``payment`` changed"""
+    Order.objects.filter(pk=order_id).update(**balance(F('paid_amount')))
+
+
+# === RECONCILIATION ===
+
+def _quantize(value):
+    return None if value is None else Decimal(value).quantize(CENT)
+
+
+def check_ledger():
+    """
+    Compare every order's stored balance with its invoices. Returns
+    ``{order pk: (stored, actual)}`` where both are
+    ``(paid_amount, remaining_amount, payment_state)``.
+    """
+    rows = (
+        Order.objects.annotate(actual_paid=paid_total())
+        .values_list('pk', 'payment', 'paid_amount', 'remaining_amount', 'payment_state', 'actual_paid')
+        .order_by('pk')
+    )
+    drift = {}
+    for pk, payment, paid, remaining, state, actual_paid in rows.iterator(chunk_size=2000):
+        actual_paid = _quantize(actual_paid)
+        actual_remaining = None if payment is None else _quantize(payment - actual_paid)
+        stored = (_quantize(paid), _quantize(remaining), state)
+        actual = (actual_paid, actual_remaining, Order.payment_state_for(payment, actual_paid))
+        if stored != actual:
+            drift[pk] = (stored, actual)
+    return drift
+
+
+def reconcile_ledger():
+    """Rewrite every drifted balance from the invoices; returns the drift fixed"""
+    drift = check_ledger()
+    pks = list(drift)
+    for start in range(0, len(pks), 500):
+        Order.objects.filter(pk__in=pks[start:start + 500]).update(**balance(paid_total()))
+    return drift
@@ -0,0 +1,334 @@
+# core/loadtest.py
+"""
+HTTP load generator for a running instance (``manage.py loadtest``).
+
+Standard library only. Each virtual user is an asyncio task with one
+keep-alive HTTP/1.1 connection and its own cookies. It logs in through
+``admin_login`` and then replays a weighted mix of the shop's traffic:
+dashboards, client typeahead, paging APIs, invoices, PDF downloads and
+payment POSTs. Users send their next request as soon as the previous
+answer arrives (optionally after a think time). Latency is measured per
+endpoint from sending the request to reading the last body byte. A PDF
+download is followed the way the browser's "Preparing" page does it: when
+the PDF is not cached yet (202), its ``status_url`` is polled until the job
+is done and the PDF is fetched, and the whole wait is the latency, so the
+run needs ``run_pdf_worker`` next to the server.
+
+Ids and search terms are sampled from the database configured in
+settings, which should be the one the server under test uses.
+"""
+import asyncio
+import json
+import random
+import ssl
+import statistics
+import time
+from collections import namedtuple
+from decimal import Decimal
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.urls import reverse
+
+from .models import Client, Invoice, Order
+
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+
+
+class LoadTestError(Exception):
+    pass
+
+
+# === HTTP ===
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection with a cookie jar"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.https = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.https else 80)
+        self.cookies = {}
+        self.reader = self.writer = None
+
+    async def request(self, method, path, data=None, headers=None):
+        body = urlencode(data).encode() if data is not None else b''
+        lines = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            "Accept-Encoding: identity",
+        ]
+        if self.cookies:
+            lines.append("Cookie: " + "; ".join(f"{name}={value}" for name, value in self.cookies.items()))
+        if data is not None:
+            lines.append("Content-Type: application/x-www-form-urlencoded")
+            lines.append(f"Content-Length: {len(body)}")
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+
+        reused = self.writer is not None
+        try:
+            return await self._send(payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        # The server dropped an idle keep-alive connection; retry on a fresh one
+        return await self._send(payload)
+
+    async def _send(self, payload):
+        if self.writer is None:
+            context = ssl.create_default_context() if self.https else None
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+        self.writer.write(payload)
+        await self.writer.drain()
+        return await self._read_response()
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'set-cookie':
+                self._store_cookie(value)
+            else:
+                headers[name] = value
+
+        status = int(status)
+        if 'chunked' in headers.get('transfer-encoding', ''):
+            body = await self._read_chunked()
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        elif status in (204, 304) or status < 200:
+            body = b''
+        else:
+            body = await self.reader.read()
+            self.close()
+        if headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+            self.close()
+        return Response(status, headers, body)
+
+    async def _read_chunked(self):
+        chunks = []
+        while size := int((await self.reader.readline()).split(b';')[0], 16):
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+        # Trailers, up to the blank line
+        while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(chunks)
+
+    def _store_cookie(self, header):
+        for name, morsel in SimpleCookie(header).items():
+            if morsel['max-age'] == '0' or not morsel.value:
+                self.cookies.pop(name, None)
+            else:
+                self.cookies[name] = morsel.value
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def login(connection, username, password):
+    # GET first for the CSRF cookie
+    await connection.request('GET', reverse('admin_login'))
+    token = connection.cookies.get('csrftoken', '')
+    response = await connection.request('POST', reverse('admin_login'), {
+        'username': username, 'password': password, 'csrfmiddlewaretoken': token,
+    })
+    if response.status != 302 or 'sessionid' not in connection.cookies:
+        raise LoadTestError(f"login as {username!r} failed (HTTP {response.status})")
+
+
+async def download_pdf(connection, path, poll_interval=1.0, timeout=60.0):
+    """
+    Request an invoice PDF and, if it is queued, poll its job until it is
+    ready and fetch it. Returns the last response; its status is
+    ``'job failed'`` or ``'timeout'`` when no PDF came.
+    """
+    headers = {'Accept': 'application/json'}
+    deadline = time.monotonic() + timeout
+    response = await connection.request('GET', path, headers=headers)
+    while response.status == 202:
+        status_url = json.loads(response.body)['status_url']
+        while True:
+            if time.monotonic() >= deadline:
+                return response._replace(status='timeout')
+            await asyncio.sleep(poll_interval)
+            response = await connection.request('GET', status_url, headers=headers)
+            status = json.loads(response.body)['status'] if response.status == 200 else None
+            if status == 'failed':
+                return response._replace(status='job failed')
+            if status == 'done' or response.status != 200:
+                break
+        if response.status != 200:
+            return response
+        response = await connection.request('GET', path, headers=headers)
+    return response
+
+
+# === SCENARIO ===
+
+def sample_targets(size=500, seed=0):
+    """Ids and search prefixes to request, sampled from the database"""
+    rng = random.Random(seed)
+
+    def pick(queryset):
+        ids = list(queryset.values_list('pk', flat=True)[:size * 20])
+        return rng.sample(ids, min(size, len(ids)))
+
+    names = list(Client.objects.values_list('name', flat=True)[:size])
+    invoices = pick(Invoice.objects.all())
+    # Recording a payment replaces the order's invoices; keep those
+    # orders apart from the invoices that are viewed
+    orders = pick(Order.objects.exclude(invoices__in=invoices))
+    return {
+        'clients': pick(Client.objects.all()),
+        'invoices': invoices,
+        'orders': list(Order.objects.filter(pk__in=orders).values_list('pk', 'payment')),
+        'prefixes': sorted({name[:rng.randint(2, 4)].lower() for name in names if len(name) >= 2}) or ['cl'],
+    }
+
+
+def _get(name, params=None, **kwargs):
+    path = reverse(name, kwargs=kwargs)
+    return 'GET', path + ('?' + urlencode(params) if params else ''), None
+
+
+def _record_payment(rng, targets):
+    order_id, payment = rng.choice(targets['orders'])
+    paid = (payment or Decimal('0')) * Decimal(rng.choice(['0', '0.25', '0.5', '1']))
+    return 'POST', reverse('finance_dashboard'), {
+        'record_payment': '1', 'order_id': order_id, 'paid_amount': f"{paid:.2f}",
+    }
+
+
+# (weight, label, request builder, what the builder needs from the targets)
+MIX = [
+    (12, 'main_dashboard', lambda rng, t: _get('main_dashboard'), None),
+    (8, 'client_dashboard', lambda rng, t: _get('client_dashboard', rng.choice([None, {'status': 'active'}])), None),
+    (8, 'order_dashboard', lambda rng, t: _get('order_dashboard', rng.choice([None, {'status': 'shipped'}])), None),
+    (4, 'inventory_dashboard', lambda rng, t: _get('inventory_dashboard'), None),
+    (4, 'reorder_dashboard', lambda rng, t: _get('reorder_dashboard'), None),
+    # Searched, as the full finance list grows with every order
+    (4, 'finance_dashboard', lambda rng, t: _get('finance_dashboard', {'q': rng.choice(t['prefixes'])}), 'prefixes'),
+    (20, 'client_search_api', lambda rng, t: _get('client_search_api', {'q': rng.choice(t['prefixes'])}), 'prefixes'),
+    (5, 'client_page_api', lambda rng, t: _get('client_page_api'), None),
+    (5, 'order_page_api', lambda rng, t: _get('order_page_api'), None),
+    (10, 'view_invoice', lambda rng, t: _get('view_invoice', invoice_id=rng.choice(t['invoices'])), 'invoices'),
+    (5, 'download_invoice_pdf',
+     lambda rng, t: _get('download_invoice_pdf', invoice_id=rng.choice(t['invoices'])), 'invoices'),
+    (3, 'record_payment', _record_payment, 'orders'),
+]
+WRITES = {'record_payment'}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def add(self, label, seconds, status):
+        self.latencies.setdefault(label, []).append(seconds)
+        counts = self.statuses.setdefault(label, {})
+        counts[status] = counts.get(status, 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+
+    def report(self, elapsed):
+        """Per-endpoint rows (and an ``all`` row) of counts, throughput and ms percentiles"""
+        rows = []
+        everything = [s for latencies in self.latencies.values() for s in latencies]
+        for label, latencies in sorted(self.latencies.items()) + [('all', everything)]:
+            if not latencies:
+                continue
+            ordered = sorted(latencies)
+            cuts = statistics.quantiles(ordered, n=100, method='inclusive') if len(ordered) > 1 else ordered * 99
+            rows.append({
+                'endpoint': label,
+                'requests': len(ordered),
+                'errors': sum(self.errors.values()) if label == 'all' else self.errors.get(label, 0),
+                'rps': round(len(ordered) / elapsed, 1),
+                'p50': round(cuts[49] * 1000, 1),
+                'p95': round(cuts[94] * 1000, 1),
+                'p99': round(cuts[98] * 1000, 1),
+                'max': round(ordered[-1] * 1000, 1),
+                'statuses': {str(k): v for k, v in self.statuses.get(label, {}).items()} if label != 'all' else {},
+            })
+        return rows
+
+
+async def _user(base_url, username, password, mix, targets, stats, deadline, rng, think, pdf_poll_interval,
+                pdf_timeout):
+    connection = Connection(base_url)
+    try:
+        await login(connection, username, password)
+        weights = [weight for weight, *_ in mix]
+        while time.monotonic() < deadline:
+            _, label, build, _ = rng.choices(mix, weights)[0]
+            method, path, data = build(rng, targets)
+            headers = {}
+            if method == 'POST':
+                headers['X-CSRFToken'] = connection.cookies.get('csrftoken', '')
+                data['csrfmiddlewaretoken'] = headers['X-CSRFToken']
+            start = time.perf_counter()
+            try:
+                if label == 'download_invoice_pdf':
+                    response = await download_pdf(connection, path, pdf_poll_interval, pdf_timeout)
+                else:
+                    response = await connection.request(method, path, data, headers)
+                status = response.status
+            except (OSError, asyncio.IncompleteReadError, ValueError) as exc:
+                connection.close()
+                status = type(exc).__name__
+            stats.add(label, time.perf_counter() - start, status)
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+    finally:
+        connection.close()
+
+
+async def _run(base_url, username, password, users, duration, mix, targets, seed, think, ramp_up,
+               pdf_poll_interval, pdf_timeout):
+    stats = Stats()
+    start = time.monotonic()
+    deadline = start + duration
+
+    async def delayed(number):
+        # Spread the logins over the ramp-up instead of one burst
+        await asyncio.sleep(ramp_up * number / users)
+        rng = random.Random(f"{seed}-{number}")
+        await _user(
+            base_url, username, password, mix, targets, stats, deadline, rng, think, pdf_poll_interval, pdf_timeout,
+        )
+
+    await asyncio.gather(*(delayed(number) for number in range(users)))
+    return stats, time.monotonic() - start
+
+
+def run(base_url, username, password, users=10, duration=30, seed=0, think=0.0, ramp_up=0.0,
+        read_only=False, targets=None, pdf_poll_interval=1.0, pdf_timeout=60.0):
+    """
+    Load ``base_url`` for ``duration`` seconds with ``users`` concurrent
+    users; returns ``(per-endpoint rows, elapsed seconds)``
+    """
+    targets = targets if targets is not None else sample_targets(seed=seed)
+    mix = [
+        entry for entry in MIX
+        if not (read_only and entry[1] in WRITES) and (entry[3] is None or targets[entry[3]])
+    ]
+    stats, elapsed = asyncio.run(
+        _run(
+            base_url, username, password, users, duration, mix, targets, seed, think, ramp_up,
+            pdf_poll_interval, pdf_timeout,
+        )
+    )
+    return stats.report(elapsed), elapsed
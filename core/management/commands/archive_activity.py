@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from core.activity_archive import archive, archive_dir, cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Move activity log entries older than the retention period to the per-month gzip archive, "
+        "keeping per-day counts. Safe to run repeatedly (e.g. nightly)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Keep this many days of entries in the table (default: ACTIVITY_RETENTION_DAYS).",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help="Entries moved per transaction.")
+        parser.add_argument(
+            '--max-rows', type=int, default=None,
+            help="Stop after moving this many entries; the next run carries on.",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many entries would move.")
+
+    def handle(self, *args, **options):
+        before = cutoff(options['days'])
+        moved = archive(
+            days=options['days'], batch_size=options['batch_size'],
+            max_rows=options['max_rows'], dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f"{moved} entries from before {before:%Y-%m-%d} would be archived.")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Archived {moved} entries from before {before:%Y-%m-%d} to {archive_dir()}."
+            ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from core.avatars import create_variants, has_variants
+from core.models import Client
+
+
+class Command(BaseCommand):
+    help = "Render the WebP/JPEG thumbnail variants for client avatars uploaded before they existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Re-render variants that already exist.",
+        )
+
+    def handle(self, *args, **options):
+        created = skipped = failed = 0
+        clients = Client.objects.exclude(avatar='').exclude(avatar__isnull=True).only('id', 'avatar')
+
+        for client in clients.iterator():
+            if not options['force'] and has_variants(client.avatar):
+                skipped += 1
+                continue
+            try:
+                create_variants(client.avatar)
+                created += 1
+            except OSError as e:
+                failed += 1
+                self.stderr.write(f"CL-{client.id} ({client.avatar.name}): {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {created}, already present {skipped}, failed {failed}."
+        ))
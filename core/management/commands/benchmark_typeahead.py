@@ -0,0 +1,45 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import typeahead
+
+
+class Command(BaseCommand):
+    help = "Time client typeahead lookups against the in-memory prefix index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=10000, help="Number of lookups to time.")
+        parser.add_argument('--limit', type=int, default=10, help="Results per lookup, as in client_search_api.")
+
+    def handle(self, *args, **options):
+        index = typeahead.PrefixIndex()
+        start = time.perf_counter()
+        index.rebuild()
+        build = time.perf_counter() - start
+        self.stdout.write(f"Indexed {len(index.clients)} clients in {build * 1000:.0f} ms.")
+        if not index.clients:
+            return
+
+        # Queries as typed: 2-4 character prefixes of real names and emails
+        rng = random.Random(0)
+        values = [value for pair in index.clients.values() for value in pair if value]
+        queries = []
+        for _ in range(options['lookups']):
+            value = rng.choice(values).lower()
+            queries.append(value[:rng.randint(2, 4)])
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, options['limit'])
+            timings.append((time.perf_counter() - start) * 1e6)
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(timings)} lookups: "
+            f"p50 {statistics.median(timings):.1f} µs, "
+            f"p99 {timings[int(len(timings) * 0.99) - 1]:.1f} µs, "
+            f"max {timings[-1]:.1f} µs."
+        ))
@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.invoice_pdfs import export_queryset, stream_zip
+
+
+class Command(BaseCommand):
+    help = "Write the PDFs of the selected invoices into one ZIP archive, rendering them in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the ZIP file to write.")
+        parser.add_argument('--start', type=date.fromisoformat, help="First invoice date (YYYY-MM-DD).")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last invoice date (YYYY-MM-DD).")
+        parser.add_argument('--client', type=int, help="Only invoices of this client id.")
+        parser.add_argument(
+            '--workers', type=int,
+            help="Renderer processes (default: PDF_EXPORT_WORKERS or one per CPU).",
+        )
+        parser.add_argument(
+            '--base-url',
+            help="URL relative links in the invoice template resolve against, e.g. https://erp.example.com/",
+        )
+
+    def handle(self, *args, **options):
+        invoices = export_queryset(options['start'], options['end'], options['client'])
+        count = invoices.count()
+        if not count:
+            raise CommandError("No invoices match.")
+
+        chunks = stream_zip(invoices, base_url=options['base_url'], workers=options['workers'])
+        with open(options['output'], 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} invoice(s) to {options['output']}."))
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.avatars import THUMBNAIL_DIR, avatars_in_use, create_variants, find_orphans, gc_grace
+from core.models import Client
+from core.storage import is_content_addressed
+
+
+def _mb(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Move avatars uploaded under their original names to content-addressed names "
+        "(merging byte-identical copies), then delete avatar files no client uses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report what would be merged and deleted without touching anything.",
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=None,
+            help="Keep unused files uploaded or shared less than this many seconds ago (default: AVATAR_GC_GRACE).",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = Client._meta.get_field('avatar').storage
+        in_use = avatars_in_use()
+
+        # 1. Legacy names (photo_AQE1P7I.jpg) -> <sha256>.jpg
+        renamed = {}
+        written = 0
+        for name in sorted(in_use):
+            if is_content_addressed(name):
+                continue
+            if not storage.exists(name):
+                self.stderr.write(f"Missing avatar file: {name}")
+                continue
+            with storage.open(name, 'rb') as f:
+                new_name = storage.hashed_name(name, File(f))
+                if new_name not in renamed.values() and not storage.exists(new_name):
+                    written += storage.size(name)
+                if not dry_run:
+                    storage.save(name, File(f))
+            renamed[name] = new_name
+
+            if not dry_run:
+                Client.objects.filter(avatar=name).update(avatar=new_name)
+                try:
+                    create_variants(Client(avatar=new_name).avatar)
+                except OSError:
+                    self.stderr.write(f"Could not render thumbnails for {new_name}")
+
+        # 2. Files nobody points at any more, unless a save in flight may be
+        # about to (recently uploaded or shared)
+        min_age = gc_grace() if options['min_age'] is None else options['min_age']
+        cutoff = timezone.now() - timedelta(seconds=min_age)
+        in_use = {renamed.get(name, name) for name in in_use}
+        orphans = find_orphans(storage, in_use)
+        freed = removed = 0
+        for name, size in orphans:
+            variant = name.startswith(f"{THUMBNAIL_DIR}/")
+            if (default_storage if variant else storage).get_modified_time(name) > cutoff:
+                continue
+            if not dry_run:
+                if variant:
+                    default_storage.delete(name)
+                elif not storage.delete_unused(name, min_age):
+                    continue
+            freed += size
+            removed += 1
+            self.stdout.write(f"{'Would delete' if dry_run else 'Deleted'} {name} ({size} bytes)")
+
+        prefix = "[dry run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Renamed {len(renamed)} avatar(s) into {len(set(renamed.values()))} file(s); "
+            f"removed {removed} file(s). Reclaimed {freed - written} bytes "
+            f"({_mb(freed - written)}: {freed} freed, {written} newly written)."
+        ))
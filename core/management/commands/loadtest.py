@@ -0,0 +1,72 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadtest import LoadTestError, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a realistic mix of dashboard, search, invoice, PDF and payment requests against a running "
+        "server (runserver, gunicorn, uvicorn, ...) and report latency percentiles and throughput per endpoint. "
+        "Ids are sampled from the configured database, which should be the server's. PDF downloads are timed "
+        "until the PDF arrives, so run_pdf_worker must be running. Payment POSTs rewrite invoices: use "
+        "--read-only against data you care about."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the server under test.")
+        parser.add_argument('--username', default=os.environ.get('LOADTEST_USERNAME', 'admin'),
+                            help="Staff user to log in as (or LOADTEST_USERNAME).")
+        parser.add_argument('--password', default=os.environ.get('LOADTEST_PASSWORD'),
+                            help="Password (or LOADTEST_PASSWORD).")
+        parser.add_argument('--users', type=int, default=10, help="Concurrent virtual users.")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run.")
+        parser.add_argument('--ramp-up', type=float, default=0, help="Seconds over which users log in.")
+        parser.add_argument('--think', type=float, default=0,
+                            help="Mean pause between a user's requests in seconds (0: back to back).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the request mix.")
+        parser.add_argument('--read-only', action='store_true', help="Leave out the payment POSTs.")
+        parser.add_argument('--pdf-timeout', type=float, default=60,
+                            help="Seconds to wait for a queued PDF before counting the download as failed.")
+        parser.add_argument('--json', metavar='PATH', help="Also write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        if not options['password']:
+            raise CommandError("Give --password or set LOADTEST_PASSWORD.")
+        if options['users'] < 1 or options['duration'] <= 0:
+            raise CommandError("--users and --duration must be positive.")
+
+        self.stdout.write(
+            f"Loading {options['url']} with {options['users']} users for {options['duration']:g}s..."
+        )
+        try:
+            rows, elapsed = run(
+                options['url'], options['username'], options['password'],
+                users=options['users'], duration=options['duration'], seed=options['seed'],
+                think=options['think'], ramp_up=options['ramp_up'], read_only=options['read_only'],
+                pdf_timeout=options['pdf_timeout'],
+            )
+        except (LoadTestError, OSError) as exc:
+            raise CommandError(f"Load test failed: {exc}")
+
+        header = f"{'endpoint':<22} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in rows:
+            self.stdout.write(
+                f"{row['endpoint']:<22} {row['requests']:>8} {row['errors']:>6} {row['rps']:>7} "
+                f"{row['p50']:>8} {row['p95']:>8} {row['p99']:>8} {row['max']:>8}"
+            )
+
+        if options['json']:
+            with open(options['json'], 'w') as handle:
+                json.dump({'url': options['url'], 'users': options['users'], 'elapsed': round(elapsed, 1),
+                           'endpoints': rows}, handle, indent=2)
+
+        errors = rows[-1]['errors'] if rows else 0
+        if errors:
+            self.stdout.write(self.style.WARNING(f"{errors} request(s) failed."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Done in {elapsed:.1f}s, no failed requests."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import check_counters, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recount the dashboard KPI counters from the base tables and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report drift; exit with status 1 if any counter is wrong.",
+        )
+
+    def handle(self, *args, **options):
+        drift = check_counters() if options['check'] else rebuild_counters()
+
+        for name, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f"{name}: stored={stored} actual={actual}")
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All counters are consistent."))
+        elif options['check']:
+            self.stderr.write(self.style.ERROR(f"{len(drift)} counter(s) out of date."))
+            raise SystemExit(1)
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(drift)} counter(s)."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Re-index every client, order and material for the search boxes (after bulk imports)."
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError("The search index is not available on this database (needs SQLite with FTS5).")
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
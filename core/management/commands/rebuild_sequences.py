@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.sequences import rebuild_sequences
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the order and invoice number sequences past the highest ids already stored "
+        "(after imports or restoring old data)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report; exit with status 1 if a sequence is behind.",
+        )
+
+    def handle(self, *args, **options):
+        changes = rebuild_sequences(dry_run=options['check'])
+
+        for name, (stored, new) in sorted(changes.items()):
+            self.stdout.write(f"{name}: stored={stored} required={new}")
+
+        if not changes:
+            self.stdout.write(self.style.SUCCESS("All sequences are ahead of the stored ids."))
+        elif options['check']:
+            self.stderr.write(self.style.ERROR(f"{len(changes)} sequence(s) behind."))
+            raise SystemExit(1)
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Moved {len(changes)} sequence(s)."))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.ledger import check_ledger, reconcile_ledger
+
+
+class Command(BaseCommand):
+    help = "Check every order's paid/remaining balance against its invoices and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report drift; exit with status 1 if any balance is wrong.",
+        )
+
+    def handle(self, *args, **options):
+        drift = check_ledger() if options['check'] else reconcile_ledger()
+
+        for pk, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(
+                f"order {pk}: stored paid={stored[0]} remaining={stored[1]} state={stored[2]}"
+                f" actual paid={actual[0]} remaining={actual[1]} state={actual[2]}"
+            )
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All order balances match their invoices."))
+        elif options['check']:
+            self.stderr.write(self.style.ERROR(f"{len(drift)} order balance(s) out of date."))
+            raise SystemExit(1)
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Reconciled {len(drift)} order balance(s)."))
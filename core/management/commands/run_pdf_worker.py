@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.pdf_jobs import work
+
+
+class Command(BaseCommand):
+    help = "Render queued invoice PDFs (see core/pdf_jobs.py). Run one or more next to the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Process the jobs that are due now, then exit.",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float,
+            help="Seconds to sleep when the queue is empty (default: PDF_JOB_POLL_INTERVAL).",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("PDF worker started." if not options['once'] else "Processing due PDF jobs...")
+        try:
+            processed = work(once=options['once'], poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)."))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import perfdata
+
+# Defaults match the volumes of the performance budgets (core/tests_perf.py)
+VOLUMES = {
+    'clients': 10000,
+    'orders': 50000,
+    'materials': 2000,
+    'vendors': 100,
+    'reorders': 5000,
+    'activity': 200000,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Add synthetic clients, orders, invoices, materials, vendors, reorders and activity logs "
+        "to the configured database, for load testing. The same --seed always generates the same data."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in VOLUMES.items():
+            parser.add_argument(f'--{name}', type=int, default=default, help=f"Number of {name} (default {default}).")
+        parser.add_argument('--scale', type=float, default=1.0, help="Multiply every volume, e.g. 20 for ~1M orders.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+        parser.add_argument('--batch-size', type=int, default=perfdata.BATCH_SIZE, help="Rows per INSERT.")
+
+    def handle(self, *args, **options):
+        volumes = {name: int(options[name] * options['scale']) for name in VOLUMES}
+        if any(count < 0 for count in volumes.values()) or options['batch_size'] < 1:
+            raise CommandError("Volumes cannot be negative and --batch-size must be at least 1.")
+        self.stdout.write("Seeding " + ", ".join(f"{count} {name}" for name, count in volumes.items()))
+
+        last = {}
+
+        def progress(name, count):
+            # One line per ~100k rows keeps big runs readable
+            if options['verbosity'] >= 2 or count // 100000 > last.get(name, 0) // 100000:
+                self.stdout.write(f"  {name}: {count}")
+            last[name] = count
+
+        start = time.monotonic()
+        counts = perfdata.seed(
+            **volumes, seed=options['seed'], batch_size=options['batch_size'], progress=progress,
+        )
+        elapsed = time.monotonic() - start
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {total} rows in {elapsed:.0f}s ({total / max(elapsed, 0.001):.0f} rows/s): "
+            + ", ".join(f"{count} {name}" for name, count in counts.items())
+        ))
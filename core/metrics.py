@@ -0,0 +1,419 @@
+# core/metrics.py
+"""
+Counters and histograms for the shop's hot paths, served in the
+Prometheus text format at ``/metrics``.
+
+Updating a metric touches a dict in the current process under an
+uncontended lock; nothing is shared between processes on the hot path.
+With METRICS_DIR set (needed under a pre-forking server such as gunicorn,
+and for ``run_pdf_worker`` and the export pool), every process also writes
+a snapshot of its values to ``METRICS_DIR/metrics-<pid>-<start>.json`` at
+most every METRICS_FLUSH_INTERVAL seconds; ``/metrics`` adds up the
+snapshots of all processes, its own live values included. The start time
+in the name keeps a process that gets a reused pid from overwriting the
+snapshot of the one before it.
+
+At exit a process adds its values to ``METRICS_DIR/exited.json``, one
+total for every process that has gone, and removes its snapshot, so
+counters survive worker restarts without the directory growing. A process
+that is killed cannot do that itself: call ``mark_process_dead(pid)`` for
+it, e.g. from gunicorn's ``child_exit`` hook, as with prometheus_client.
+Without METRICS_DIR each process reports only itself.
+"""
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+# Seconds; the default for request and render latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# === VALUES ===
+
+class _Values:
+    """This process's metric values: ``{(metric name, label values): value}``"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.started = time.time_ns() // 1000000
+        self.data = {}
+        self.flushed_at = 0.0
+        self.exited = False
+
+    def _own(self):
+        # A forked child starts with its parent's values; they are already
+        # counted in the parent's snapshot
+        if self.pid != os.getpid():
+            self._start()
+        return self.data
+
+    def add(self, key, amount):
+        with self.lock:
+            data = self._own()
+            data[key] = data.get(key, 0) + amount
+        self._maybe_flush()
+
+    def observe(self, key, index, amount, size):
+        """Add one observation to bucket ``index`` of a histogram"""
+        with self.lock:
+            data = self._own()
+            buckets = data.get(key)
+            if buckets is None:
+                # One count per bucket (the last is +Inf), then the sum
+                buckets = data[key] = [0] * (size + 1)
+            buckets[index] += 1
+            buckets[-1] += amount
+        self._maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [name, list(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self._own().items()
+            ]
+
+    def clear(self):
+        with self.lock:
+            self.data = {}
+
+    def _maybe_flush(self):
+        if self.exited:
+            return
+        if time.monotonic() - self.flushed_at >= _setting('METRICS_FLUSH_INTERVAL', 1.0):
+            try:
+                flush()
+            except OSError as e:
+                # Never fail a request over its metrics
+                logger.warning("Could not write metrics snapshot: %s", e)
+
+
+_values = _Values()
+
+
+def _snapshot_path(directory):
+    with _values.lock:
+        _values._own()
+    return Path(directory) / f'metrics-{_values.pid}-{_values.started}.json'
+
+
+def _exited_path(directory):
+    return Path(directory) / 'exited.json'
+
+
+def _write(path, data):
+    # Readers only ever see a whole file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.metrics-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush():
+    """Write this process's snapshot to METRICS_DIR, if configured"""
+    directory = _setting('METRICS_DIR', None)
+    _values.flushed_at = time.monotonic()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _write(_snapshot_path(directory), _values.snapshot())
+
+
+@contextmanager
+def _exited_lock(directory, timeout=10):
+    """Serialize updates of exited.json across processes"""
+    path = Path(directory) / 'exited.lock'
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > timeout:
+                    # Left behind by a process killed while holding it
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{path} is held by another process")
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        path.unlink(missing_ok=True)
+
+
+def _read_exited(directory):
+    try:
+        return json.loads(_exited_path(directory).read_text())
+    except (OSError, ValueError):
+        return {'merged': {}, 'values': []}
+
+
+def _merge_exited(directory, snapshots):
+    """Add ``{snapshot file name: snapshot}`` to exited.json, then remove the files"""
+    with _exited_lock(directory):
+        exited = _read_exited(directory)
+        now = time.time()
+        # A name is remembered while its file exists and for a while after,
+        # so collect() can tell a snapshot it read is already in the total
+        merged = {
+            name: at for name, at in exited['merged'].items()
+            if now - at < 300 or (Path(directory) / name).exists()
+        }
+        totals = _add({}, exited['values'])
+        for name, snapshot in snapshots.items():
+            if name not in merged:
+                _add(totals, snapshot)
+                merged[name] = now
+        _write(_exited_path(directory), {'merged': merged, 'values': _as_snapshot(totals)})
+    for name in snapshots:
+        (Path(directory) / name).unlink(missing_ok=True)
+
+
+def _at_exit():
+    directory = _setting('METRICS_DIR', None)
+    if not directory:
+        return
+    _values.exited = True
+    try:
+        os.makedirs(directory, exist_ok=True)
+        _merge_exited(directory, {_snapshot_path(directory).name: _values.snapshot()})
+    except OSError as e:
+        logger.warning("Could not record metrics of exiting process: %s", e)
+
+
+atexit.register(_at_exit)
+
+
+def mark_process_dead(pid):
+    """Fold the snapshot of process ``pid``, which died without doing so itself, into exited.json"""
+    directory = _setting('METRICS_DIR', None)
+    if not directory or not os.path.isdir(directory):
+        return
+    snapshots = {}
+    for path in Path(directory).glob(f'metrics-{pid}-*.json'):
+        if path.name == _snapshot_path(directory).name:
+            continue
+        try:
+            snapshots[path.name] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+    if snapshots:
+        _merge_exited(directory, snapshots)
+
+
+def _add(totals, snapshot):
+    for name, labels, value in snapshot:
+        key = (name, tuple(labels))
+        if isinstance(value, list):
+            current = totals.setdefault(key, [0] * len(value))
+            for i, amount in enumerate(value):
+                current[i] += amount
+        else:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _as_snapshot(totals):
+    return [[name, list(labels), value] for (name, labels), value in totals.items()]
+
+
+def collect():
+    """Values of every process, added up: ``{(name, label values): value}``"""
+    totals = _add({}, _values.snapshot())
+    directory = _setting('METRICS_DIR', None)
+    if directory and os.path.isdir(directory):
+        own = _snapshot_path(directory).name
+        snapshots = {}
+        for path in Path(directory).glob('metrics-*.json'):
+            if path.name == own:
+                continue
+            try:
+                snapshots[path.name] = json.loads(path.read_text())
+            except (OSError, ValueError):
+                # Removed while listing the directory
+                continue
+        # Read after the snapshots: one merged meanwhile is in both, and
+        # listed as merged
+        exited = _read_exited(directory)
+        for name, snapshot in snapshots.items():
+            if name not in exited['merged']:
+                _add(totals, snapshot)
+        _add(totals, exited['values'])
+    return totals
+
+
+def reset():
+    """Forget every value, including other processes' snapshots (tests)"""
+    _values.clear()
+    directory = _setting('METRICS_DIR', None)
+    if directory and os.path.isdir(directory):
+        for path in Path(directory).glob('metrics-*.json'):
+            path.unlink(missing_ok=True)
+        _exited_path(directory).unlink(missing_ok=True)
+
+
+# === METRIC TYPES ===
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        try:
+            if len(labels) == len(self.labelnames):
+                return self.name, tuple([str(labels[name]) for name in self.labelnames])
+        except KeyError:
+            pass
+        raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _values.add(self._key(labels), amount)
+
+    def zero(self):
+        return 0
+
+    def samples(self, values, value):
+        yield f"{self.name}{self._labels(values)} {_number(value)}"
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        _values.observe(self._key(labels), index, value, len(self.buckets) + 1)
+
+    def zero(self):
+        return [0] * (len(self.buckets) + 2)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self, values, value):
+        *counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield f"{self.name}_bucket{self._labels(values, [('le', _number(bound))])} {_number(cumulative)}"
+        yield f"{self.name}_sum{self._labels(values)} {_number(total)}"
+        yield f"{self.name}_count{self._labels(values)} {_number(cumulative)}"
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+def exposition():
+    """Every metric in the Prometheus text format (version 0.0.4)"""
+    values = collect()
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        samples = sorted((labels, value) for (name, labels), value in values.items() if name == metric.name)
+        if not samples and not metric.labelnames:
+            # Unlabelled metrics are reported from the start, at zero
+            samples = [((), metric.zero())]
+        for labels, value in samples:
+            lines.extend(metric.samples(labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+# === SHOP METRICS ===
+
+REQUEST_SECONDS = Histogram(
+    'shop_http_request_duration_seconds', "Time to answer a request, by view.", ['view', 'method'],
+)
+REQUESTS = Counter(
+    'shop_http_requests_total', "Requests answered, by view and status code.", ['view', 'method', 'status'],
+)
+PDF_RENDER_SECONDS = Histogram(
+    'shop_pdf_render_seconds', "Invoice PDF render time (worker, export pool or inline).", ['result'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+PDF_DOWNLOADS = Counter(
+    'shop_pdf_downloads_total', "Invoice PDF download requests, by how they were answered.", ['result'],
+)
+PAYMENTS = Counter(
+    'shop_payments_recorded_total', "Payment recordings on the finance dashboard.", ['result'],
+)
+PAYMENT_AMOUNT = Counter(
+    'shop_payment_amount_recorded_total', "Sum of the paid amounts recorded on the finance dashboard.",
+)
+REORDERS = Counter(
+    'shop_reorders_created_total', "Reorders placed from the reorder dashboard.",
+)
+SEARCH_SECONDS = Histogram(
+    'shop_client_search_seconds', "Client typeahead lookup time.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+LOGINS = Counter(
+    'shop_login_attempts_total', "Login attempts on admin_login, by outcome.", ['result'],
+)
+
+
+class MetricsMiddleware:
+    """Per-view latency and status counts; listed first in MIDDLEWARE"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match else '(unmatched)'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        return response
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 11:15
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_client_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to='avatars/'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 11:21
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def highest_order_number(Order):
+    """Largest number already used by ``ORD-<n>`` ids (or pks, which the old scheme followed)"""
+    highest = Order.objects.aggregate(Max('id'))['id__max'] or 0
+    for order_id in Order.objects.filter(order_id__startswith='ORD-').values_list('order_id', flat=True).iterator():
+        suffix = order_id[len('ORD-'):]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+
+def seed_order_sequence(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    Sequence = apps.get_model('core', 'Sequence')
+    Sequence.objects.update_or_create(name='order_id', defaults={'last_value': highest_order_number(Order)})
+
+
+def remove_order_sequence(apps, schema_editor):
+    apps.get_model('core', 'Sequence').objects.filter(name='order_id').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_pdfjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_order_sequence, remove_order_sequence),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 11:23
+
+import re
+
+from django.db import migrations
+
+INVOICE_ID_RE = re.compile(r'^(?P<prefix>.+)-(?P<year>\d{4})-(?P<number>\d+)$')
+
+
+def seed_invoice_sequences(apps, schema_editor):
+    """One sequence per prefix and year, past the highest number in use (compared as numbers)"""
+    Invoice = apps.get_model('core', 'Invoice')
+    Sequence = apps.get_model('core', 'Sequence')
+    highest = {}
+    for invoice_id in Invoice.objects.values_list('invoice_id', flat=True).iterator():
+        match = INVOICE_ID_RE.match(invoice_id)
+        if match:
+            name = f"invoice_id:{match['prefix']}-{match['year']}"
+            highest[name] = max(highest.get(name, 0), int(match['number']))
+    for name, last_value in highest.items():
+        Sequence.objects.update_or_create(name=name, defaults={'last_value': last_value})
+
+
+def remove_invoice_sequences(apps, schema_editor):
+    apps.get_model('core', 'Sequence').objects.filter(name__startswith='invoice_id:').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_order_id_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_invoice_sequences, remove_invoice_sequences),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 6.0 on 2026-10-18 11:40
+
+from django.db import DatabaseError, migrations
+
+# Self-contained: the FTS tables and their rows as core/search.py defined
+# them when this migration was written
+TABLES = {
+    'Client': 'core_search_client',
+    'Order': 'core_search_order',
+    'Material': 'core_search_material',
+}
+INSERT = "INSERT INTO {} (rowid, name, secondary, related) VALUES (%s, %s, %s, %s)"
+
+
+def documents(apps, name):
+    model = apps.get_model('core', name)
+    if name == 'Client':
+        for pk, client_name, company, email in model.objects.values_list('pk', 'name', 'company', 'email').iterator():
+            yield pk, client_name, company or '', email or ''
+    elif name == 'Order':
+        rows = model.objects.values_list('pk', 'order_id', 'fabric_type', 'client__name').iterator()
+        for pk, order_id, fabric_type, client_name in rows:
+            order_id = order_id or ''
+            number = order_id.rpartition('-')[2].lstrip('0')
+            yield pk, f"{order_id} {number}", fabric_type or '', client_name
+    else:
+        for pk, material_name, description in model.objects.values_list('pk', 'name', 'description').iterator():
+            yield pk, material_name, description or '', ''
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        for table in TABLES.values():
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+                f"USING fts5(name, secondary, related, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+    except DatabaseError:
+        # SQLite compiled without FTS5: the views keep their LIKE filters
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name, table in TABLES.items():
+            batch = []
+            for row in documents(apps, name):
+                batch.append(row)
+                if len(batch) == 2000:
+                    cursor.executemany(INSERT.format(table), batch)
+                    batch = []
+            cursor.executemany(INSERT.format(table), batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for table in TABLES.values():
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 6.0 on 2026-10-18 11:34
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+
+
+def fill_ledger(apps, schema_editor):
+    """paid_amount was never maintained; compute all three columns from the invoices"""
+    Order = apps.get_model('core', 'Order')
+    Invoice = apps.get_model('core', 'Invoice')
+    invoices = (
+        Invoice.objects.filter(order=OuterRef('pk'))
+        .order_by()
+        .values('order')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    Order.objects.update(paid_amount=Coalesce(
+        Subquery(invoices), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2),
+    ))
+    remaining = F('payment') - F('paid_amount')
+    Order.objects.update(
+        remaining_amount=remaining,
+        payment_state=Case(
+            When(LessThanOrEqual(remaining, 0), then=Value('paid')),
+            When(GreaterThan(F('paid_amount'), 0), then=Value('partial')),
+            default=Value('pending'),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('partial', 'Partial'), ('paid', 'Paid')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='remaining_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='paid_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_state', 'created_at', 'id'], name='order_payment_created_id_idx'),
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
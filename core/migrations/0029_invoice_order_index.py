@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_order_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['order', 'created_at', 'id'], name='invoice_order_created_id_idx'),
+        ),
+    ]
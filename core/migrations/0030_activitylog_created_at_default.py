@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 12:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_invoice_order_index'),
+    ]
+
+    # The column is unchanged (defaults live in Python), so only the state
+    # is altered; SQLite would otherwise copy the whole activity table
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='activitylog',
+                    name='created_at',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
@@ -1,8 +1,14 @@
 # core/models.py
 from django.db import models
 from django.utils import timezone
-from django.db.models import Max
+from django.core.files.storage import default_storage
+from django.urls import reverse
 import hashlib
+import re
+
+from .avatars import VARIANTS, variant_name
+from .sequences import allocate, next_value
+from .storage import avatar_storage
 
 # core/models.py
 
@@ -30,7 +36,9 @@ class ActivityLog(models.Model):
     activity_type = models.CharField(max_length=50, choices=ACTIVITY_TYPES)
     description = models.TextField()
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # When the activity happened, not when the batched writer got to it
+    # (core/activity.py)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     
     # Optional: Store related object IDs for linking
     client_id = models.IntegerField(null=True, blank=True)
@@ -41,6 +49,29 @@ class ActivityLog(models.Model):
     def __str__(self):
         return f"{self.get_activity_type_display()} - {self.description}"
 
+    class Meta:
+        indexes = [
+            # "Recent activity" on the home page
+            models.Index(fields=['created_at'], name='activity_created_idx'),
+        ]
+
+class ActivityRollup(models.Model):
+    """
+    Number of ActivityLog entries per day and type, kept for entries that
+    were moved to the archive (core/activity_archive.py)
+    """
+    day = models.DateField()
+    activity_type = models.CharField(max_length=50)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'activity_type'], name='activity_rollup_day_type_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.activity_type}: {self.count}"
+
 class Vendor(models.Model):
     name = models.CharField(max_length=200, unique=True)
     contact_person = models.CharField(max, max_length=200, blank=True)
@@ -58,8 +89,28 @@ class Client(models.Model):
     phone = models.CharField(max_length=15, blank=True)
     company = models.CharField(max_length=100, blank=True)
     is_active = models.BooleanField(default=True)
-    avatar = models.ImageField(upload_to='avatars/' , blank=True , null=True)
+    avatar = models.ImageField(upload_to='avatars/' , storage=avatar_storage, blank=True , null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    def avatar_variant_url(self, fmt='jpeg'):
+        """URL of a small avatar variant ('jpeg' or 'webp', see core/avatars.py)"""
+        if not self.avatar or fmt not in VARIANTS:
+            return ''
+        name = variant_name(self.avatar.name, fmt)
+        if default_storage.exists(name):
+            return default_storage.url(name)
+        # Not rendered yet (uploaded before thumbnails existed): the view
+        # renders it on first request. The version changes with the file.
+        version = hashlib.md5(self.avatar.name.encode()).hexdigest()[:8]
+        return f"{reverse('client_avatar', args=[self.id])}?format={fmt}&v={version}"
+
+    @property
+    def avatar_thumbnail_url(self):
+        return self.avatar_variant_url('jpeg')
+
+    @property
+    def avatar_thumbnail_webp_url(self):
+        return self.avatar_variant_url('webp')
     
     def get_initials(self):
         """Get initials for avatar (e.g., 'John Doe' → 'JD')"""
@@ -93,8 +144,28 @@ class Client(models.Model):
             b = max(0, b - 60)
             
         return f"#{r:02x}{g:02x}{b:02x}"
+
+    class Meta:
+        indexes = [
+            # Cursor for the paginated client table (newest first)
+            models.Index(fields=['created_at', 'id'], name='client_created_id_idx'),
+            # ...filtered by the active/inactive dropdown
+            models.Index(fields=['is_active', 'created_at', 'id'], name='client_active_created_id_idx'),
+        ]
     
 class Order(models.Model):
+    ORDER_SEQUENCE = 'order_id'
+
+    PAYMENT_PENDING = 'pending'
+    PAYMENT_PARTIAL = 'partial'
+    PAYMENT_PAID = 'paid'
+    PAYMENT_STATE_CHOICES = [
+        (PAYMENT_PENDING, 'Pending'),
+        (PAYMENT_PARTIAL, 'Partial'),
+        (PAYMENT_PAID, 'Paid'),
+    ]
+    LEDGER_FIELDS = ('paid_amount', 'remaining_amount', 'payment_state')
+
     STATUS_CHOICES = [
         ('sample_preparing', 'Sample Preparing'),
         ('production_starts', 'Production Starts'),
@@ -111,7 +182,12 @@ class Order(models.Model):
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='sample_preparing')
     created_at = models.DateTimeField(auto_now_add=True)
     due_date = models.DateField(blank=True, null=True) 
-    paid_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Payment ledger, maintained from the invoices by core/ledger.py
+    paid_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    remaining_amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, editable=False)
+    payment_state = models.CharField(
+        max_length=10, choices=PAYMENT_STATE_CHOICES, default=PAYMENT_PENDING, editable=False,
+    )
     payment_method = models.CharField(
         max_length=20,
         choices=[
@@ -124,22 +200,55 @@ class Order(models.Model):
         default='bank_transfer'
     )
     
-    @property
-    def remaining_amount(self):
-        return self.payment - self.paid_amount
-    
-    
     def save(self, *args, **kwargs):
         if not self.order_id:
             # Generate order ID like ORD-1001
-            last_order = Order.objects.order_by('-id').first()
-            next_id = 1 if not last_order else last_order.id + 1
-            self.order_id = f"ORD-{next_id:04d}"
+            self.order_id = self.format_order_id(next_value(self.ORDER_SEQUENCE))
+        if self._state.adding:
+            self.remaining_amount = None if self.payment is None else self.payment - self.paid_amount
+            self.payment_state = self.payment_state_for(self.payment, self.paid_amount)
+        elif kwargs.get('update_fields') is None:
+            # The ledger columns may have moved since this instance was
+            # loaded; never write a stale copy back over them
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.LEDGER_FIELDS
+            ]
         super().save(*args, **kwargs)
 
+    @classmethod
+    def payment_state_for(cls, payment, paid):
+        """pending / partial / paid for an order of ``payment`` with ``paid`` received"""
+        if payment is not None and payment - paid <= 0:
+            return cls.PAYMENT_PAID
+        if paid > 0:
+            return cls.PAYMENT_PARTIAL
+        return cls.PAYMENT_PENDING
+
+    @staticmethod
+    def format_order_id(number):
+        return f"ORD-{number:04d}"
+
+    @classmethod
+    def assign_order_ids(cls, orders):
+        """Give unsaved ``orders`` their ids with one allocation (for bulk_create)"""
+        orders = [order for order in orders if not order.order_id]
+        for order, number in zip(orders, allocate(cls.ORDER_SEQUENCE, len(orders))):
+            order.order_id = cls.format_order_id(number)
+
     def __str__(self):
         return f"{self.order_id} - {self.client.name}"
 
+    class Meta:
+        indexes = [
+            # Cursor for the paginated order table (newest first), unfiltered
+            # and with the status dropdown set
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='order_status_created_id_idx'),
+            # Finance list, filtered by payment state
+            models.Index(fields=['payment_state', 'created_at', 'id'], name='order_payment_created_id_idx'),
+        ]
+
 class VendorBill(models.Model):
     vendor_name = models.CharField(max_length=100)
     amount = models.FloatField()
@@ -161,6 +270,18 @@ class Material(models.Model):
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # Inventory stock filters (quantity = 0 / > 0)
+            models.Index(fields=['quantity'], name='material_quantity_idx'),
+            # Reorder dashboard: only the rows at or below their threshold,
+            # already sorted by quantity
+            models.Index(
+                fields=['quantity'], name='material_reorder_idx',
+                condition=models.Q(quantity__lte=models.F('threshold')),
+            ),
+        ]
+
 class Reorder(models.Model):
     material = models.ForeignKey(Material, on_delete=models.CASCADE)
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
@@ -181,8 +302,16 @@ class Reorder(models.Model):
     def __str__(self):
         return f"{self.material.name} - {self.quantity} {self.material.unit} (Status: {self.status})"
 
+    class Meta:
+        indexes = [
+            # Open reorders by expected delivery
+            models.Index(fields=['status', 'delivery_date'], name='reorder_status_delivery_idx'),
+        ]
+
 class Invoice(models.Model):
     INVOICE_PREFIX = "INV"
+    # INV-2026-007; the number is not capped at three digits
+    INVOICE_ID_RE = re.compile(r'^(?P<prefix>.+)-(?P<year>\d{4})-(?P<number>\d+)$')
 
     # Core fields
     invoice_id = models.CharField(max_length=50, unique=True, editable=False)
@@ -216,22 +345,104 @@ class Invoice(models.Model):
             self.order_total = self.order.payment
         super().save(*args, **kwargs)
 
+    @classmethod
+    def invoice_sequence(cls, year, prefix=None):
+        """Name of the ``Sequence`` numbering ``<prefix>-<year>-NNN`` ids"""
+        return f"invoice_id:{prefix or cls.INVOICE_PREFIX}-{year}"
+
+    @classmethod
+    def format_invoice_id(cls, year, number, prefix=None):
+        return f"{prefix or cls.INVOICE_PREFIX}-{year}-{number:03d}"
+
     def generate_invoice_id(self):
-        year = timezone.now().year
-        last_invoice = Invoice.objects.filter(
-            invoice_id__startswith=f"{self.INVOICE_PREFIX}-{year}-"
-        ).aggregate(Max('invoice_id'))['invoice_id__max']
-        
-        if last_invoice:
-            last_num = int(last_invoice.split('-')[-1])
-            next_num = last_num + 1
-        else:
-            next_num = 1
-        
-        return f"{self.INVOICE_PREFIX}-{year}-{next_num:03d}"
+        year = (self.created_at or timezone.now()).year
+        return self.format_invoice_id(year, next_value(self.invoice_sequence(year)))
+
+    @classmethod
+    def assign_invoice_ids(cls, invoices):
+        """Number unsaved ``invoices`` with one allocation per year (for bulk_create)"""
+        by_year = {}
+        for invoice in invoices:
+            if not invoice.invoice_id:
+                year = (invoice.created_at or timezone.now()).year
+                by_year.setdefault(year, []).append(invoice)
+        for year, batch in by_year.items():
+            for invoice, number in zip(batch, allocate(cls.invoice_sequence(year), len(batch))):
+                invoice.invoice_id = cls.format_invoice_id(year, number)
 
     def __str__(self):
         return self.invoice_id
 
     class Meta:
-        ordering = ['-created_at']  
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            # Default ordering and the bulk export's date range
+            models.Index(fields=['created_at', 'id'], name='invoice_created_id_idx'),
+            # Newest invoice of an order (finance list's invoice link)
+            models.Index(fields=['order', 'created_at', 'id'], name='invoice_order_created_id_idx'),
+        ]
+
+
+class KPICounter(models.Model):
+    """
+    Materialized dashboard count, kept current by the signal handlers in
+    core/signals.py. See core/counters.py for the counter definitions.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class Sequence(models.Model):
+    """
+    Named counter handing out human-facing numbers (``ORD-0042``); see
+    core/sequences.py. ``last_value`` is the last number given out.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_value}"
+
+
+class PDFJob(models.Model):
+    """
+    Queued invoice PDF render, picked up by ``manage.py run_pdf_worker``.
+    The PDF itself lands in the PDF cache (core/pdf_cache.py) under
+    ``cache_key``; see core/pdf_jobs.py.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    invoice = models.ForeignKey('Invoice', on_delete=models.CASCADE, related_name='pdf_jobs')
+    status = models.CharField(
+        max_length=10,
+        choices=[
+            (QUEUED, 'Queued'),
+            (RUNNING, 'Running'),
+            (DONE, 'Done'),
+            (FAILED, 'Failed'),
+        ],
+        default=QUEUED,
+    )
+    base_url = models.CharField(max_length=500, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    cache_key = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's "next job" lookup
+            models.Index(fields=['status', 'run_after'], name='pdfjob_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"PDF job {self.pk} for invoice {self.invoice_id} ({self.status})"
@@ -0,0 +1,112 @@
+# core/pagination.py
+"""
+Keyset ("seek") pagination for the dashboard tables.
+
+Instead of OFFSET, each page remembers the sort key of its last row in an
+opaque cursor and the next page asks for rows strictly after it. Cost per
+page stays flat however deep the user scrolls, and rows inserted meanwhile
+do not shift later pages.
+
+Searches ranked by the FTS index (core/search.py) annotate a ``relevance``
+and page on it first, best match first; ``sort_fields()`` picks the key.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+NEWEST = ('created_at', 'id')
+RANKED = ('relevance', 'created_at', 'id')
+
+
+def get_page_size(request):
+    """``?page_size=`` from the request, clamped to the configured limits"""
+    default = getattr(settings, 'DASHBOARD_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'DASHBOARD_MAX_PAGE_SIZE', 200)
+    try:
+        size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+def encode_cursor(obj, fields):
+    values = [getattr(obj, name) for name in fields]
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, model, fields):
+    """Cursor -> list of field values, or ``None`` if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(fields):
+            return None
+        return [_to_python(model, name, v) for name, v in zip(fields, values)]
+    except (binascii.Error, ValueError, ValidationError):
+        return None
+
+
+def _to_python(model, name, value):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # An annotation: the search relevance, a number
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Bad {name} in cursor")
+        return value
+    return field.to_python(value)
+
+
+def sort_fields(queryset):
+    """Keyset fields for ``queryset``: best match first if it is ranked, else newest"""
+    return RANKED if 'relevance' in queryset.query.annotations else NEWEST
+
+
+def _after(fields, values):
+    """Rows that sort after ``values`` in descending ``fields`` order"""
+    condition = Q()
+    for i, name in enumerate(fields):
+        step = Q(**{f'{name}__lt': values[i]})
+        for prev, value in zip(fields[:i], values[:i]):
+            step &= Q(**{prev: value})
+        condition |= step
+    return condition
+
+
+def keyset_page(queryset, cursor=None, page_size=50, fields=NEWEST):
+    """
+    One page of ``queryset``, in descending ``fields`` order (newest first
+    by default).
+
+    ``cursor`` is the ``next_cursor`` of the previous page (``None`` for the
+    first page). Raises ``ValueError`` for a cursor that cannot be decoded.
+    """
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, fields)
+        if values is None:
+            raise ValueError("Invalid page cursor")
+        queryset = queryset.filter(_after(fields, values))
+
+    queryset = queryset.order_by(*[f'-{name}' for name in fields])
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1], fields)
+    return Page(items, next_cursor)
+
+
+def page_query(request, cursor):
+    """The current query string (filters, page size) pointing at ``cursor``"""
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return params.urlencode()
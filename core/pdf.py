@@ -0,0 +1,149 @@
+# core/pdf.py
+"""
+HTML -> PDF rendering for invoices.
+
+``get_renderer()`` returns a process-wide renderer chosen by the
+``PDF_RENDERER`` setting (a dotted path to a ``PDFRenderer`` subclass).
+Left unset, it renders in-process with the WeasyPrint library when that is
+installed and falls back to running the ``weasyprint`` command otherwise.
+Either way everything stays in memory: no temp files.
+"""
+import shutil
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .metrics import PDF_RENDER_SECONDS
+
+
+class PDFRenderError(Exception):
+    """The renderer is unavailable or failed on this document"""
+
+
+class PDFRenderer:
+    def render(self, html, base_url=None):
+        """Return the PDF for ``html`` as bytes; raise ``PDFRenderError``"""
+        raise NotImplementedError
+
+
+class WeasyPrintRenderer(PDFRenderer):
+    """
+    In-process WeasyPrint, kept warm between requests: the library and its
+    font configuration are loaded once, and remote stylesheets (the invoice
+    template pulls Bootstrap from a CDN) are fetched once per process.
+    """
+
+    def __init__(self):
+        try:
+            import weasyprint
+            from weasyprint.text.fonts import FontConfiguration
+        except (ImportError, OSError) as e:
+            # OSError: installed, but its system libraries (Pango) are missing
+            raise PDFRenderError(f"WeasyPrint is not usable: {e}") from e
+        self._weasyprint = weasyprint
+        self._font_config = FontConfiguration()
+        self._resources = {}
+        # Font configuration and the resource cache are shared state
+        self._lock = threading.Lock()
+
+    def _fetch(self, url, *args, **kwargs):
+        if not url.startswith(('http://', 'https://')):
+            return self._weasyprint.default_url_fetcher(url, *args, **kwargs)
+        if url not in self._resources:
+            resource = self._weasyprint.default_url_fetcher(url, *args, **kwargs)
+            if 'file_obj' in resource:
+                resource['string'] = resource.pop('file_obj').read()
+            self._resources[url] = resource
+        return dict(self._resources[url])
+
+    def render(self, html, base_url=None):
+        with self._lock:
+            try:
+                document = self._weasyprint.HTML(string=html, base_url=base_url, url_fetcher=self._fetch)
+                return document.write_pdf(font_config=self._font_config)
+            except Exception as e:
+                raise PDFRenderError(f"WeasyPrint failed: {e}") from e
+
+
+class SubprocessRenderer(PDFRenderer):
+    """
+    Runs the ``weasyprint`` command (``WEASYPRINT_BINARY``), piping HTML in
+    on stdin and reading the PDF from stdout.
+    """
+
+    def __init__(self, binary=None, timeout=None):
+        self.binary = binary or getattr(settings, 'WEASYPRINT_BINARY', 'weasyprint')
+        self.timeout = timeout or getattr(settings, 'PDF_RENDER_TIMEOUT', 30)
+
+    def render(self, html, base_url=None):
+        binary = shutil.which(self.binary)
+        if binary is None:
+            raise PDFRenderError(f"WeasyPrint executable not found: {self.binary}")
+
+        command = [binary, '-', '-']
+        if base_url:
+            command += ['--base-url', base_url]
+        try:
+            result = subprocess.run(command, input=html.encode('utf-8'), capture_output=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired as e:
+            raise PDFRenderError("PDF generation timed out.") from e
+        if result.returncode != 0:
+            raise PDFRenderError(result.stderr.decode('utf-8', 'replace').strip() or "WeasyPrint failed")
+        return result.stdout
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = _build_renderer()
+    return _renderer
+
+
+def _build_renderer():
+    path = getattr(settings, 'PDF_RENDERER', None)
+    if path:
+        return import_string(path)()
+    try:
+        return WeasyPrintRenderer()
+    except PDFRenderError:
+        return SubprocessRenderer()
+
+
+@receiver(setting_changed)
+def _reset_renderer(setting, **kwargs):
+    global _renderer
+    if setting in ('PDF_RENDERER', 'WEASYPRINT_BINARY', 'PDF_RENDER_TIMEOUT'):
+        _renderer = None
+
+
+def render_pdf(html, base_url=None):
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        pdf = get_renderer().render(html, base_url=base_url)
+        result = 'ok'
+        return pdf
+    finally:
+        PDF_RENDER_SECONDS.observe(time.perf_counter() - start, result=result)
+
+
+def setup_worker(renderer=None):
+    """
+    Process pool initializer for rendering in spawned worker processes;
+    ``renderer`` is the parent's PDF_RENDERER
+    """
+    import django
+    django.setup()
+    if renderer:
+        settings.PDF_RENDERER = renderer
@@ -0,0 +1,64 @@
+# core/pdf_cache.py
+"""
+On-disk cache of rendered invoice PDFs.
+
+An entry is keyed by the SHA-256 of the invoice HTML it was rendered from,
+so anything that changes what the PDF would show (amount, payments on the
+order, template edits) changes the key and can never serve a stale file.
+Entries are grouped per order under ``PDF_CACHE_DIR/<order pk>/`` because a
+payment on one invoice changes the "paid"/"remaining" figures printed on
+every invoice of that order; ``invalidate_order()`` drops them all.
+
+The key doubles as the response ETag.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+
+
+def cache_key(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def _order_dir(order_id):
+    return Path(settings.PDF_CACHE_DIR) / str(order_id)
+
+
+def _path(invoice, key):
+    return _order_dir(invoice.order_id) / f"{invoice.pk}-{key}.pdf"
+
+
+def get(invoice, key):
+    """Return ``(pdf_bytes, rendered_at)`` or None on a miss"""
+    path = _path(invoice, key)
+    try:
+        data = path.read_bytes()
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    return data, datetime.fromtimestamp(mtime, tz=dt_timezone.utc)
+
+
+def put(invoice, key, data):
+    """Store a rendered PDF, replacing older renders of the same invoice"""
+    directory = _order_dir(invoice.order_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    for stale in directory.glob(f"{invoice.pk}-*.pdf"):
+        stale.unlink(missing_ok=True)
+
+    # Write-then-rename so a concurrent reader never sees half a PDF
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    path = _path(invoice, key)
+    os.replace(tmp, path)
+    return datetime.fromtimestamp(path.stat().st_mtime, tz=dt_timezone.utc)
+
+
+def invalidate_order(order_id):
+    shutil.rmtree(_order_dir(order_id), ignore_errors=True)
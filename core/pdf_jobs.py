@@ -0,0 +1,144 @@
+# core/pdf_jobs.py
+"""
+Database-backed queue for invoice PDF renders.
+
+``download_invoice_pdf`` no longer renders inside the request: on a cache
+miss it calls ``enqueue()`` and the browser polls ``pdf_job_status`` until
+a worker (``manage.py run_pdf_worker``) has put the PDF in the PDF cache.
+
+Workers claim jobs with a conditional UPDATE (``status='queued'`` ->
+``'running'``), so any number of them can share the queue on SQLite
+without row locks. A failed render is retried with exponential backoff up
+to ``PDF_JOB_MAX_ATTEMPTS`` times; a job left ``running`` by a worker that
+died is handed out again once ``PDF_JOB_STALE_AFTER`` seconds have passed,
+unless it has used up its attempts (a render that kills its worker every
+time), in which case it fails.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import pdf_cache
+from .invoice_pdfs import invoice_html
+from .models import PDFJob
+from .pdf import PDFRenderError, render_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(invoice, base_url=''):
+    """Queue a render of ``invoice``, reusing a job already waiting for it"""
+    job = (
+        PDFJob.objects.filter(invoice=invoice, status__in=[PDFJob.QUEUED, PDFJob.RUNNING])
+        .order_by('id')
+        .first()
+    )
+    if job is None:
+        job = PDFJob.objects.create(invoice=invoice, base_url=base_url)
+    return job
+
+
+def requeue_stale():
+    """
+    Put jobs whose worker went away back in the queue, or fail them once
+    they have had PDF_JOB_MAX_ATTEMPTS; returns how many were requeued
+    """
+    now = timezone.now()
+    stale = PDFJob.objects.filter(
+        status=PDFJob.RUNNING, started_at__lt=now - timedelta(seconds=_setting('PDF_JOB_STALE_AFTER', 300)),
+    )
+    max_attempts = _setting('PDF_JOB_MAX_ATTEMPTS', 5)
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=PDFJob.FAILED, last_error='Worker stopped while rendering', finished_at=now,
+    )
+    if failed:
+        logger.error("%d stale PDF job(s) failed for good after %d attempts", failed, max_attempts)
+    return stale.filter(attempts__lt=max_attempts).update(status=PDFJob.QUEUED)
+
+
+def claim_next():
+    """Mark the next due job as running and return it, or None"""
+    while True:
+        now = timezone.now()
+        job_id = (
+            PDFJob.objects.filter(status=PDFJob.QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        claimed = PDFJob.objects.filter(pk=job_id, status=PDFJob.QUEUED).update(
+            status=PDFJob.RUNNING, started_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return PDFJob.objects.select_related('invoice__order__client').get(pk=job_id)
+        # Another worker got there first; try the next one
+
+
+def retry_delay(attempts):
+    base = _setting('PDF_JOB_RETRY_DELAY', 10)
+    return min(base * 2 ** (attempts - 1), _setting('PDF_JOB_MAX_RETRY_DELAY', 600))
+
+
+def run_job(job):
+    invoice = job.invoice
+    html = invoice_html(invoice)
+    key = pdf_cache.cache_key(html)
+    try:
+        if pdf_cache.get(invoice, key) is None:
+            pdf_cache.put(invoice, key, render_pdf(html, base_url=job.base_url or None))
+    except PDFRenderError as e:
+        job.last_error = str(e)
+        if job.attempts >= _setting('PDF_JOB_MAX_ATTEMPTS', 5):
+            job.status = PDFJob.FAILED
+            job.finished_at = timezone.now()
+            logger.error("PDF job %s failed for good: %s", job.pk, e)
+        else:
+            job.status = PDFJob.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            logger.warning("PDF job %s failed (attempt %s), retrying: %s", job.pk, job.attempts, e)
+    else:
+        job.status = PDFJob.DONE
+        job.cache_key = key
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'cache_key', 'last_error', 'run_after', 'finished_at'])
+    return job
+
+
+def work(once=False, poll_interval=None):
+    """
+    Process jobs until stopped; with ``once``, until nothing is due.
+    Returns the number of jobs processed.
+    """
+    if poll_interval is None:
+        poll_interval = _setting('PDF_JOB_POLL_INTERVAL', 1)
+    processed = 0
+    while True:
+        requeue_stale()
+        job = claim_next()
+        if job is None:
+            if once:
+                return processed
+            # Drop connections that went bad while idle, as a request would
+            close_old_connections()
+            time.sleep(poll_interval)
+            continue
+        try:
+            run_job(job)
+        except Exception as e:
+            # Not a renderer hiccup (template error, missing data): retrying won't help
+            logger.exception("PDF job %s crashed", job.pk)
+            PDFJob.objects.filter(pk=job.pk).update(
+                status=PDFJob.FAILED, last_error=str(e), finished_at=timezone.now(),
+            )
+        processed += 1
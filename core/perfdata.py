@@ -0,0 +1,299 @@
+# core/perfdata.py
+"""
+Synthetic shop data at production-like volumes, for the performance
+budgets (core/tests_perf.py), ``manage.py seed_perf_data`` and
+benchmarking.
+
+Everything is drawn from ``random.Random(seed)``, so the same arguments
+always produce the same rows. Rows are generated lazily and written with
+``bulk_create`` one batch at a time, so millions of orders or log rows
+never sit in memory together. ``bulk_create`` skips the model signals;
+``seed()`` does their work in bulk instead:
+
+- order and invoice ids come from the ``Sequence`` generators
+  (``assign_order_ids`` / ``assign_invoice_ids``);
+- each order's ledger columns are computed from the invoices planned for it;
+- the KPI counters and the search index are rebuilt at the end, and the
+  typeahead version is bumped so running processes reload.
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters, search, typeahead
+from .models import ActivityLog, Client, Invoice, Material, Order, Reorder, Vendor
+
+BATCH_SIZE = 2000
+
+FIRST_NAMES = [
+    'Ali', 'Ayesha', 'Bilal', 'Fatima', 'Hamza', 'Hina', 'Imran', 'Kashif', 'Maryam', 'Nadia',
+    'Omar', 'Rabia', 'Saad', 'Sana', 'Tariq', 'Usman', 'Zainab', 'Zara', 'John', 'Maria',
+    'Chen', 'Priya', 'Ahmed', 'Elena', 'Lucas', 'Sofia', 'Yusuf', 'Amina', 'David', 'Leila',
+]
+LAST_NAMES = [
+    'Khan', 'Baig', 'Malik', 'Qureshi', 'Sheikh', 'Raza', 'Siddiqui', 'Chaudhry', 'Butt', 'Ansari',
+    'Smith', 'Garcia', 'Wang', 'Patel', 'Haddad', 'Rossi', 'Novak', 'Silva', 'Kim', 'Okafor',
+]
+COMPANIES = [
+    'Hamdard Textiles', 'Indus Weaving', 'Crescent Mills', 'Penta Apparel', 'Nishat Linen',
+    'Gul Fabrics', 'Sapphire Garments', 'Kohinoor Knits', 'Alkaram Studio', 'Lotus Exports',
+]
+FABRICS = ['Cotton', 'Linen', 'Silk', 'Denim', 'Polyester', 'Wool', 'Chiffon', 'Lawn', 'Khaddar', 'Velvet']
+MATERIALS = [
+    'Sulphuric Acid', 'Caustic Soda', 'Reactive Dye', 'Disperse Dye', 'Softener', 'Bleach',
+    'Starch', 'Binder', 'Wetting Agent', 'Fixing Agent', 'Enzyme', 'Soda Ash',
+]
+UNITS = ['kg', 'litre', 'drum', 'bag']
+VENDOR_WORDS = ['Chem', 'Dye', 'Textile', 'Supply', 'Trading', 'Industrial', 'Global', 'United', 'Star', 'Prime']
+PAYMENT_METHODS = ['cash', 'bank_transfer', 'credit_card', 'upi', 'other']
+# Most activity is order and payment traffic
+ACTIVITY_WEIGHTS = {
+    'client_created': 4, 'client_updated': 6, 'client_deleted': 1,
+    'order_created': 20, 'order_updated': 25, 'order_deleted': 2,
+    'payment_recorded': 18, 'material_created': 2, 'material_updated': 12,
+    'material_deleted': 1, 'reorder_created': 5, 'invoice_created': 4,
+}
+
+
+@contextmanager
+def keep_created_at(*models):
+    """Let bulk_create store the generated ``created_at`` instead of now()"""
+    fields = [model._meta.get_field('created_at') for model in models]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def _money(value):
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def _moment(rng, now, days):
+    """A random time in the last ``days`` days, recent times more likely"""
+    return now - timedelta(days=days * rng.random() ** 1.5, seconds=rng.randrange(86400))
+
+
+# === GENERATORS ===
+# Each yields unsaved rows; seed() inserts them batch by batch.
+
+def make_clients(rng, count, now):
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield Client(
+            name=f"{first} {last}",
+            email=f"{first}.{last}{i}@example.com".lower() if rng.random() < 0.9 else None,
+            phone=f"03{rng.randrange(10**9):09d}",
+            company=rng.choice(COMPANIES) if rng.random() < 0.6 else '',
+            is_active=rng.random() < 0.85,
+            created_at=_moment(rng, now, 3 * 365),
+        )
+
+
+def make_orders(rng, clients, count, now):
+    """``(order, [invoice, ...])`` pairs; ``clients`` are saved Client rows"""
+    # A few big customers place most of the orders
+    weights = [rng.paretovariate(1.2) for _ in clients]
+    statuses = [choice for choice, _ in Order.STATUS_CHOICES]
+    for client in rng.choices(clients, weights, k=count):
+        age = (now - client.created_at).days
+        created_at = _moment(rng, now, max(age, 1))
+        if (now - created_at).days > 90:
+            status = rng.choices(['completed', 'shipped'], [9, 1])[0]
+        else:
+            status = rng.choice(statuses)
+        payment = _money(rng.lognormvariate(7, 0.8))
+        order = Order(
+            client=client,
+            fabric_type=rng.choice(FABRICS),
+            quantity=rng.randrange(50, 5000, 50),
+            payment=payment,
+            status=status,
+            created_at=created_at,
+            due_date=(created_at + timedelta(days=rng.randrange(14, 90))).date(),
+            payment_method=rng.choice(PAYMENT_METHODS),
+        )
+
+        # Finished orders are mostly settled, fresh ones mostly not yet
+        settled = 0.85 if status == 'completed' else 0.3
+        share = 1 if rng.random() < settled else rng.choice([0, 0, 0.25, 0.5, 0.75])
+        invoices = []
+        remaining = _money(payment * Decimal(share))
+        parts = rng.choice([1, 1, 2, 3]) if remaining else 0
+        for part in range(parts):
+            amount = remaining if part == parts - 1 else _money(remaining / (parts - part))
+            remaining -= amount
+            invoices.append(Invoice(
+                amount=amount,
+                payment_method=rng.choice(PAYMENT_METHODS),
+                created_at=min(created_at + timedelta(days=rng.randrange(0, 60)), now),
+                client_name=client.name,
+                client_id=client.pk,
+                order_total=payment,
+            ))
+        paid = sum((invoice.amount for invoice in invoices), Decimal('0'))
+        order.paid_amount = paid
+        order.remaining_amount = payment - paid
+        order.payment_state = Order.payment_state_for(payment, paid)
+        yield order, invoices
+
+
+def make_materials(rng, count):
+    for i in range(count):
+        threshold = _money(rng.choice([50, 100, 200, 500]))
+        roll = rng.random()
+        if roll < 0.05:
+            quantity = _money(0)
+        elif roll < 0.25:
+            quantity = _money(float(threshold) * rng.random())
+        else:
+            quantity = _money(float(threshold) * rng.uniform(1, 10))
+        yield Material(
+            name=f"{rng.choice(MATERIALS)} {i + 1}",
+            description=f"Grade {rng.choice('ABC')} {rng.choice(UNITS)} stock",
+            quantity=quantity,
+            threshold=threshold,
+            unit=rng.choice(UNITS),
+        )
+
+
+def make_vendors(rng, count, now, first=1):
+    """Vendors numbered from ``first`` (names are unique)"""
+    for number in range(first, first + count):
+        name = f"{rng.choice(VENDOR_WORDS)} {rng.choice(VENDOR_WORDS)} {number}"
+        yield Vendor(
+            name=name,
+            contact_person=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            email=f"sales{number}@vendor.example.com",
+            phone=f"042{rng.randrange(10**8):08d}",
+            created_at=_moment(rng, now, 3 * 365),
+        )
+
+
+def make_reorders(rng, count, now, materials, links):
+    """Reorders of ``materials`` from one of their linked vendors"""
+    vendors_of = {}
+    for link in links:
+        vendors_of.setdefault(link.material_id, []).append(link.vendor_id)
+    linked = [material for material in materials if material.pk in vendors_of]
+    for _ in range(count if linked else 0):
+        material = rng.choice(linked)
+        created_at = _moment(rng, now, 365)
+        delivery = created_at + timedelta(days=rng.randrange(3, 45))
+        if delivery > now:
+            status = rng.choice(['pending', 'pending', 'shipped'])
+        else:
+            status = rng.choices(['received', 'shipped', 'pending'], [8, 1, 1])[0]
+        yield Reorder(
+            material_id=material.pk,
+            vendor_id=rng.choice(vendors_of[material.pk]),
+            quantity=_money(float(material.threshold) * rng.uniform(1, 5)),
+            delivery_date=delivery.date(),
+            status=status,
+            created_at=created_at,
+        )
+
+
+def make_activity(rng, count, now, clients, orders, materials):
+    """Log rows; ``orders`` are ``(pk, order_id)`` pairs"""
+    types, weights = zip(*ACTIVITY_WEIGHTS.items())
+    for activity_type in rng.choices(types, weights, k=count):
+        log = ActivityLog(activity_type=activity_type, created_at=_moment(rng, now, 365))
+        subject, _, verb = activity_type.partition('_')
+        label = activity_type.replace('_', ' ').capitalize()
+        if subject == 'client' and clients:
+            client = rng.choice(clients)
+            log.client_id = client.pk
+            log.description = f"Client {client.name} {verb}"
+        elif subject in ('order', 'payment', 'invoice') and orders:
+            log.order_id, order_id = rng.choice(orders)
+            log.description = f"{label} for order #{order_id}"
+        elif subject in ('material', 'reorder') and materials:
+            material = rng.choice(materials)
+            log.material_id = material.pk
+            log.description = f"{label}: {material.name}"
+        else:
+            log.description = label
+        yield log
+
+
+# === LOADING ===
+
+def insert(model, rows, batch_size=BATCH_SIZE):
+    """``bulk_create`` an iterable of rows batch by batch; yields the saved batches"""
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield model.objects.bulk_create(batch)
+
+
+def seed(clients=10000, orders=50000, materials=2000, vendors=100, reorders=5000,
+         activity=200000, seed=0, batch_size=BATCH_SIZE, progress=None):
+    """
+    Insert the given volumes of synthetic data; returns the row counts.
+    ``progress(model name, rows so far)`` is called after every batch.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    report = progress or (lambda name, count: None)
+    counts = dict.fromkeys(['clients', 'orders', 'invoices', 'materials', 'vendors', 'reorders', 'activity'], 0)
+
+    def load(name, model, rows, keep=None):
+        for batch in insert(model, rows, batch_size):
+            counts[name] += len(batch)
+            if keep is not None:
+                keep.extend(batch)
+            report(name, counts[name])
+
+    with transaction.atomic(), keep_created_at(Client, Order, Vendor, Reorder, ActivityLog):
+        client_rows = []
+        load('clients', Client, make_clients(rng, clients, now), keep=client_rows)
+
+        # Order ids are allocated per batch, invoice ids per batch and year
+        order_refs = []
+        planned = make_orders(rng, client_rows, orders, now) if client_rows else iter(())
+        while chunk := list(islice(planned, batch_size)):
+            order_rows = [order for order, _ in chunk]
+            Order.assign_order_ids(order_rows)
+            Order.objects.bulk_create(order_rows)
+            invoice_rows = []
+            for order, invoices in chunk:
+                for invoice in invoices:
+                    invoice.order = order
+                    invoice.order_id_display = order.order_id
+                invoice_rows.extend(invoices)
+            Invoice.assign_invoice_ids(invoice_rows)
+            load('invoices', Invoice, invoice_rows)
+            order_refs.extend((order.pk, order.order_id) for order in order_rows)
+            counts['orders'] = len(order_refs)
+            report('orders', counts['orders'])
+
+        material_rows, vendor_rows = [], []
+        load('materials', Material, make_materials(rng, materials), keep=material_rows)
+        first = (Vendor.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        load('vendors', Vendor, make_vendors(rng, vendors, now, first), keep=vendor_rows)
+        links = []
+        if vendor_rows:
+            Link = Material.vendors.through
+            for material in material_rows:
+                for vendor in rng.sample(vendor_rows, min(len(vendor_rows), rng.randint(1, 3))):
+                    links.append(Link(material_id=material.pk, vendor_id=vendor.pk))
+            Link.objects.bulk_create(links, batch_size=batch_size)
+        load('reorders', Reorder, make_reorders(rng, reorders, now, material_rows, links))
+        load('activity', ActivityLog, make_activity(rng, activity, now, client_rows, order_refs, material_rows))
+
+        # What the skipped signal handlers would have done
+        counters.rebuild_counters()
+        if search.available():
+            search.rebuild()
+        typeahead.bump_version()
+
+    return counts
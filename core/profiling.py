@@ -0,0 +1,237 @@
+# core/profiling.py
+"""
+Sampled per-request profiling (``ProfilingMiddleware``).
+
+For a sampled request the middleware records the SQL query count and time,
+queries that ran more than once with different parameters (the usual sign
+of an N+1), template render time and view time. They are kept in a
+rolling store that the staff-only ``/perf/`` page summarises and, for
+staff (anyone with PROFILING_SERVER_TIMING_PUBLIC), sent back as a
+``Server-Timing`` header, visible in the browser's network panel. Template
+time comes from a wrapper around ``Template.render`` that
+``install_template_timer()`` puts in place once, from CoreConfig.ready().
+
+Unsampled requests only pay for one ``random()`` call. The store is the
+PROFILING_CACHE cache alias rather than a table, so profiling never adds
+queries or write locks to the request it measures; point that alias at a
+shared backend (Redis, Memcached) to see every worker on one page, with
+the default local-memory cache each process keeps its own window.
+"""
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.backends.django import Template
+
+CURSOR_KEY = 'profiling:cursor'
+SLOT_KEY = 'profiling:slot:{}'
+# Repeated statements kept per profile, and how much of each
+REPEATED_PER_REQUEST = 5
+SQL_MAX_LENGTH = 1000
+
+_current = ContextVar('profiling_record', default=None)
+
+
+class Record:
+    """Measurements of the request being profiled"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.template_depth = 0
+        # sql -> [executions, seconds]
+        self.statements = {}
+
+    def duplicates(self):
+        """Executions beyond the first of each statement"""
+        return sum(count - 1 for count, _ in self.statements.values())
+
+    def repeated(self):
+        """``(sql, executions, ms)`` of the most repeated statements"""
+        rows = sorted(
+            ((sql, count, seconds) for sql, (count, seconds) in self.statements.items() if count > 1),
+            key=lambda row: (-row[1], -row[2]),
+        )
+        return [(sql[:SQL_MAX_LENGTH], count, round(seconds * 1000, 2)) for sql, count, seconds in rows[:REPEATED_PER_REQUEST]]
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# === COLLECTION ===
+
+def _time_query(execute, sql, params, many, context):
+    record = _current.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        record.queries += 1
+        record.db += elapsed
+        # The SQL still has its placeholders, so an N+1 shows up as one
+        # statement run many times
+        entry = record.statements.setdefault(sql, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+_template_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    record = _current.get()
+    if record is None:
+        return _template_render(self, context, request)
+    # Templates rendered from inside a template (render_to_string in a
+    # tag) are already part of the outer render's time
+    record.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _template_render(self, context, request)
+    finally:
+        record.template_depth -= 1
+        if not record.template_depth:
+            record.template += time.perf_counter() - start
+
+
+def install_template_timer():
+    """Time Django template renders (a no-op outside sampled requests)"""
+    Template.render = _timed_render
+
+
+# === STORE ===
+
+def _store():
+    return caches[_setting('PROFILING_CACHE', 'default')]
+
+
+def save(profile):
+    """Add ``profile`` to the rolling store, overwriting the oldest one"""
+    store = _store()
+    store.add(CURSOR_KEY, 0, timeout=None)
+    try:
+        position = store.incr(CURSOR_KEY)
+    except ValueError:
+        # Evicted between add() and incr()
+        store.set(CURSOR_KEY, 1, timeout=None)
+        position = 1
+    store.set(SLOT_KEY.format(position % _setting('PROFILING_KEEP', 1000)), profile, timeout=None)
+
+
+def profiles():
+    """Every profile currently in the store"""
+    keep = _setting('PROFILING_KEEP', 1000)
+    return list(_store().get_many([SLOT_KEY.format(slot) for slot in range(keep)]).values())
+
+
+def clear():
+    store = _store()
+    store.delete_many([CURSOR_KEY] + [SLOT_KEY.format(slot) for slot in range(_setting('PROFILING_KEEP', 1000))])
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def slowest_endpoints(rows, limit=20):
+    """Per-endpoint summary of ``rows``, slowest (p95 view time) first"""
+    grouped = {}
+    for profile in rows:
+        grouped.setdefault(profile['endpoint'], []).append(profile)
+    summary = []
+    for endpoint, group in grouped.items():
+        times = sorted(profile['view_ms'] for profile in group)
+        summary.append({
+            'endpoint': endpoint,
+            'requests': len(group),
+            'p50_ms': _percentile(times, 0.5),
+            'p95_ms': _percentile(times, 0.95),
+            'max_ms': times[-1],
+            'avg_queries': round(sum(profile['queries'] for profile in group) / len(group), 1),
+            'avg_db_ms': round(sum(profile['db_ms'] for profile in group) / len(group), 1),
+            'avg_template_ms': round(sum(profile['template_ms'] for profile in group) / len(group), 1),
+            'avg_duplicates': round(sum(profile['duplicates'] for profile in group) / len(group), 1),
+        })
+    summary.sort(key=lambda row: row['p95_ms'], reverse=True)
+    return summary[:limit]
+
+
+def repeated_queries(rows, limit=20):
+    """Statements that ran more than once per request, most repeated first"""
+    totals = {}
+    for profile in rows:
+        for sql, count, ms in profile['repeated']:
+            entry = totals.setdefault(sql, {'sql': sql, 'executions': 0, 'ms': 0.0, 'requests': 0, 'endpoints': set()})
+            entry['executions'] += count
+            entry['ms'] += ms
+            entry['requests'] += 1
+            entry['endpoints'].add(profile['endpoint'])
+    summary = sorted(totals.values(), key=lambda entry: (-entry['executions'], -entry['ms']))[:limit]
+    for entry in summary:
+        entry['ms'] = round(entry['ms'], 1)
+        entry['endpoints'] = sorted(entry['endpoints'])
+    return summary
+
+
+# === MIDDLEWARE ===
+
+class ProfilingMiddleware:
+    """
+    Profiles PROFILING_SAMPLE_RATE of the requests (0 disables, 1 profiles
+    everything). Listed last in MIDDLEWARE so that "view" is the view
+    itself rather than the whole middleware stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = _setting('PROFILING_SAMPLE_RATE', 0)
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        record = Record()
+        token = _current.set(record)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                start = time.perf_counter()
+                response = self.get_response(request)
+                view = time.perf_counter() - start
+        finally:
+            _current.reset(token)
+
+        match = request.resolver_match
+        profile = {
+            'endpoint': match.view_name if match else '(unmatched)',
+            'method': request.method,
+            'status': response.status_code,
+            'at': time.time(),
+            'view_ms': round(view * 1000, 2),
+            'db_ms': round(record.db * 1000, 2),
+            'template_ms': round(record.template * 1000, 2),
+            'queries': record.queries,
+            'duplicates': record.duplicates(),
+            'repeated': record.repeated(),
+        }
+        user = getattr(request, 'user', None)
+        if _setting('PROFILING_SERVER_TIMING_PUBLIC', False) or (user is not None and user.is_staff):
+            response['Server-Timing'] = server_timing(profile)
+        save(profile)
+        return response
+
+
+def server_timing(profile):
+    return ', '.join([
+        f'db;dur={profile["db_ms"]};desc="{profile["queries"]} queries, {profile["duplicates"]} repeated"',
+        f'tpl;dur={profile["template_ms"]}',
+        f'view;dur={profile["view_ms"]}',
+    ])
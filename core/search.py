@@ -0,0 +1,157 @@
+# core/search.py
+"""
+Word-prefix search over clients, orders and materials with SQLite FTS5.
+
+Each searchable model has an FTS5 table (``core_search_client`` ...) whose
+rowid is the object's pk and whose three columns hold what the search
+boxes look at:
+
+    model     name                     secondary     related
+    Client    name                     company       email
+    Order     order id (ORD-0042 42)   fabric type   client name
+    Material  name                     description
+
+A query like ``"saad ba"`` becomes ``"saad"* "ba"*``: every word must
+start one of the indexed words. The FTS index answers that without
+looking at the other rows, and ``relevance()`` ranks the hits by bm25.
+
+The tables are created by migration 0027. Rows are kept current by the
+signal handlers in core/signals.py;
+``manage.py rebuild_search_index`` rebuilds them after bulk writes that
+bypass signals. Where FTS5 is missing (another database, or an SQLite
+built without it) ``matches()`` returns None and the views keep their
+LIKE filters.
+"""
+import re
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+COLUMNS = ('name', 'secondary', 'related')
+# bm25 weights: a hit in the name outranks one in the company/email
+WEIGHTS = (10.0, 3.0, 1.0)
+MODELS = ('Client', 'Order', 'Material')
+TOKEN = re.compile(r'\w+')
+
+_available = None
+
+
+def table(model):
+    return f'core_search_{model._meta.model_name}'
+
+
+def available():
+    global _available
+    if _available is None:
+        _available = (
+            connection.vendor == 'sqlite'
+            and 'core_search_client' in connection.introspection.table_names()
+        )
+    return _available
+
+
+# === DOCUMENTS ===
+
+def document(instance):
+    """The (name, secondary, related) text indexed for ``instance``"""
+    name = instance._meta.object_name
+    if name == 'Client':
+        return instance.name, instance.company or '', instance.email or ''
+    if name == 'Order':
+        order_id = instance.order_id or ''
+        number = order_id.rpartition('-')[2].lstrip('0')
+        # "42" should find ORD-0042 as well as "0042"
+        return f"{order_id} {number}", instance.fabric_type or '', instance.client.name
+    if name == 'Material':
+        return instance.name, instance.description or '', ''
+    raise ValueError(f"{name} is not searchable")
+
+
+def index(instance):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {table(instance)} (rowid, {', '.join(COLUMNS)}) VALUES (%s, %s, %s, %s)",
+            [instance.pk, *document(instance)],
+        )
+
+
+def unindex(model, pk):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table(model)} WHERE rowid = %s", [pk])
+
+
+def reindex_client_orders(client):
+    """Orders carry their client's name; refresh it after a rename"""
+    if not available():
+        return
+    Order = client.orders.model
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table(Order)} SET related = %s "
+            f"WHERE rowid IN (SELECT id FROM {Order._meta.db_table} WHERE client_id = %s)",
+            [client.name, client.pk],
+        )
+
+
+def rebuild():
+    """Re-index every searchable row"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name in MODELS:
+            model = apps.get_model('core', name)
+            queryset = model.objects.all()
+            if name == 'Order':
+                queryset = queryset.select_related('client')
+            sql = f"INSERT INTO {table(model)} (rowid, {', '.join(COLUMNS)}) VALUES (%s, %s, %s, %s)"
+            cursor.execute(f"DELETE FROM {table(model)}")
+            batch = []
+            for instance in queryset.iterator(chunk_size=2000):
+                batch.append([instance.pk, *document(instance)])
+                if len(batch) == 2000:
+                    cursor.executemany(sql, batch)
+                    batch = []
+            cursor.executemany(sql, batch)
+
+
+# === QUERIES ===
+
+def match_expression(text, columns=COLUMNS):
+    """FTS5 query for ``text`` restricted to ``columns``, or None if it has no words"""
+    words = TOKEN.findall(text.lower())
+    if not words:
+        return None
+    terms = ' '.join(f'"{word}"*' for word in words)
+    return f"{{{' '.join(columns)}}} : ({terms})"
+
+
+def matches(model, text, columns=COLUMNS):
+    """
+    Subquery of the pks of ``model`` rows matching ``text``, for
+    ``filter(pk__in=...)``; None if the index can't answer (fall back to LIKE)
+    """
+    expression = match_expression(text, columns)
+    if expression is None or not available():
+        return None
+    return RawSQL(f"SELECT rowid FROM {table(model)} WHERE {table(model)} MATCH %s", [expression])
+
+
+def relevance(model, text, columns=COLUMNS):
+    """
+    How well each ``model`` row matches ``text``, for ``annotate()``: minus
+    its weighted bm25 score, so higher is better, and 0 for rows the index
+    doesn't match; None if the index can't answer
+    """
+    expression = match_expression(text, columns)
+    if expression is None or not available():
+        return None
+    weights = ', '.join(str(w) for w in WEIGHTS)
+    return RawSQL(
+        f"COALESCE((SELECT -bm25({table(model)}, {weights}) FROM {table(model)} "
+        f"WHERE {table(model)} MATCH %s AND {table(model)}.rowid = {model._meta.db_table}.id), 0.0)",
+        [expression], output_field=FloatField(),
+    )
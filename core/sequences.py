@@ -0,0 +1,89 @@
+# core/sequences.py
+"""
+Gap-tolerant number sequences stored in the ``Sequence`` table.
+
+``allocate(name, n)`` reserves ``n`` consecutive numbers with a single
+``UPDATE ... SET last_value = last_value + n``. The database serialises
+concurrent updates of the row, so two callers can never get the same
+number, and a bulk import reserves its whole range in one round trip.
+
+Numbers are never handed back: if the insert that used one fails or is
+rolled back, the number is simply skipped.
+"""
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+
+
+def _model():
+    # Imported lazily: core.models uses this module
+    return apps.get_model('core', 'Sequence')
+
+
+def allocate(name, count=1):
+    """Reserve ``count`` numbers from sequence ``name``; return them as a range"""
+    if count < 1:
+        return range(0)
+    Sequence = _model()
+    with transaction.atomic():
+        updated = Sequence.objects.filter(name=name).update(last_value=F('last_value') + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    Sequence.objects.create(name=name, last_value=count)
+            except IntegrityError:
+                # Created concurrently; take the normal path
+                Sequence.objects.filter(name=name).update(last_value=F('last_value') + count)
+        last = Sequence.objects.filter(name=name).values_list('last_value', flat=True).get()
+    return range(last - count + 1, last + 1)
+
+
+def next_value(name):
+    return allocate(name)[0]
+
+
+def reset(name, last_value):
+    """Make ``last_value + 1`` the next number handed out by ``name``"""
+    _model().objects.update_or_create(name=name, defaults={'last_value': last_value})
+
+
+# === REBUILD FROM EXISTING ROWS ===
+
+def required_floors():
+    """Lowest safe ``last_value`` of every sequence, from the ids already in use"""
+    from .models import Invoice, Order
+
+    floors = {Order.ORDER_SEQUENCE: Order.objects.aggregate(top=Max('id'))['top'] or 0}
+    for order_id in Order.objects.filter(order_id__startswith='ORD-').values_list('order_id', flat=True).iterator():
+        suffix = order_id[len('ORD-'):]
+        if suffix.isdigit():
+            floors[Order.ORDER_SEQUENCE] = max(floors[Order.ORDER_SEQUENCE], int(suffix))
+
+    for invoice_id in Invoice.objects.values_list('invoice_id', flat=True).iterator():
+        match = Invoice.INVOICE_ID_RE.match(invoice_id)
+        if match:
+            name = Invoice.invoice_sequence(match['year'], match['prefix'])
+            floors[name] = max(floors.get(name, 0), int(match['number']))
+    return floors
+
+
+def rebuild_sequences(dry_run=False):
+    """
+    Raise every sequence that is behind the ids already stored. Sequences
+    are never lowered: numbers of deleted rows stay retired. Returns
+    ``{name: (stored, new)}`` for the sequences that were (or would be) moved.
+    """
+    Sequence = _model()
+    stored = dict(Sequence.objects.values_list('name', 'last_value'))
+    changes = {
+        name: (stored.get(name), floor)
+        for name, floor in required_floors().items()
+        if stored.get(name, 0) < floor
+    }
+    if not dry_run:
+        for name, (_, floor) in changes.items():
+            # Conditional, so numbers allocated meanwhile are never taken back
+            with transaction.atomic():
+                Sequence.objects.get_or_create(name=name)
+                Sequence.objects.filter(name=name, last_value__lt=floor).update(last_value=floor)
+    return changes
@@ -0,0 +1,197 @@
+# core/signals.py
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from . import activity, avatars, counters, ledger, pdf_cache, search, typeahead
+from .models import ActivityLog, Client, Invoice, Material, Order
+
+logger = logging.getLogger(__name__)
+
+
+# === PAYMENT LEDGER ===
+# Connected before the KPI counters: they read the order's balance to decide
+# whether it is unpaid, so it has to be updated first.
+
+def remember_invoice_amount(sender, instance, **kwargs):
+    instance._ledger_old = None
+    if not instance._state.adding:
+        instance._ledger_old = (
+            Invoice.objects.filter(pk=instance.pk).values_list('order_id', 'amount').first()
+        )
+
+
+def record_invoice(sender, instance, created, **kwargs):
+    old = getattr(instance, '_ledger_old', None)
+    if old is None:
+        ledger.record(instance.order_id, instance.amount)
+    elif old[0] == instance.order_id:
+        ledger.record(instance.order_id, instance.amount - old[1])
+    else:
+        ledger.record(old[0], -old[1])
+        ledger.record(instance.order_id, instance.amount)
+
+
+def remove_invoice(sender, instance, **kwargs):
+    ledger.record(instance.order_id, -instance.amount)
+
+
+def refresh_order_balance(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or 'payment' in update_fields):
+        ledger.refresh(instance.pk)
+
+
+pre_save.connect(remember_invoice_amount, sender=Invoice, dispatch_uid='payment_ledger')
+post_save.connect(record_invoice, sender=Invoice, dispatch_uid='payment_ledger')
+post_delete.connect(remove_invoice, sender=Invoice, dispatch_uid='payment_ledger')
+post_save.connect(refresh_order_balance, sender=Order, dispatch_uid='payment_ledger')
+
+
+# === KPI COUNTERS ===
+
+def counters_pre_save(sender, instance, **kwargs):
+    if not instance._state.adding:
+        counters.snapshot(sender, instance.pk)
+    if sender is Invoice:
+        # A payment can move its order in or out of "unpaid"
+        counters.snapshot(Order, instance.order_id)
+
+
+def counters_post_save(sender, instance, created, **kwargs):
+    if created:
+        counters.settle_create(sender, instance.pk)
+    else:
+        counters.settle(sender, instance.pk)
+    if sender is Invoice:
+        counters.settle(Order, instance.order_id)
+
+
+def counters_pre_delete(sender, instance, **kwargs):
+    counters.snapshot(sender, instance.pk, deleting=True)
+    if sender is Invoice:
+        counters.snapshot(Order, instance.order_id)
+
+
+def counters_post_delete(sender, instance, **kwargs):
+    counters.settle_delete(sender, instance.pk)
+    if sender is Invoice:
+        counters.settle(Order, instance.order_id)
+
+
+for model in counters.COUNTERS:
+    uid = f'kpi_counters_{model.__name__}'
+    pre_save.connect(counters_pre_save, sender=model, dispatch_uid=uid)
+    post_save.connect(counters_post_save, sender=model, dispatch_uid=uid)
+    pre_delete.connect(counters_pre_delete, sender=model, dispatch_uid=uid)
+    post_delete.connect(counters_post_delete, sender=model, dispatch_uid=uid)
+
+
+# === AVATAR THUMBNAILS ===
+
+def render_avatar_variants(sender, instance, **kwargs):
+    """Render the small avatar variants right after an upload"""
+    if not instance.avatar or avatars.has_variants(instance.avatar):
+        return
+    try:
+        avatars.create_variants(instance.avatar)
+    except OSError:
+        # Not an image Pillow can read; keep the upload, just without thumbnails
+        logger.warning("Could not render avatar thumbnails for client %s", instance.pk, exc_info=True)
+
+
+post_save.connect(render_avatar_variants, sender=Client, dispatch_uid='avatar_variants')
+
+
+# === AVATAR GARBAGE COLLECTION ===
+# Avatar files are shared between clients with identical uploads, so the old
+# file is only deleted (after commit) if no other client still uses it.
+
+def remember_old_avatar(sender, instance, **kwargs):
+    instance._old_avatar = ''
+    if not instance._state.adding:
+        instance._old_avatar = (
+            Client.objects.filter(pk=instance.pk).values_list('avatar', flat=True).first() or ''
+        )
+
+
+def release_replaced_avatar(sender, instance, **kwargs):
+    old = getattr(instance, '_old_avatar', '')
+    if old and old != instance.avatar.name:
+        storage = instance.avatar.storage
+        transaction.on_commit(lambda: avatars.release_avatar(old, storage))
+
+
+def release_deleted_avatar(sender, instance, **kwargs):
+    if instance.avatar:
+        name, storage = instance.avatar.name, instance.avatar.storage
+        transaction.on_commit(lambda: avatars.release_avatar(name, storage))
+
+
+pre_save.connect(remember_old_avatar, sender=Client, dispatch_uid='avatar_gc')
+post_save.connect(release_replaced_avatar, sender=Client, dispatch_uid='avatar_gc')
+post_delete.connect(release_deleted_avatar, sender=Client, dispatch_uid='avatar_gc')
+
+
+# === INVOICE PDF CACHE ===
+# Cached PDFs are content-keyed, so these only reclaim the disk space of
+# renders that can no longer be requested.
+
+def invalidate_invoice_pdfs(sender, instance, **kwargs):
+    order_id = instance.pk if sender is Order else instance.order_id
+    transaction.on_commit(lambda: pdf_cache.invalidate_order(order_id))
+
+
+for model in (Invoice, Order):
+    uid = f'invoice_pdf_cache_{model.__name__}'
+    post_save.connect(invalidate_invoice_pdfs, sender=model, dispatch_uid=uid)
+    post_delete.connect(invalidate_invoice_pdfs, sender=model, dispatch_uid=uid)
+
+
+# === SEARCH INDEX ===
+
+def index_for_search(sender, instance, **kwargs):
+    search.index(instance)
+    if sender is Client:
+        search.reindex_client_orders(instance)
+
+
+def unindex_for_search(sender, instance, **kwargs):
+    search.unindex(sender, instance.pk)
+
+
+for model in (Client, Order, Material):
+    uid = f'search_index_{model.__name__}'
+    post_save.connect(index_for_search, sender=model, dispatch_uid=uid)
+    post_delete.connect(unindex_for_search, sender=model, dispatch_uid=uid)
+
+
+# === CLIENT TYPEAHEAD ===
+# The version bump rolls back with the write; the in-memory index is only
+# touched once the write is committed.
+
+def update_typeahead(sender, instance, **kwargs):
+    version = typeahead.bump_version()
+    client_id, name, email = instance.pk, instance.name, instance.email
+    transaction.on_commit(lambda: typeahead.index.apply(client_id, name, email, version))
+
+
+def remove_from_typeahead(sender, instance, **kwargs):
+    version = typeahead.bump_version()
+    client_id = instance.pk
+    transaction.on_commit(lambda: typeahead.index.apply(client_id, version=version))
+
+
+post_save.connect(update_typeahead, sender=Client, dispatch_uid='client_typeahead')
+post_delete.connect(remove_from_typeahead, sender=Client, dispatch_uid='client_typeahead')
+
+
+# === ACTIVITY FEED ===
+# After commit, so a request running meanwhile cannot cache the old feed again.
+
+def invalidate_activity_feed(sender, **kwargs):
+    transaction.on_commit(activity.invalidate_feed)
+
+
+post_save.connect(invalidate_activity_feed, sender=ActivityLog, dispatch_uid='activity_feed')
+post_delete.connect(invalidate_activity_feed, sender=ActivityLog, dispatch_uid='activity_feed')
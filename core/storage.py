@@ -0,0 +1,78 @@
+# core/storage.py
+"""
+Content-addressed file storage for client avatars.
+
+Files are named after the SHA-256 of their bytes (``avatars/<sha256>.jpg``)
+instead of the upload name, so re-uploading the same photo (every client
+edit used to) stores nothing new and every client with that photo points
+at the same file. Unused files are cleaned up by core/avatars.py.
+
+Sharing a file marks it as just stored (its modification time), so that
+it is not collected while the save that shares it has yet to commit;
+``delete_unused()`` leaves such files alone.
+"""
+import hashlib
+import os
+import re
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name):
+    stem, _ = os.path.splitext(os.path.basename(name))
+    return bool(HASHED_NAME.match(stem))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def hashed_name(self, name, content):
+        """Where ``content`` uploaded as ``name`` is stored"""
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        name = f"{content_hash(content)}{extension}"
+        return f"{directory}/{name}" if directory else name
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            try:
+                # Same bytes are already stored; share the file
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Taken away by delete_unused() meanwhile; store it again
+                pass
+        return super()._save(name, content)
+
+    def delete_unused(self, name, min_age):
+        """
+        Delete ``name``, which no client refers to, unless it was stored or
+        shared in the last ``min_age`` seconds; returns the bytes freed
+        """
+        path = self.path(name)
+        doomed = f"{path}.deleting"
+        try:
+            # From here on an upload of the same bytes stores a new copy
+            os.rename(path, doomed)
+        except FileNotFoundError:
+            return 0
+        stat = os.stat(doomed)
+        if time.time() - stat.st_mtime < min_age:
+            os.replace(doomed, path)
+            return 0
+        os.remove(doomed)
+        return stat.st_size
+
+
+avatar_storage = ContentAddressedStorage()
@@ -1,3 +1,1447 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .avatars import THUMBNAIL_SIZE, VARIANTS, has_variants, variant_name
+from .counters import check_counters, get_counters, rebuild_counters
+from .ledger import check_ledger
+from .loadtest import Connection, LoadTestError, download_pdf, login, run as run_load_test
+from .perfdata import make_clients
+from .models import ActivityLog, ActivityRollup, Client, Invoice, KPICounter, Material, Order, PDFJob, Reorder, Sequence, Vendor
+from . import activity, activity_archive, invoice_pdfs, metrics, pdf_cache, profiling, search, typeahead
+from .invoice_pdfs import export_queryset
+from .pdf import PDFRenderError, WeasyPrintRenderer
+from .pdf_jobs import requeue_stale, work
+from .sequences import allocate, rebuild_sequences
+from .storage import avatar_storage, is_content_addressed
+
+
+def make_image(size=(600, 400), fmt='JPEG', name='photo.jpg', color='teal'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def make_orders(count, payment=Decimal('100.00'), paid=None):
+    """Create ``count`` orders (one client each), optionally with an invoice."""
+    orders = []
+    for i in range(count):
+        client = Client.objects.create(name=f"Client {i}")
+        order = Order.objects.create(client=client, payment=payment)
+        if paid is not None:
+            Invoice.objects.create(order=order, amount=paid, payment_method='cash')
+        orders.append(order)
+    return orders
+
+
+class MainDashboardTests(TestCase):
+    def test_view_query_count_does_not_grow_with_rows(self):
+        cache.clear()
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+        url = reverse('main_dashboard')
+        rebuild_counters()
+
+        # Both requests render the activity feed rather than reuse it
+        make_orders(1, paid=Decimal('10.00'))
+        activity.invalidate_feed()
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        make_orders(30, paid=Decimal('10.00'))
+        activity.invalidate_feed()
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertEqual(len(small), len(large))
+
+
+class KPICounterTests(TestCase):
+    def setUp(self):
+        rebuild_counters()
+
+    def assertConsistent(self):
+        self.assertEqual(check_counters(), {})
+
+    def test_signals_keep_counters_consistent(self):
+        order, other = make_orders(2)
+        self.assertConsistent()
+
+        order.status = 'shipped'
+        order.save()
+        Invoice.objects.create(order=order, amount=Decimal('30.00'), payment_method='cash')
+        Invoice.objects.create(order=order, amount=Decimal('70.00'), payment_method='cash')
+        self.assertConsistent()
+        self.assertEqual(get_counters()['orders_shipped'], 1)
+        self.assertEqual(get_counters()['orders_unpaid'], 1)
+
+        # record_payment: drop every invoice of the order, then add one
+        Invoice.objects.filter(order=order).delete()
+        self.assertConsistent()
+        Invoice.objects.create(order=order, amount=Decimal('20.00'), payment_method='cash')
+        self.assertConsistent()
+
+        material = Material.objects.create(name="Acid", quantity=500, threshold=100)
+        material.quantity = 0
+        material.save()
+        vendor = Vendor.objects.create(name="Acme")
+        Reorder.objects.create(material=material, vendor=vendor, quantity=10, delivery_date='2026-01-01')
+        self.assertConsistent()
+
+        # Cascades: order -> invoices, client -> orders -> invoices, material -> reorders
+        order.delete()
+        self.assertConsistent()
+        Invoice.objects.create(order=other, amount=Decimal('100.00'), payment_method='cash')
+        other.client.delete()
+        Material.objects.filter(id=material.id).delete()
+        self.assertConsistent()
+
+    def test_rebuild_fixes_drift(self):
+        make_orders(3)
+        KPICounter.objects.filter(name='orders_total').update(value=99)
+
+        self.assertEqual(check_counters(), {'orders_total': (99, 3)})
+        self.assertEqual(rebuild_counters(), {'orders_total': (99, 3)})
+        self.assertConsistent()
+
+    def test_read_is_one_query(self):
+        make_orders(5)
+        with self.assertNumQueries(1):
+            get_counters()
+
+
+class OrderPaginationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+        self.orders = make_orders(7)
+        # Ties on created_at must be broken by id
+        Order.objects.filter(id__in=[o.id for o in self.orders[2:5]]).update(
+            created_at=self.orders[2].created_at
+        )
+        Order.objects.filter(id=self.orders[0].id).update(status='shipped')
+
+    def test_pages_cover_every_order_once(self):
+        seen = []
+        response = self.client.get(reverse('order_dashboard'), {'page_size': 3})
+        seen += [o.id for o in response.context['orders']]
+        query = response.context['next_query']
+        while query:
+            data = self.client.get(reverse('order_page_api') + '?' + query).json()
+            seen += [o['id'] for o in data['orders']]
+            query = data['next_query']
+
+        expected = list(
+            Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_filters_are_kept_in_next_page_link(self):
+        response = self.client.get(reverse('order_dashboard'), {'status': 'sample_preparing', 'page_size': 4})
+        self.assertEqual(len(response.context['orders']), 4)
+        self.assertIn('status=sample_preparing', response.context['next_query'])
+
+        data = self.client.get(reverse('order_page_api') + '?' + response.context['next_query']).json()
+        self.assertEqual(len(data['orders']), 2)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('order_page_api'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TempMediaMixin:
+    """Uploads go to a throwaway MEDIA_ROOT"""
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class ClientListTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+
+    def test_infinite_scroll_pages(self):
+        for i in range(5):
+            Client.objects.create(name=f"Ali {i}", is_active=i % 2 == 0)
+        Client.objects.create(name="Zed")
+
+        response = self.client.get(reverse('client_dashboard'), {'search': 'ali', 'page_size': 2})
+        names = [c.name for c in response.context['clients']]
+        query = response.context['next_query']
+        while query:
+            data = self.client.get(reverse('client_page_api') + '?' + query).json()
+            names += [c['name'] for c in data['clients']]
+            query = data['next_query']
+
+        self.assertEqual(names, [f"Ali {i}" for i in reversed(range(5))])
+
+    def test_avatar_served_as_lazy_thumbnail(self):
+        client = Client.objects.create(name="Pic", avatar=make_image())
+
+        response = self.client.get(reverse('client_dashboard'))
+        self.assertContains(response, client.avatar_thumbnail_url)
+        self.assertContains(response, client.avatar_thumbnail_webp_url)
+        self.assertContains(response, 'loading="lazy"')
+        self.assertNotContains(response, f'src="{client.avatar.url}"')
+
+
+class AvatarThumbnailTests(TempMediaMixin, TestCase):
+    def open_variant(self, client, fmt):
+        return Image.open(default_storage.open(variant_name(client.avatar.name, fmt)))
+
+    def test_variants_rendered_on_upload_without_exif(self):
+        exif = Image.Exif()
+        exif[0x0110] = "Phone Model X"
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 900), 'teal').save(buffer, 'JPEG', exif=exif)
+        upload = SimpleUploadedFile('phone.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+        client = Client.objects.create(name="Pic", avatar=upload)
+
+        for fmt, pil_format in (('jpeg', 'JPEG'), ('webp', 'WEBP')):
+            variant = self.open_variant(client, fmt)
+            self.assertEqual(variant.format, pil_format)
+            self.assertEqual(variant.size, (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            self.assertEqual(dict(variant.getexif()), {})
+        self.assertEqual(client.avatar_thumbnail_url, default_storage.url(variant_name(client.avatar.name)))
+
+    def test_missing_variants_fall_back_to_view_and_backfill(self):
+        client = Client.objects.create(name="Pic", avatar=make_image())
+        for fmt in VARIANTS:
+            default_storage.delete(variant_name(client.avatar.name, fmt))
+        self.assertIn(reverse('client_avatar', args=[client.id]), client.avatar_thumbnail_url)
+
+        out = StringIO()
+        call_command('backfill_avatar_thumbnails', stdout=out)
+        self.assertIn("Rendered 1", out.getvalue())
+        self.assertTrue(has_variants(client.avatar))
+        self.assertNotIn(reverse('client_avatar', args=[client.id]), client.avatar_thumbnail_url)
+
+    def test_fallback_view_renders_variant(self):
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+        client = Client.objects.create(name="Pic", avatar=make_image())
+        default_storage.delete(variant_name(client.avatar.name, 'webp'))
+
+        response = self.client.get(reverse('client_avatar', args=[client.id]), {'format': 'webp'})
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        thumb = Image.open(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(thumb.size, (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+
+
+class AvatarStorageTests(TempMediaMixin, TestCase):
+    def files(self):
+        return sorted(default_storage.listdir('avatars')[1])
+
+    def test_identical_uploads_share_one_file(self):
+        first = Client.objects.create(name="A", avatar=make_image(name='a.jpg'))
+        second = Client.objects.create(name="B", avatar=make_image(name='b_copy.jpg'))
+
+        self.assertEqual(first.avatar.name, second.avatar.name)
+        self.assertTrue(is_content_addressed(first.avatar.name))
+        self.assertEqual(len(self.files()), 1)
+
+    @override_settings(AVATAR_GC_GRACE=0)
+    def test_replaced_and_deleted_avatars_are_collected(self):
+        first = Client.objects.create(name="A", avatar=make_image())
+        second = Client.objects.create(name="B", avatar=make_image())
+        shared = first.avatar.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.avatar = make_image(color='red')
+            first.save()
+        # Still used by the second client
+        self.assertTrue(default_storage.exists(shared))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(shared))
+        self.assertFalse(default_storage.exists(variant_name(shared)))
+        self.assertEqual(self.files(), [os.path.basename(first.avatar.name)])
+
+    def test_recently_shared_file_survives_release(self):
+        first = Client.objects.create(name="A", avatar=make_image())
+        name = first.avatar.name
+        old = time.time() - 7200
+        os.utime(default_storage.path(name), (old, old))
+
+        # Another upload of the same photo, its client not saved yet
+        self.assertEqual(avatar_storage.save('avatars/again.jpg', make_image()), name)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+
+        # Nobody ever saved it: collected once the grace period is over
+        os.utime(default_storage.path(name), (old, old))
+        call_command('gc_avatars', stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_file_being_deleted_is_stored_again(self):
+        client = Client.objects.create(name="A", avatar=make_image())
+        path = default_storage.path(client.avatar.name)
+        # delete_unused() has moved it aside
+        os.rename(path, f"{path}.deleting")
+        self.assertEqual(avatar_storage.save('avatars/again.jpg', make_image()), client.avatar.name)
+        self.assertTrue(os.path.exists(path))
+
+    def test_gc_command_merges_legacy_duplicates(self):
+        data = make_image().read()
+        legacy = [default_storage.save('avatars/photo.jpg', ContentFile(data)) for _ in range(2)]
+        orphan = default_storage.save('avatars/old.jpg', ContentFile(b'x' * 100))
+        for i, name in enumerate(legacy):
+            Client.objects.filter(pk=Client.objects.create(name=f"C{i}").pk).update(avatar=name)
+
+        out = StringIO()
+        call_command('gc_avatars', '--min-age=0', stdout=out)
+
+        names = set(Client.objects.values_list('avatar', flat=True))
+        self.assertEqual(len(names), 1)
+        (name,) = names
+        self.assertTrue(is_content_addressed(name))
+        self.assertEqual(self.files(), [os.path.basename(name)])
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertIn(f"Reclaimed {len(data) + 100} bytes", out.getvalue())
+
+
+class FakeRenderer:
+    calls = []
+
+    def render(self, html, base_url=None):
+        self.calls.append((html, base_url))
+        return b'%PDF-1.7 fake'
+
+
+class WeasyPrintRendererTests(SimpleTestCase):
+    def setUp(self):
+        try:
+            self.renderer = WeasyPrintRenderer()
+        except PDFRenderError as e:
+            self.skipTest(str(e))
+
+    def test_renders_and_fetches_remote_stylesheets_once(self):
+        weasyprint = self.renderer._weasyprint
+        fetched = []
+
+        def fetcher(url, *args, **kwargs):
+            fetched.append(url)
+            return {'string': b'body { color: teal; }', 'mime_type': 'text/css'}
+
+        original = weasyprint.default_url_fetcher
+        weasyprint.default_url_fetcher = fetcher
+        self.addCleanup(setattr, weasyprint, 'default_url_fetcher', original)
+
+        html = '<link rel="stylesheet" href="https://cdn.example.com/site.css"><p>Invoice</p>'
+        for _ in range(2):
+            self.assertTrue(self.renderer.render(html).startswith(b'%PDF'))
+        self.assertEqual(fetched, ['https://cdn.example.com/site.css'])
+
+
+@override_settings(PDF_RENDERER='core.tests.FakeRenderer')
+class InvoicePDFTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        override = override_settings(PDF_CACHE_DIR=cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        user = User.objects.create_user('staff', password='pw')
+        self.client.force_login(user)
+        FakeRenderer.calls.clear()
+        order = make_orders(1, paid=Decimal('40.00'))[0]
+        self.invoice = order.invoices.get()
+
+    def download(self, **headers):
+        """Request the PDF, letting the worker render it if it was queued"""
+        url = reverse('download_invoice_pdf', args=[self.invoice.id])
+        response = self.client.get(url, **headers)
+        if response.status_code == 202:
+            work(once=True)
+            response = self.client.get(url, **headers)
+        return response
+
+    def test_download_queues_job_and_worker_renders_it(self):
+        url = reverse('download_invoice_pdf', args=[self.invoice.id])
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        job = PDFJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(job.status, PDFJob.QUEUED)
+        self.assertEqual(FakeRenderer.calls, [])
+
+        # A second click while queued reuses the job
+        self.assertEqual(self.client.get(url).context['job'], job)
+
+        self.assertEqual(work(once=True), 1)
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(status['status'], PDFJob.DONE)
+        self.assertEqual(status['download_url'], url)
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn(f'Invoice_INV-{self.invoice.id}.pdf', response['Content-Disposition'])
+        self.assertEqual(response.content, b'%PDF-1.7 fake')
+        html, base_url = FakeRenderer.calls[0]
+        self.assertIn('40', html)
+        self.assertTrue(base_url.endswith(url))
+
+    @override_settings(
+        PDF_RENDERER='core.pdf.SubprocessRenderer', WEASYPRINT_BINARY='no-such-weasyprint',
+        PDF_JOB_MAX_ATTEMPTS=2,
+    )
+    def test_failed_render_is_retried_with_backoff_then_fails(self):
+        self.client.get(reverse('download_invoice_pdf', args=[self.invoice.id]))
+        work(once=True)
+        job = PDFJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (PDFJob.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(work(once=True), 0)  # not due yet
+
+        PDFJob.objects.update(run_after=timezone.now())
+        work(once=True)
+        status = self.client.get(reverse('pdf_job_status', args=[job.id])).json()
+        self.assertEqual((status['status'], status['attempts']), (PDFJob.FAILED, 2))
+        self.assertIn('no-such-weasyprint', status['error'])
+
+    def test_cached_pdf_is_reused_and_revalidated_by_etag(self):
+        first = self.download()
+        second = self.download()
+        self.assertEqual(len(FakeRenderer.calls), 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertIn('Last-Modified', second)
+
+        response = self.download(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(FakeRenderer.calls), 1)
+
+    def test_payment_on_order_invalidates_cached_pdf(self):
+        first = self.download()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.create(order=self.invoice.order, amount=Decimal('25.00'), payment_method='cash')
+        response = self.download(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(len(FakeRenderer.calls), 2)
+
+    @override_settings(PDF_JOB_STALE_AFTER=60, PDF_JOB_MAX_ATTEMPTS=2)
+    def test_stale_job_is_requeued_until_out_of_attempts(self):
+        self.client.get(reverse('download_invoice_pdf', args=[self.invoice.id]))
+        job = PDFJob.objects.get()
+        long_ago = timezone.now() - timedelta(minutes=5)
+
+        PDFJob.objects.update(status=PDFJob.RUNNING, started_at=long_ago, attempts=1)
+        self.assertEqual(requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PDFJob.QUEUED)
+
+        # The worker died on its last attempt too
+        PDFJob.objects.update(status=PDFJob.RUNNING, started_at=long_ago, attempts=2)
+        self.assertEqual(requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PDFJob.FAILED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(work(once=True), 0)
+
+    def test_download_and_job_status_require_login(self):
+        self.client.get(reverse('download_invoice_pdf', args=[self.invoice.id]))
+        job = PDFJob.objects.get()
+        self.client.logout()
+        for url in [reverse('download_invoice_pdf', args=[self.invoice.id]), reverse('pdf_job_status', args=[job.id])]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertIn('next=', response['Location'])
+        self.assertEqual(PDFJob.objects.count(), 1)
+
+
+@override_settings(PDF_RENDERER='core.tests.FakeRenderer')
+class InvoiceExportTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        override = override_settings(PDF_CACHE_DIR=cache_dir, PDF_EXPORT_WORKERS=1)
+        override.enable()
+        self.addCleanup(override.disable)
+        user = User.objects.create_user('staff', password='pw')
+        self.client.force_login(user)
+        FakeRenderer.calls.clear()
+        self.orders = make_orders(3, paid=Decimal('10.00'))
+
+    def test_streams_zip_of_filtered_invoices(self):
+        client_id = self.orders[1].client_id
+        response = self.client.get(reverse('export_invoice_pdfs'), {'client': client_id})
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        invoice = self.orders[1].invoices.get()
+        self.assertEqual(archive.namelist(), [f'Invoice_INV-{invoice.id}.pdf'])
+        self.assertEqual(archive.read(f'Invoice_INV-{invoice.id}.pdf'), b'%PDF-1.7 fake')
+
+    def test_pool_of_two_workers_is_shared_by_exports(self):
+        self.addCleanup(invoice_pdfs.shutdown_pool)
+        names = [f'Invoice_INV-{order.invoices.get().id}.pdf' for order in self.orders]
+        pools = []
+        for _ in range(2):
+            archive = zipfile.ZipFile(BytesIO(b''.join(invoice_pdfs.stream_zip(export_queryset(), workers=2))))
+            self.assertEqual(sorted(archive.namelist()), sorted(names))
+            self.assertEqual({archive.read(name) for name in names}, {b'%PDF-1.7 fake'})
+            pools.append(invoice_pdfs._pool)
+            # Cached renders would skip the pool on the second export
+            for order in self.orders:
+                pdf_cache.invalidate_order(order.id)
+        # Rendered in the workers, with this process's PDF_RENDERER
+        self.assertEqual(FakeRenderer.calls, [])
+        self.assertIs(pools[0], pools[1])
+
+    def test_command_reuses_cached_renders(self):
+        output = os.path.join(tempfile.mkdtemp(), 'invoices.zip')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        invoice = self.orders[0].invoices.get()
+        self.client.get(reverse('download_invoice_pdf', args=[invoice.id]))
+        work(once=True)
+
+        call_command('export_invoice_pdfs', output, stdout=StringIO())
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+        self.assertEqual(len(FakeRenderer.calls), 3)
+
+
+class SequenceTests(TestCase):
+    def test_allocates_consecutive_ranges(self):
+        self.assertEqual(list(allocate('test', 3)), [1, 2, 3])
+        self.assertEqual(list(allocate('test', 2)), [4, 5])
+        self.assertEqual(list(allocate('other')), [1])
+
+    def test_order_ids_survive_deleting_the_newest_order(self):
+        first, second = make_orders(2)
+        second.delete()
+        third = make_orders(1)[0]
+        self.assertNotEqual(third.order_id, second.order_id)
+        self.assertNotEqual(third.order_id, first.order_id)
+
+    def test_bulk_assignment_is_one_allocation(self):
+        client = Client.objects.create(name="Bulk")
+        orders = [Order(client=client, payment=Decimal('1.00')) for _ in range(50)]
+        with self.assertNumQueries(4):  # savepoint, UPDATE, SELECT, release
+            Order.assign_order_ids(orders)
+        Order.objects.bulk_create(orders)
+        self.assertEqual(Order.objects.filter(client=client).values('order_id').distinct().count(), 50)
+
+
+    def test_invoice_numbers_are_numeric_past_999(self):
+        order = make_orders(1)[0]
+        year = timezone.now().year
+        Sequence.objects.update_or_create(name=Invoice.invoice_sequence(year), defaults={'last_value': 999})
+        first = Invoice.objects.create(order=order, amount=Decimal('1.00'), payment_method='cash')
+        second = Invoice.objects.create(order=order, amount=Decimal('1.00'), payment_method='cash')
+        self.assertEqual(first.invoice_id, f'INV-{year}-1000')
+        self.assertEqual(second.invoice_id, f'INV-{year}-1001')
+
+    def test_invoice_batches_are_numbered_per_year(self):
+        order = make_orders(1)[0]
+        invoices = [
+            Invoice(order=order, amount=Decimal('1.00'), payment_method='cash',
+                    created_at=timezone.now().replace(year=year))
+            for year in (2024, 2025, 2024)
+        ]
+        Invoice.assign_invoice_ids(invoices)
+        self.assertEqual([i.invoice_id for i in invoices], ['INV-2024-001', 'INV-2025-001', 'INV-2024-002'])
+
+    def test_rebuild_moves_sequences_past_stored_ids(self):
+        order = make_orders(1)[0]
+        invoice = Invoice.objects.create(order=order, amount=Decimal('1.00'), payment_method='cash')
+        Invoice.objects.filter(pk=invoice.pk).update(invoice_id='INV-2019-1204')
+        Sequence.objects.filter(name='order_id').update(last_value=0)
+
+        with self.assertRaises(SystemExit):
+            call_command('rebuild_sequences', '--check', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_sequences', stdout=StringIO())
+
+        self.assertEqual(Sequence.objects.get(name='invoice_id:INV-2019').last_value, 1204)
+        self.assertNotEqual(make_orders(1)[0].order_id, order.order_id)
+        call_command('rebuild_sequences', '--check', stdout=StringIO())
+
+
+class SequenceConcurrencyTests(TransactionTestCase):
+    def test_threads_never_share_a_number(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("threads can't share an in-memory SQLite database")
+        threads, per_thread, batch = 8, 25, 3
+        results, errors = [], []
+
+        def hammer():
+            try:
+                for _ in range(per_thread):
+                    results.extend(allocate('threaded', batch))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=hammer) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        total = threads * per_thread * batch
+        self.assertEqual(sorted(results), list(range(1, total + 1)))
+
+
+class QueryPlanTests(TestCase):
+    """Dashboard queries must be served by an index, not a full table scan"""
+    DASHBOARDS = [
+        ('main_dashboard', {}),
+        ('client_dashboard', {}),
+        ('client_dashboard', {'status': 'inactive'}),
+        ('order_dashboard', {}),
+        ('order_dashboard', {'status': 'shipped'}),
+        ('inventory_dashboard', {'status': 'out_of_stock'}),
+        ('inventory_dashboard', {'status': 'low_stock'}),
+        ('reorder_dashboard', {}),
+        ('finance_dashboard', {}),
+        ('finance_dashboard', {'status': 'partial'}),
+    ]
+    # Small fixed-size tables that are meant to be read whole
+    WHOLE_TABLE_READS = {'core_kpicounter'}
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("plans are checked with SQLite's EXPLAIN QUERY PLAN")
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+        make_orders(60, paid=Decimal('5.00'))
+        Client.objects.filter(id__in=Client.objects.values('id')[:10]).update(is_active=False)
+        for i in range(30):
+            Material.objects.create(name=f"Material {i}", quantity=i * 10, threshold=100)
+        rebuild_counters()
+
+    def full_scans(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        return [
+            step for step in plan
+            if 'USE TEMP B-TREE' in step
+            or (step.startswith('SCAN ') and 'USING' not in step and step.split()[1] not in self.WHOLE_TABLE_READS)
+        ]
+
+    def test_dashboard_queries_use_indexes(self):
+        for name, params in self.DASHBOARDS:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse(name), params).status_code, 200)
+            for query in queries.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    with self.subTest(dashboard=name, params=params, sql=query['sql'][:120]):
+                        self.assertEqual(self.full_scans(query['sql']), [])
+
+    def test_finance_payment_state_filter_uses_index(self):
+        orders = Order.objects.filter(payment_state=Order.PAYMENT_PARTIAL)
+        for queryset in (orders.order_by('-created_at', '-id'), orders.values('id')):
+            sql, params = queryset.query.sql_with_params()
+            self.assertEqual(self.full_scans(sql, params), [])
+
+    def test_invoice_export_range_uses_index(self):
+        today = timezone.now().date()
+        sql, params = export_queryset(start=today, end=today).query.sql_with_params()
+        self.assertEqual(self.full_scans(sql, params), [])
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        if not search.available():
+            self.skipTest("needs SQLite with FTS5")
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+
+    def ids(self, model, text, columns=search.COLUMNS):
+        return set(model.objects.filter(id__in=search.matches(model, text, columns)).values_list('id', flat=True))
+
+    def test_index_follows_saves_renames_and_deletes(self):
+        saad = Client.objects.create(name="Saad Baig", company="Hamdard")
+        order = Order.objects.create(client=saad, payment=Decimal('10.00'), fabric_type="Cotton")
+        self.assertEqual(self.ids(Client, "ba"), {saad.id})
+        self.assertEqual(self.ids(Client, "saad ham"), {saad.id})
+        self.assertEqual(self.ids(Order, "baig", ('related',)), {order.id})
+
+        saad.name = "Saad Khan"
+        saad.save()
+        self.assertEqual(self.ids(Client, "baig"), set())
+        self.assertEqual(self.ids(Order, "khan", ('related',)), {order.id})
+
+        saad.delete()
+        self.assertEqual(self.ids(Client, "saad"), set())
+        self.assertEqual(self.ids(Order, "cotton"), set())
+
+    def test_order_number_without_leading_zeros(self):
+        order = make_orders(1)[0]
+        number = order.order_id.split('-')[1]
+        self.assertEqual(self.ids(Order, number.lstrip('0'), ('name',)), {order.id})
+        response = self.client.get(reverse('order_dashboard'), {'search': number})
+        self.assertEqual([o.id for o in response.context['orders']], [order.id])
+
+    def test_name_hits_rank_above_company_and_email_hits(self):
+        by_name = Client.objects.create(name="Ali Raza", email="r@example.com")
+        by_company = Client.objects.create(name="Zed", company="Ali Traders")
+        by_email = Client.objects.create(name="Yusuf", email="ali@example.com")
+        ranked = Client.objects.annotate(relevance=search.relevance(Client, "ali")).order_by('-relevance')
+        self.assertEqual([c.id for c in ranked], [by_name.id, by_company.id, by_email.id])
+
+        # The dashboard puts the older name hit before the newer company hit,
+        # on the first page and across pages
+        response = self.client.get(reverse('client_dashboard'), {'search': 'ali'})
+        self.assertEqual([c.id for c in response.context['clients']], [by_name.id, by_company.id])
+        first = self.client.get(reverse('client_dashboard'), {'search': 'ali', 'page_size': 1})
+        self.assertEqual([c.id for c in first.context['clients']], [by_name.id])
+        rest = self.client.get(reverse('client_page_api') + '?' + first.context['next_query']).json()
+        self.assertEqual([c['id'] for c in rest['clients']], [by_company.id])
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_rebuild_picks_up_bulk_writes(self):
+        Client.objects.bulk_create([Client(name=f"Bulk {i}") for i in range(3)])
+        self.assertEqual(self.ids(Client, "bulk"), set())
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.ids(Client, "bulk")), 3)
+
+
+@override_settings(TYPEAHEAD_RECHECK=0)
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        # The index is per process and outlives each test's rollback
+        typeahead.index.reset()
+        self.addCleanup(typeahead.index.reset)
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+
+    def ids(self, query):
+        return [client_id for client_id, _, _ in typeahead.search(query)]
+
+    def test_name_matches_rank_before_word_and_email_matches(self):
+        by_email = Client.objects.create(name="Zed", email="ali@example.com")
+        by_word = Client.objects.create(name="Saad Ali", email="s@example.com")
+        by_name = Client.objects.create(name="Ali Raza", email="z@example.com")
+        response = self.client.get(reverse('client_search_api'), {'q': 'ALI'})
+        self.assertEqual([c['id'] for c in response.json()], [by_name.id, by_word.id, by_email.id])
+        self.assertEqual(response.json()[0]['display'], f"CL-{by_name.id} – Ali Raza")
+        self.assertIn('max-age=30', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_short_queries_return_nothing(self):
+        Client.objects.create(name="Ali Raza")
+        self.assertEqual(self.client.get(reverse('client_search_api'), {'q': 'a'}).json(), [])
+
+    @override_settings(TYPEAHEAD_RECHECK=60)
+    def test_committed_writes_are_applied_without_a_rebuild(self):
+        ali = Client.objects.create(name="Ali Raza")
+        self.assertEqual(self.ids("ali"), [ali.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            saad = Client.objects.create(name="Saad Baig", email="saad@example.com")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ids("baig"), [saad.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            saad.name = "Saad Khan"
+            saad.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            saad.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ids("saad"), [])
+            self.assertEqual(self.ids("ali"), [ali.id])
+
+    def test_lookups_stay_fast_on_a_large_index(self):
+        index = typeahead.PrefixIndex()
+        index.load(((i, f"Client {i} Name{i % 977}", f"c{i}@example.com") for i in range(50000)), version=1)
+        start = time.perf_counter()
+        for i in range(1000):
+            index.search(f"name{i % 977}")
+        # Generous bound; benchmark_typeahead gives the real numbers
+        self.assertLess((time.perf_counter() - start) / 1000, 0.001)
+
+
+@override_settings(TYPEAHEAD_RECHECK=0)
+class TypeaheadRebuildTests(TransactionTestCase):
+    def setUp(self):
+        typeahead.index.reset()
+        self.addCleanup(typeahead.index.reset)
+
+    def ids(self, query):
+        return [client_id for client_id, _, _ in typeahead.search(query)]
+
+    def test_writes_from_other_processes_rebuild_in_the_background(self):
+        self.assertEqual(self.ids("bulk"), [])
+        # bulk_create skips signals; a bumped version is all another process leaves behind
+        Client.objects.bulk_create([Client(name=f"Bulk {i}") for i in range(3)])
+        self.assertEqual(self.ids("bulk"), [])
+        typeahead.bump_version()
+
+        # Answered from the old index while the rebuild runs
+        release = threading.Event()
+        load = typeahead.index.load
+        typeahead.index.load = lambda rows, version: release.wait(10) and load(rows, version)
+        self.addCleanup(vars(typeahead.index).pop, 'load')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.ids("bulk"), [])
+        self.assertEqual(self.ids("bulk"), [])
+        release.set()
+        typeahead.index.rebuild_thread.join(timeout=10)
+        self.assertEqual(len(self.ids("bulk")), 3)
+
+
+class LedgerTests(TestCase):
+    def assertBalance(self, order, paid, remaining, state):
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.paid_amount, order.remaining_amount, order.payment_state),
+            (Decimal(paid), None if remaining is None else Decimal(remaining), state),
+        )
+
+    def test_invoice_writes_move_the_balance(self):
+        order, other = make_orders(2)
+        self.assertBalance(order, '0', '100', 'pending')
+
+        first = Invoice.objects.create(order=order, amount=Decimal('30.00'), payment_method='cash')
+        self.assertBalance(order, '30', '70', 'partial')
+        Invoice.objects.create(order=order, amount=Decimal('70.00'), payment_method='cash')
+        self.assertBalance(order, '100', '0', 'paid')
+
+        first.amount = Decimal('10.00')
+        first.save()
+        self.assertBalance(order, '80', '20', 'partial')
+
+        first.order = other
+        first.save()
+        self.assertBalance(order, '70', '30', 'partial')
+        self.assertBalance(other, '10', '90', 'partial')
+
+        Invoice.objects.filter(order=order).delete()
+        self.assertBalance(order, '0', '100', 'pending')
+        self.assertEqual(check_ledger(), {})
+
+    def test_order_edits_keep_the_ledger(self):
+        order = make_orders(1)[0]
+        stale = Order.objects.get(pk=order.pk)
+        Invoice.objects.create(order=order, amount=Decimal('40.00'), payment_method='cash')
+
+        # Saving an instance loaded before the payment must not undo it
+        stale.status = 'shipped'
+        stale.payment = Decimal('40.00')
+        stale.save()
+        self.assertBalance(order, '40', '0', 'paid')
+
+        no_price = Order.objects.create(client=order.client)
+        self.assertBalance(no_price, '0', None, 'pending')
+        self.assertEqual(check_ledger(), {})
+
+    def test_reconcile_command_fixes_drift(self):
+        order = make_orders(1, paid=Decimal('25.00'))[0]
+        Order.objects.filter(pk=order.pk).update(paid_amount=0, payment_state='pending')
+
+        with self.assertRaises(SystemExit):
+            call_command('reconcile_ledger', '--check', stdout=StringIO(), stderr=StringIO())
+        out = StringIO()
+        call_command('reconcile_ledger', stdout=out)
+        self.assertIn("Reconciled 1 order balance(s)", out.getvalue())
+        self.assertBalance(order, '25', '75', 'partial')
+        self.assertEqual(check_ledger(), {})
+
+    def test_finance_filters_on_payment_state(self):
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+        pending = make_orders(1)[0]
+        partial = make_orders(1, paid=Decimal('40.00'))[0]
+        paid = make_orders(1, paid=Decimal('100.00'))[0]
+
+        for state, order in [('pending', pending), ('partial', partial), ('paid', paid)]:
+            response = self.client.get(reverse('finance_dashboard'), {'status': state})
+            self.assertEqual([o.id for o in response.context['client_invoices']], [order.id])
+        response = self.client.get(reverse('finance_dashboard'))
+        self.assertEqual((response.context['total_invoices'], response.context['paid_invoices']), (3, 1))
+
+
+class FinanceDashboardTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(user)
+
+    def test_links_the_latest_invoice(self):
+        order = make_orders(1, paid=Decimal('10.00'))[0]
+        latest = Invoice.objects.create(order=order, amount=Decimal('5.00'), payment_method='cash')
+        unpaid = make_orders(1)[0]
+        response = self.client.get(reverse('finance_dashboard'))
+        rows = {o.id: o.latest_invoice_id for o in response.context['client_invoices']}
+        self.assertEqual(rows, {order.id: latest.id, unpaid.id: None})
+        self.assertContains(response, reverse('view_invoice', args=[latest.id]))
+
+    def test_query_count_does_not_grow_with_orders(self):
+        url = reverse('finance_dashboard')
+        make_orders(1, paid=Decimal('10.00'))
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        make_orders(30, paid=Decimal('10.00'))
+        make_orders(5)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertEqual(len(small), len(large))
+
+    def test_pages_newest_first(self):
+        orders = make_orders(5, paid=Decimal('10.00'))
+        response = self.client.get(reverse('finance_dashboard'), {'page_size': 2})
+        self.assertEqual(response.context['total_invoices'], 5)
+        self.assertContains(response, 'id="next-invoices"')
+        seen = [o.id for o in response.context['client_invoices']]
+        while response.context['next_query']:
+            response = self.client.get(reverse('finance_dashboard') + '?' + response.context['next_query'])
+            seen += [o.id for o in response.context['client_invoices']]
+        newest_first = sorted(orders, key=lambda o: (o.created_at, o.id), reverse=True)
+        self.assertEqual(seen, [o.id for o in newest_first])
+        self.assertNotContains(response, 'id="next-invoices"')
+
+
+class SeedPerfDataTests(TestCase):
+    def test_seeded_data_is_consistent(self):
+        out = StringIO()
+        call_command(
+            'seed_perf_data', '--clients=20', '--orders=60', '--materials=10', '--vendors=3',
+            '--reorders=15', '--activity=100', '--batch-size=25', stdout=out,
+        )
+        self.assertIn("60 orders", out.getvalue())
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertEqual(Reorder.objects.count(), 15)
+        # Everything the skipped signal handlers maintain
+        self.assertEqual(check_ledger(), {})
+        self.assertEqual(check_counters(), {})
+        self.assertEqual(rebuild_sequences(dry_run=True), {})
+        self.assertTrue(Order.objects.exclude(payment_state='pending').exists())
+
+        # Ids keep coming from the sequences afterwards
+        order = make_orders(1)[0]
+        self.assertEqual(order.order_id, Order.format_order_id(61))
+
+    def test_same_seed_same_data(self):
+        now = timezone.now()
+        first = [c.name for c in make_clients(random.Random(7), 50, now)]
+        second = [c.name for c in make_clients(random.Random(7), 50, now)]
+        self.assertEqual(first, second)
+
+
+@override_settings(PDF_RENDERER='core.tests.FakeRenderer')
+class LoadTestTests(LiveServerTestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        override = override_settings(PDF_CACHE_DIR=cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        User.objects.create_user('admin', password='pw', is_staff=True)
+        make_orders(3, paid=Decimal('10.00'))
+        rebuild_counters()
+
+    def start_pdf_worker(self):
+        stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                work(once=True)
+                stop.wait(0.02)
+            connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.set)
+
+    def test_replays_the_mix_against_a_live_server(self):
+        self.start_pdf_worker()
+        # One user: concurrent SQLite writes are what a real run measures,
+        # not what this test checks
+        rows, _ = run_load_test(self.live_server_url, 'admin', 'pw', users=1, duration=2, pdf_poll_interval=0.05)
+        by_endpoint = {row['endpoint']: row for row in rows}
+        self.assertEqual(by_endpoint['all']['errors'], 0, rows)
+        # Followed until the PDF arrived
+        self.assertEqual(set(by_endpoint['download_invoice_pdf']['statuses']), {'200'})
+        self.assertGreater(by_endpoint['all']['requests'], 10)
+        for row in rows:
+            self.assertLessEqual(row['p50'], row['p95'])
+            self.assertLessEqual(row['p95'], row['p99'])
+
+    def test_bad_credentials_fail_fast(self):
+        with self.assertRaises(LoadTestError):
+            run_load_test(self.live_server_url, 'admin', 'wrong', users=1, duration=1)
+
+    def test_pdf_download_without_a_worker_times_out(self):
+        path = reverse('download_invoice_pdf', args=[Invoice.objects.first().id])
+
+        async def download():
+            http = Connection(self.live_server_url)
+            try:
+                await login(http, 'admin', 'pw')
+                return await download_pdf(http, path, poll_interval=0.05, timeout=0.2)
+            finally:
+                http.close()
+
+        self.assertEqual(asyncio.run(download()).status, 'timeout')
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        profiling.clear()
+        self.addCleanup(profiling.clear)
+        self.user = User.objects.create_user('admin', password='pw', is_staff=True)
+
+    def test_sampled_request_gets_server_timing(self):
+        self.client.force_login(self.user)
+        make_orders(3)
+        response = self.client.get(reverse('order_dashboard'))
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'view;dur='):
+            self.assertIn(metric, timing)
+
+        [profile] = [p for p in profiling.profiles() if p['endpoint'] == 'order_dashboard']
+        self.assertGreater(profile['queries'], 0)
+        self.assertGreater(profile['template_ms'], 0)
+        self.assertLessEqual(profile['db_ms'] + profile['template_ms'], profile['view_ms'])
+
+    def test_server_timing_is_for_staff_only(self):
+        self.client.force_login(User.objects.create_user('clerk', password='pw'))
+        response = self.client.get(reverse('order_dashboard'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual([p['endpoint'] for p in profiling.profiles()], ['order_dashboard'])
+
+        self.client.logout()
+        with override_settings(PROFILING_SERVER_TIMING_PUBLIC=True):
+            self.assertIn('Server-Timing', self.client.get(reverse('admin_login')))
+
+    def test_repeated_statements_are_reported(self):
+        clients = make_clients(random.Random(1), 3, timezone.now())
+        Client.objects.bulk_create(clients)
+
+        def n_plus_one(request):
+            for client in Client.objects.all():
+                Order.objects.filter(client=client).exists()
+            return HttpResponse()
+
+        profiling.ProfilingMiddleware(n_plus_one)(RequestFactory().get('/'))
+        [profile] = profiling.profiles()
+        self.assertEqual(profile['duplicates'], 2)
+        [(sql, executions, _)] = profile['repeated']
+        self.assertIn('core_order', sql)
+        self.assertEqual(executions, 3)
+        self.assertEqual(profiling.repeated_queries([profile])[0]['executions'], 3)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(reverse('admin_login'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(profiling.profiles(), [])
+
+    @override_settings(PROFILING_KEEP=3)
+    def test_store_keeps_the_latest_profiles(self):
+        for number in range(5):
+            profiling.save({'number': number})
+        self.assertEqual(sorted(p['number'] for p in profiling.profiles()), [2, 3, 4])
+
+    def test_perf_page_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('clerk', password='pw'))
+        self.assertEqual(self.client.get(reverse('perf_dashboard')).status_code, 302)
+
+        self.client.force_login(self.user)
+        self.client.get(reverse('client_dashboard'))
+        response = self.client.get(reverse('perf_dashboard'))
+        self.assertContains(response, 'client_dashboard')
+
+
+def _count_in_child(amount):
+    metrics.REORDERS.inc(amount)
+    metrics.flush()
+
+
+def _count_and_exit_in_child(amount):
+    metrics.REORDERS.inc(amount)
+    # What atexit does in a process that exits normally (forked ones don't run it)
+    metrics._at_exit()
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.user = User.objects.create_user('admin', password='pw', is_staff=True)
+
+    def sample(self, line_start):
+        self.client.force_login(self.user)
+        text = self.client.get(reverse('metrics')).content.decode()
+        return [line for line in text.splitlines() if line.startswith(line_start)]
+
+    def test_hot_paths_are_counted(self):
+        self.client.post(reverse('admin_login'), {'username': 'admin', 'password': 'wrong'})
+        self.client.post(reverse('admin_login'), {'username': 'admin', 'password': 'pw'})
+        self.client.get(reverse('client_search_api'), {'q': 'cl'})
+        order = make_orders(1)[0]
+        self.client.post(reverse('finance_dashboard'), {
+            'record_payment': '1', 'order_id': order.id, 'paid_amount': '4.50',
+        })
+
+        self.assertEqual(self.sample('shop_login_attempts_total{'), [
+            'shop_login_attempts_total{result="invalid"} 1',
+            'shop_login_attempts_total{result="success"} 1',
+        ])
+        self.assertEqual(self.sample('shop_payments_recorded_total{'), [
+            'shop_payments_recorded_total{result="recorded"} 1',
+        ])
+        self.assertEqual(self.sample('shop_payment_amount_recorded_total '), [
+            'shop_payment_amount_recorded_total 4.5',
+        ])
+        self.assertEqual(self.sample('shop_client_search_seconds_count'), ['shop_client_search_seconds_count 1'])
+        self.assertIn(
+            'shop_http_requests_total{view="finance_dashboard",method="POST",status="302"} 1',
+            self.sample('shop_http_requests_total'),
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', "Test.", buckets=(0.1, 1))
+        self.addCleanup(metrics.REGISTRY.pop, 'test_seconds')
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        self.assertEqual(self.sample('test_seconds'), [
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 4.25',
+            'test_seconds_count 4',
+        ])
+
+    def test_values_of_other_processes_are_added(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            metrics.REORDERS.inc()
+            context = multiprocessing.get_context('fork')
+            for amount in (2, 3):
+                child = context.Process(target=_count_in_child, args=(amount,))
+                child.start()
+                child.join()
+            self.assertEqual(self.sample('shop_reorders_created_total'), ['shop_reorders_created_total 6'])
+
+    def test_exited_processes_are_folded_into_one_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            metrics.REORDERS.inc()
+            context = multiprocessing.get_context('fork')
+            exiting = context.Process(target=_count_and_exit_in_child, args=(2,))
+            exiting.start()
+            exiting.join()
+            killed = context.Process(target=_count_in_child, args=(3,))
+            killed.start()
+            killed.join()
+            self.assertFalse(list(Path(directory).glob(f'metrics-{exiting.pid}-*.json')))
+            self.assertTrue(list(Path(directory).glob(f'metrics-{killed.pid}-*.json')))
+
+            metrics.mark_process_dead(killed.pid)
+            self.assertFalse(list(Path(directory).glob(f'metrics-{killed.pid}-*.json')))
+            self.assertTrue((Path(directory) / 'exited.json').exists())
+            self.assertEqual(self.sample('shop_reorders_created_total'), ['shop_reorders_created_total 6'])
+            # Already folded in: not counted again
+            metrics.mark_process_dead(killed.pid)
+            self.assertEqual(self.sample('shop_reorders_created_total'), ['shop_reorders_created_total 6'])
+
+    def test_reused_pid_does_not_replace_earlier_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            for started, amount in [(1000, 2), (2000, 5)]:
+                snapshot = [['shop_reorders_created_total', [], amount]]
+                (Path(directory) / f'metrics-99999999-{started}.json').write_text(json.dumps(snapshot))
+            self.assertEqual(self.sample('shop_reorders_created_total'), ['shop_reorders_created_total 7'])
+            metrics.mark_process_dead(99999999)
+            self.assertEqual(self.sample('shop_reorders_created_total'), ['shop_reorders_created_total 7'])
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_staff_or_token_is_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 401)
+        self.client.force_login(User.objects.create_user('clerk', password='pw'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.client.logout()
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE shop_pdf_render_seconds histogram', response.content.decode())
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=True)
+    def test_public_only_when_opted_in(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        with override_settings(METRICS_PUBLIC=False):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+
+
+class ActivityFeedTests(TestCase):
+    def setUp(self):
+        # The feed version rolls back after each test, the cached feeds don't
+        cache.clear()
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_staff=True))
+
+    def log(self, activity_type, description):
+        with self.captureOnCommitCallbacks(execute=True):
+            ActivityLog.objects.create(activity_type=activity_type, description=description)
+
+    def test_every_icon_is_in_the_sprite(self):
+        sprite = (settings.BASE_DIR / 'static' / 'img' / 'activity-icons.svg').read_text()
+        for presentation in list(activity.PRESENTATION.values()) + [activity.DEFAULT]:
+            self.assertIn(f'<symbol id="{presentation.icon}"', sprite)
+
+    def test_rows_reference_the_sprite(self):
+        self.log('payment_recorded', 'Payment recorded: $5')
+        self.log('invoice_created', 'Invoice created')
+        html = activity.recent_feed()
+        self.assertIn('activity-icons.svg#activity-payment"', html)
+        self.assertIn('activity-icons.svg#activity-default"', html)
+        self.assertNotIn('<path', html)
+
+    def test_feed_is_cached_until_a_new_entry(self):
+        url = reverse('main_dashboard')
+        self.log('client_created', 'Client created: Acme')
+        self.assertContains(self.client.get(url), 'Client created: Acme')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([q for q in queries if 'core_activitylog' in q['sql']])
+
+        self.log('order_created', 'Order created: ORD-0001')
+        self.assertContains(self.client.get(url), 'Order created: ORD-0001')
+
+    def test_write_in_another_process_retires_the_cached_feed(self):
+        # Two per-process caches: the writer's cache is not the reader's
+        reader = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'reader'}}
+        writer = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'writer'}}
+        with override_settings(CACHES=reader):
+            self.assertNotIn('Client created: Acme', activity.recent_feed())
+        with override_settings(CACHES=writer):
+            self.log('client_created', 'Client created: Acme')
+        with override_settings(CACHES=reader):
+            self.assertIn('Client created: Acme', activity.recent_feed())
+
+
+@override_settings(ACTIVITY_LOG_BATCH_SIZE=3)
+class ActivityWriterTests(TestCase):
+    def setUp(self):
+        self.writer = activity.ActivityWriter(background=False)
+        self.user = User.objects.create_user('admin', password='pw', is_staff=True)
+
+    def entry(self, number, **kwargs):
+        return ActivityLog(activity_type='client_created', description=f"Client {number}", **kwargs)
+
+    def test_entries_are_written_in_one_batch(self):
+        self.writer.add(self.entry(1))
+        self.writer.add(self.entry(2))
+        self.assertFalse(ActivityLog.objects.exists())
+        self.assertFalse(self.writer.wake.is_set())
+        self.writer.add(self.entry(3))
+        # A full batch wakes the background thread
+        self.assertTrue(self.writer.wake.is_set())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.writer.flush(), 3)
+        # One INSERT, plus the feed version bump
+        self.assertEqual(len([q for q in queries if 'core_activitylog' in q['sql']]), 1)
+        self.assertEqual(ActivityLog.objects.count(), 3)
+        self.assertEqual(self.writer.flush(), 0)
+
+    def test_entries_keep_the_time_they_were_logged(self):
+        entry = self.entry(1)
+        logged_at = entry.created_at
+        time.sleep(0.01)
+        self.writer.add(entry)
+        self.writer.flush()
+        self.assertEqual(ActivityLog.objects.get().created_at, logged_at)
+
+    def test_queued_after_commit_only(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            activity.log('client_created', 'Client created: Acme', user=self.user)
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(ActivityLog.objects.exists())
+
+    def test_critical_entries_are_part_of_the_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    activity.log('payment_recorded', 'Payment recorded: $5', user=self.user, critical=True)
+                    self.assertEqual(ActivityLog.objects.count(), 1)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertFalse(ActivityLog.objects.exists())
+
+    def test_payment_is_logged_at_once(self):
+        self.client.force_login(self.user)
+        order = make_orders(1)[0]
+        self.client.post(reverse('finance_dashboard'), {
+            'record_payment': '1', 'order_id': order.id, 'paid_amount': '2.00',
+        })
+        self.assertEqual(ActivityLog.objects.get().activity_type, 'payment_recorded')
+
+
+class ActivityWriterThreadTests(TransactionTestCase):
+    def test_a_bad_entry_does_not_lose_the_batch(self):
+        # Foreign keys are checked on commit, which a TestCase never reaches
+        user = User.objects.create_user('admin', password='pw', is_staff=True)
+        writer = activity.ActivityWriter(background=False)
+        writer.add(ActivityLog(activity_type='client_created', description="kept", user_id=user.id))
+        writer.add(ActivityLog(activity_type='client_created', description="bad", user_id=user.id + 1000))
+        with self.assertLogs('core.activity', 'ERROR') as logs:
+            self.assertEqual(writer.flush(), 1)
+        self.assertIn("Dropped activity log entry 'bad'", logs.output[0])
+        self.assertEqual(list(ActivityLog.objects.values_list('description', flat=True)), ['kept'])
+
+    @override_settings(ACTIVITY_LOG_FLUSH_INTERVAL=0.05)
+    def test_background_thread_flushes_and_close_drains(self):
+        writer = activity.ActivityWriter()
+        writer.add(ActivityLog(activity_type='client_created', description="first"))
+        deadline = time.monotonic() + 5
+        while not ActivityLog.objects.exists() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(ActivityLog.objects.count(), 1)
+
+        writer.close()
+        self.assertFalse(writer.thread.is_alive())
+        writer.add(ActivityLog(activity_type='client_created', description="late"))
+        writer.close()
+        self.assertEqual(ActivityLog.objects.count(), 2)
+
+
+class ActivityArchiveTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        override = override_settings(ACTIVITY_ARCHIVE_DIR=self.archive_dir, ACTIVITY_RETENTION_DAYS=30)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.now = timezone.now()
+
+    def log(self, days_ago, activity_type='client_created'):
+        return ActivityLog.objects.create(
+            activity_type=activity_type, description=f"{activity_type} {days_ago}d ago",
+            created_at=self.now - timedelta(days=days_ago),
+        )
+
+    def test_old_entries_move_to_monthly_files_with_rollups(self):
+        old = [self.log(40), self.log(40, 'order_created'), self.log(75), self.log(75)]
+        recent = self.log(2)
+
+        moved = activity_archive.archive(batch_size=3, now=self.now)
+        self.assertEqual(moved, 4)
+        self.assertEqual(list(ActivityLog.objects.values_list('id', flat=True)), [recent.id])
+
+        archived = []
+        for entry in old:
+            month = timezone.localdate(entry.created_at)
+            archived += [row['id'] for row in activity_archive.read_archive(month)]
+        self.assertEqual(sorted(set(archived)), sorted(entry.id for entry in old))
+
+        day = timezone.localdate(old[2].created_at)
+        self.assertEqual(ActivityRollup.objects.get(day=day, activity_type='client_created').count, 2)
+        counts = activity_archive.daily_counts()
+        self.assertEqual(counts[day, 'client_created'], 2)
+        self.assertEqual(counts[timezone.localdate(recent.created_at), 'client_created'], 1)
+
+    def test_runs_are_incremental(self):
+        first = self.log(40)
+        self.assertEqual(activity_archive.archive(now=self.now), 1)
+        self.assertEqual(activity_archive.archive(now=self.now), 0)
+
+        # Same day and month as the first run: appended and added up
+        second = ActivityLog.objects.create(
+            activity_type='client_created', description="late", created_at=first.created_at,
+        )
+        self.assertEqual(activity_archive.archive(now=self.now), 1)
+        month = timezone.localdate(first.created_at)
+        self.assertEqual([row['id'] for row in activity_archive.read_archive(month)], [first.id, second.id])
+        self.assertEqual(ActivityRollup.objects.get().count, 2)
+
+    def test_overlapping_runs_count_each_entry_once(self):
+        entries = [self.log(40), self.log(40)]
+        rows = list(ActivityLog.objects.order_by('id').values(*activity_archive.FIELDS))
+        # Two runs that read the same batch before either deleted it
+        self.assertEqual(activity_archive._archive_batch(rows), 2)
+        self.assertEqual(activity_archive._archive_batch(rows), 0)
+        self.assertEqual(ActivityRollup.objects.get().count, 2)
+        month = timezone.localdate(entries[0].created_at)
+        self.assertEqual(len(activity_archive.read_archive(month)), 2)
+
+    def test_interrupted_write_leaves_the_month_readable(self):
+        first = self.log(40)
+        activity_archive.archive(now=self.now)
+        directory = activity_archive.month_dir(timezone.localdate(first.created_at))
+        # A run that died half way through writing its batch
+        torn = directory / '.tmp-torn'
+        torn.write_bytes(gzip.compress(b'{"id": 0}\n' * 100)[:50])
+
+        second = ActivityLog.objects.create(
+            activity_type='client_created', description="late", created_at=first.created_at,
+        )
+        self.assertEqual(activity_archive.archive(now=self.now), 1)
+        month = timezone.localdate(first.created_at)
+        self.assertEqual([row['id'] for row in activity_archive.read_archive(month)], [first.id, second.id])
+        self.assertEqual(len(list(directory.glob('*.jsonl.gz'))), 2)
+
+        # Cleaned up once it is old enough not to belong to a running run
+        old = timezone.now().timestamp() - activity_archive.STALE_TMP_SECONDS - 1
+        os.utime(torn, (old, old))
+        activity_archive.archive(now=self.now)
+        self.assertFalse(torn.exists())
+
+    def test_max_rows_and_dry_run(self):
+        for _ in range(5):
+            self.log(40)
+        out = StringIO()
+        call_command('archive_activity', '--dry-run', stdout=out)
+        self.assertIn("5 entries", out.getvalue())
+        self.assertEqual(ActivityLog.objects.count(), 5)
+
+        call_command('archive_activity', '--max-rows=2', '--batch-size=1', stdout=StringIO())
+        self.assertEqual(ActivityLog.objects.count(), 3)
+        call_command('archive_activity', stdout=StringIO())
+        self.assertFalse(ActivityLog.objects.exists())
+        self.assertEqual(sum(ActivityRollup.objects.values_list('count', flat=True)), 5)
@@ -0,0 +1,171 @@
+"""
+Performance budgets: every URL in core/urls.py against production-sized
+data (core/perfdata.py), with limits on SQL queries, wall time and
+response size.
+
+Seeding takes a while, so the budgets only run on request (that every
+URL has one is checked with the regular suite):
+
+    PERF_BUDGETS=1 python manage.py test core.tests_perf
+
+PERF_SCALE=0.1 shrinks the seeded volumes for a quick look (the budgets
+still apply). The measurements are written to perf-report.json, or to
+PERF_REPORT, so they can be compared across commits.
+"""
+import json
+import os
+import statistics
+import subprocess
+import time
+import unittest
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import perfdata, urls
+from .models import Client, Invoice, Material, PDFJob
+
+VOLUMES = {'clients': 10000, 'orders': 50000, 'materials': 2000, 'activity': 200000}
+RUNS = 3
+
+Budget = namedtuple('Budget', 'queries ms kb')
+
+# url name -> (budget, url kwargs, GET params). Kwargs name the seeded
+# object to use; budgets leave headroom over the measured values so that
+# only real regressions fail.
+CASES = {
+    'admin_login': (Budget(queries=0, ms=50, kb=20), {}, {}),
+    'main_dashboard': (Budget(queries=6, ms=100, kb=80), {}, {}),
+    'client_dashboard': (Budget(queries=6, ms=150, kb=100), {}, {}),
+    'client_avatar': (Budget(queries=4, ms=50, kb=1), {'client_id': 'client'}, {}),
+    'order_dashboard': (Budget(queries=6, ms=150, kb=100), {}, {'status': 'shipped'}),
+    'add_order_for_client': (Budget(queries=4, ms=50, kb=40), {'client_id': 'client'}, {}),
+    # These two still render every matching material on one page
+    'reorder_dashboard': (Budget(queries=8, ms=300, kb=700), {}, {}),
+    'inventory_dashboard': (Budget(queries=8, ms=1200, kb=6000), {}, {}),
+    'finance_dashboard': (Budget(queries=8, ms=300, kb=700), {}, {}),
+    'view_invoice': (Budget(queries=5, ms=50, kb=30), {'invoice_id': 'invoice'}, {}),
+    'download_invoice_pdf': (Budget(queries=12, ms=100, kb=10), {'invoice_id': 'invoice'}, {}),
+    'export_invoice_pdfs': (Budget(queries=6, ms=5000, kb=50), {}, 'export'),
+    'pdf_job_status': (Budget(queries=4, ms=50, kb=1), {'job_id': 'job'}, {}),
+    'client_search_api': (Budget(queries=4, ms=100, kb=5), {}, {'q': 'sa'}),
+    'client_page_api': (Budget(queries=5, ms=150, kb=100), {}, {}),
+    'order_page_api': (Budget(queries=5, ms=150, kb=100), {}, {}),
+    'material_vendors': (Budget(queries=4, ms=50, kb=5), {'material_id': 'material'}, {}),
+    'perf_dashboard': (Budget(queries=3, ms=100, kb=100), {}, {}),
+    'metrics': (Budget(queries=2, ms=50, kb=30), {}, {}),
+    'logout': (Budget(queries=3, ms=50, kb=20), {}, {}),
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@unittest.skipUnless(os.environ.get('PERF_BUDGETS'), "set PERF_BUDGETS=1 to run the performance budgets")
+class PerformanceBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        scale = float(os.environ.get('PERF_SCALE', '1'))
+        cls.volumes = {name: max(1, int(count * scale)) for name, count in VOLUMES.items()}
+        start = time.perf_counter()
+        cls.seeded = perfdata.seed(**cls.volumes)
+        cls.seed_seconds = round(time.perf_counter() - start, 1)
+
+        cls.user = User.objects.create_user('admin', password='pw', is_staff=True)
+        invoice = Invoice.objects.order_by('id').first()
+        cls.objects = {
+            'client': Client.objects.order_by('id').first().pk,
+            'invoice': invoice.pk,
+            'material': Material.objects.order_by('id').first().pk,
+            'job': PDFJob.objects.create(invoice=invoice).pk,
+        }
+        day = timezone.localdate(invoice.created_at).isoformat()
+        cls.export_params = {'start': day, 'end': day, 'client': invoice.order.client_id}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        report = {
+            'commit': _git_commit(),
+            'generated_at': timezone.now().isoformat(),
+            'volumes': cls.seeded,
+            'seed_seconds': cls.seed_seconds,
+            'views': cls.results,
+        }
+        path = Path(os.environ.get('PERF_REPORT') or settings.BASE_DIR / 'perf-report.json')
+        path.write_text(json.dumps(report, indent=2, sort_keys=True) + '\n')
+        super().tearDownClass()
+
+    def measure(self, name):
+        budget, kwargs, params = CASES[name]
+        url = reverse(name, kwargs={key: self.objects[value] for key, value in kwargs.items()})
+        if params == 'export':
+            params = self.export_params
+
+        timings = []
+        for _ in range(RUNS):
+            if name == 'admin_login':
+                self.client.logout()
+            else:
+                self.client.force_login(self.user)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = self.client.get(url, params)
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append((time.perf_counter() - start) * 1000)
+
+        result = {
+            'url': url,
+            'status': response.status_code,
+            'queries': len(queries),
+            'ms': round(statistics.median(timings), 1),
+            'kb': round(len(body) / 1024, 1),
+            'budget': budget._asdict(),
+        }
+        result['ok'] = (
+            result['status'] < 500
+            and result['queries'] <= budget.queries
+            and result['ms'] <= budget.ms
+            and result['kb'] <= budget.kb
+        )
+        self.results[name] = result
+        return result
+
+    def assertWithinBudget(self, name):
+        result = self.measure(name)
+        budget = CASES[name][0]
+        self.assertLess(result['status'], 500)
+        self.assertLessEqual(result['queries'], budget.queries, "SQL queries")
+        self.assertLessEqual(result['ms'], budget.ms, "median wall time (ms)")
+        self.assertLessEqual(result['kb'], budget.kb, "response size (KiB)")
+
+    def test_budgets(self):
+        for name in CASES:
+            with self.subTest(view=name):
+                self.assertWithinBudget(name)
+
+
+class BudgetCoverageTests(SimpleTestCase):
+    """Runs with the regular suite: a new URL must come with a budget"""
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - set(CASES), set())
@@ -0,0 +1,187 @@
+# core/typeahead.py
+"""
+In-memory prefix index for the client typeahead (``client_search_api``).
+
+Every process keeps three sorted lists of ``(key, client id)``: full names,
+single name words and emails, all lowercased. A query is a ``bisect`` to
+the first key >= the query, then a walk while keys still start with it,
+so a lookup costs O(log n + limit) and never touches the database.
+
+Writes in this process are applied incrementally (``insort``/removal) once
+their transaction commits. Other processes learn about them through the
+``client_typeahead`` sequence: every client write bumps it, and a process
+whose index is older than the sequence rebuilds it. The sequence is read
+at most every ``TYPEAHEAD_RECHECK`` seconds, by one request at a time. A
+rebuild reads every client (about a second at 100k), so it runs in a
+background thread while lookups keep being answered from the old index;
+another worker's edit shows up once it is done. Only the very first
+lookup, with nothing to answer from yet, waits for the build.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Client, Sequence
+from .sequences import next_value
+
+logger = logging.getLogger(__name__)
+
+VERSION_SEQUENCE = 'client_typeahead'
+
+
+def _keys(name, email):
+    """(full name, words, email) keys of one client"""
+    name = (name or '').strip().lower()
+    words = set(name.split()) - {name}
+    return name, words, (email or '').strip().lower()
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.names = []
+        self.words = []
+        self.emails = []
+        self.clients = {}  # id -> (name, email)
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        # Held for the whole of a rebuild, so there is only one at a time
+        self.build_lock = threading.Lock()
+        self.rebuild_thread = None
+
+    # === BUILDING ===
+
+    def _add(self, client_id, name, email):
+        full, words, mail = _keys(name, email)
+        if full:
+            insort(self.names, (full, client_id))
+        for word in words:
+            insort(self.words, (word, client_id))
+        if mail:
+            insort(self.emails, (mail, client_id))
+        self.clients[client_id] = (name, email)
+
+    def _remove(self, client_id):
+        if client_id not in self.clients:
+            return
+        full, words, mail = _keys(*self.clients.pop(client_id))
+        for keys, key in [(self.names, full), (self.emails, mail)] + [(self.words, w) for w in words]:
+            position = bisect_left(keys, (key, client_id))
+            if position < len(keys) and keys[position] == (key, client_id):
+                del keys[position]
+
+    def rebuild(self):
+        version = current_version()
+        self.load(Client.objects.values_list('id', 'name', 'email'), version)
+
+    def _rebuild_in_background(self):
+        if not self.build_lock.acquire(blocking=False):
+            return  # already under way
+        self.rebuild_thread = threading.Thread(target=self._run_rebuild, name='typeahead-rebuild', daemon=True)
+        self.rebuild_thread.start()
+
+    def _run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Typeahead rebuild failed; lookups use the old index")
+        finally:
+            self.build_lock.release()
+            # This thread's own connection
+            connections.close_all()
+
+    def load(self, rows, version):
+        """Replace the whole index with ``(id, name, email)`` rows"""
+        rows = list(rows)
+        names, words, emails = [], [], []
+        for client_id, name, email in rows:
+            full, client_words, mail = _keys(name, email)
+            if full:
+                names.append((full, client_id))
+            words.extend((word, client_id) for word in client_words)
+            if mail:
+                emails.append((mail, client_id))
+        names.sort()
+        words.sort()
+        emails.sort()
+        with self.lock:
+            self.names, self.words, self.emails = names, words, emails
+            self.clients = {client_id: (name, email) for client_id, name, email in rows}
+            self.version = version
+            self.checked_at = time.monotonic()
+
+    def reset(self):
+        """Forget everything; the next lookup rebuilds"""
+        with self.lock:
+            self.version = None
+
+    def apply(self, client_id, name=None, email=None, version=None):
+        """Replace (or with no ``name``, drop) one client after a committed write"""
+        with self.lock:
+            if self.version is None:
+                return
+            self._remove(client_id)
+            if name is not None:
+                self._add(client_id, name, email)
+            # Only current if no other process wrote in between
+            if version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                self.checked_at = 0.0
+
+    # === LOOKUPS ===
+
+    def ensure_fresh(self):
+        recheck = getattr(settings, 'TYPEAHEAD_RECHECK', 1.0)
+        with self.lock:
+            version = self.version
+            if version is not None:
+                if time.monotonic() - self.checked_at < recheck:
+                    return
+                # The other requests skip the check while this one makes it
+                self.checked_at = time.monotonic()
+        if version is None:
+            with self.build_lock:
+                if self.version is None:
+                    self.rebuild()
+        elif current_version() != version:
+            self._rebuild_in_background()
+
+    def search(self, query, limit=10):
+        """Client ids for ``query``: name prefixes, then word prefixes, then emails"""
+        query = query.strip().lower()
+        found = []
+        with self.lock:
+            for keys in (self.names, self.words, self.emails):
+                position = bisect_left(keys, (query,))
+                while position < len(keys) and len(found) < limit:
+                    key, client_id = keys[position]
+                    if not key.startswith(query):
+                        break
+                    if client_id not in found:
+                        found.append(client_id)
+                    position += 1
+                if len(found) >= limit:
+                    break
+            return [(client_id, *self.clients[client_id]) for client_id in found]
+
+
+def current_version():
+    return Sequence.objects.filter(name=VERSION_SEQUENCE).values_list('last_value', flat=True).first() or 0
+
+
+def bump_version():
+    return next_value(VERSION_SEQUENCE)
+
+
+index = PrefixIndex()
+
+
+def search(query, limit=10):
+    """``[(id, name, email), ...]`` of the best ``limit`` clients for ``query``"""
+    index.ensure_fresh()
+    return index.search(query, limit)
@@ -6,6 +6,7 @@ urlpatterns = [
     path('', views.admin_login, name='admin_login'),           # Root = login page
     path('dashboard/', views.main_dashboard, name='main_dashboard'),  # ← Changed this!
     path('client/', views.client_dashboard, name='client_dashboard'),
+    path('client/<int:client_id>/avatar/', views.client_avatar, name='client_avatar'),
     path('order/', views.order_dashboard, name='order_dashboard'),      
     path('order/add/<int:client_id>/', views.add_order_for_client, name='add_order_for_client'),
     path('reorder/', views.reorder_dashboard, name='reorder_dashboard'),
@@ -13,7 +14,13 @@ urlpatterns = [
     path('finance/', views.finance_dashboard, name='finance_dashboard'),
     path('finance/invoice/<int:invoice_id>/', views.view_invoice, name='view_invoice'),
     path('finance/invoice/<int:invoice_id>/pdf/', views.download_invoice_pdf, name='download_invoice_pdf'),
+    path('finance/invoices/export/', views.export_invoice_pdfs, name='export_invoice_pdfs'),
+    path('finance/pdf-jobs/<int:job_id>/', views.pdf_job_status, name='pdf_job_status'),
     path('api/clients/', views.client_search_api, name='client_search_api'),
+    path('api/clients/page/', views.client_page_api, name='client_page_api'),
+    path('api/orders/', views.order_page_api, name='order_page_api'),
     path('api/material/<int:material_id>/vendors/', views.get_material_vendors, name='material_vendors'),
+    path('perf/', views.perf_dashboard, name='perf_dashboard'),
+    path('metrics', views.metrics_endpoint, name='metrics'),
     path('logout/', views.admin_logout, name='logout'),
 ]
\ No newline at end of file
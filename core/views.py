@@ -1,11 +1,22 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from .models import Client, Invoice, Order, Material, Vendor, Reorder , ActivityLog
+from .models import Client, Invoice, Order, Material, Vendor, Reorder , PDFJob
 from .forms import ClientForm, OrderForm
+from .counters import get_counters
+from .pagination import get_page_size, keyset_page, page_query, sort_fields
+from .avatars import VARIANTS as AVATAR_VARIANTS, get_or_create_thumbnail
+from . import pdf_cache
+from . import search as search_index
+from . import typeahead
+from . import metrics, profiling
+from .activity import log as log_activity, recent_feed
+from .ledger import latest_invoice_id
+from .invoice_pdfs import export_queryset, get_bank_details, invoice_html, pdf_filename, stream_zip
+from .pdf_jobs import enqueue
 from  django.http import JsonResponse
 from django.urls import reverse
 from django.contrib.auth import authenticate, login
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.http import require_http_methods
 from django.db.models import Q, Count, Sum , F , DecimalField
 from core.models import Material
@@ -13,41 +24,23 @@ import json
 from datetime import datetime
 from django.utils import timezone
 from decimal import Decimal, InvalidOperation
-from django.http import HttpResponse , Http404
+from django.http import HttpResponse , Http404, FileResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+import hmac
 import random
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 import os
-import tempfile
-import subprocess
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db.models.functions import Coalesce
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_protect
 from django.contrib.auth.decorators import login_required
 
 
-BANKS = [
-    "Global Trust Bank",
-    "Penta Financial Services",
-    "Horizon Capital Bank",
-    "Summit National Bank",
-    "Vertex Banking, Ltd."
-]
-
-IBANS = [
-    "DE89370400440532013000",
-    "FR1420041010050500013M02606",
-    "GB29NWBK60161331926819",
-    "IT60X0542811101000000123456",
-    "ES9121000418450200051332"
-]
-
-def get_bank_details(invoice_id):
-    """Return consistent bank name and IBAN for a given invoice ID."""
-    index = invoice_id % len(BANKS)  
-    return BANKS[index], IBANS[index]
-
 # models.py
 
 @csrf_protect
@@ -67,85 +60,19 @@ def admin_logout(request):
 
 @login_required
 def main_dashboard(request):
-    # Calculate stats
-    total_clients = Client.objects.count()
-    total_orders = Order.objects.count()
-    total_materials = Material.objects.count()
-    low_stock_materials = Material.objects.filter(quantity__lte=F('threshold')).count()
-    out_of_stock_materials = Material.objects.filter(quantity__lte=0).count()
-    
-    # Calculate finance stats
-    orders_with_payments = Order.objects.prefetch_related('invoices').all()
-    total_invoices = orders_with_payments.count()
-    unpaid_invoices = 0
-    
-    for order in orders_with_payments:
-        total_paid = sum(invoice.amount for invoice in order.invoices.all())
-        remaining = order.payment - total_paid
-        if remaining > 0:
-            unpaid_invoices += 1
-    
-    # ✅ GET RECENT ACTIVITIES FROM ACTIVITY LOG - WITH COMPLETE ICON MAPPING
-    recent_activities = []
-    activity_logs = ActivityLog.objects.order_by('-created_at')[:8]
-    
-    for log in activity_logs:
-        # Map activity types to icons and colors
-        if log.activity_type == 'client_created':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M17 21v-2a4 4 0 0 0-4-4H5a4 4 0 0 0-4 4v2"></path><circle cx="9" cy="7" r="4"></circle><path d="M23 21v-2a4 4 0 0 0-3-3.87"></path><path d="M16 3.13a4 4 0 0 1 0 7.75"></path></svg>'
-            color = 'rgba(14, 116, 144, 0.2)'
-        elif log.activity_type == 'client_updated':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M17 21v-2a4 4 0 0 0-4-4H5a4 4 0 0 0-4 4v2"></path><circle cx="9" cy="7" r="4"></circle><path d="M23 21v-2a4 4 0 0 0-3-3.87"></path><path d="M16 3.13a4 4 0 0 1 0 7.75"></path></svg>'
-            color = 'rgba(14, 116, 144, 0.2)'
-        elif log.activity_type == 'client_deleted':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M21 16V8a2 2 0 0 0-1-1.73l-7-4a2 2 0 0 0-2 0l-7 4A2 2 0 0 0 3 8v8a2 2 0 0 0 1 1.73l7 4a2 2 0 0 0 2 0l7-4A2 2 0 0 0 21 16z"></path><line x1="3" y1="20" x2="21" y2="20"></line></svg>'
-            color = 'rgba(239, 68, 68, 0.2)'
-        elif log.activity_type == 'order_created':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M21 16V8a2 2 0 0 0-1-1.73l-7-4a2 2 0 0 0-2 0l-7 4A2 2 0 0 0 3 8v8a2 2 0 0 0 1 1.73l7 4a2 2 0 0 0 2 0l7-4A2 2 0 0 0 21 16z"></path></svg>'
-            color = 'rgba(59, 130, 246, 0.2)'
-        elif log.activity_type == 'order_updated':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M21 16V8a2 2 0 0 0-1-1.73l-7-4a2 2 0 0 0-2 0l-7 4A2 2 0 0 0 3 8v8a2 2 0 0 0 1 1.73l7 4a2 2 0 0 0 2 0l7-4A2 2 0 0 0 21 16z"></path><polyline points="3.27 6.96 12 12.01 20.73 6.96"></polyline><line x1="12" y1="22.08" x2="12" y2="12"></line></svg>'
-            color = 'rgba(59, 130, 246, 0.2)'
-        elif log.activity_type == 'order_deleted':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M21 16V8a2 2 0 0 0-1-1.73l-7-4a2 2 0 0 0-2 0l-7 4A2 2 0 0 0 3 8v8a2 2 0 0 0 1 1.73l7 4a2 2 0 0 0 2 0l7-4A2 2 0 0 0 21 16z"></path><line x1="3" y1="20" x2="21" y2="20"></line></svg>'
-            color = 'rgba(239, 68, 68, 0.2)'
-        elif log.activity_type == 'payment_recorded':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><rect x="2" y="5" width="20" height="14" rx="2"></rect><line x1="6" y1="12" x2="6" y2="12"></line><line x1="10" y1="12" x2="14" y2="12"></line><line x1="18" y1="12" x2="18" y2="12"></line></svg>'
-            color = 'rgba(16, 185, 129, 0.2)'
-        elif log.activity_type == 'material_created':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M2 3h6a4 4 0 0 1 4 4v14a3 3 0 0 0-3-3H2z"></path><path d="M22 3h-6a4 4 0 0 0-4 4v14a3 3 0 0 1 3-3h7z"></path></svg>'
-            color = 'rgba(245, 158, 11, 0.2)'
-        elif log.activity_type == 'material_updated':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M2 3h6a4 4 0 0 1 4 4v14a3 3 0 0 0-3-3H2z"></path><path d="M22 3h-6a4 4 0 0 0-4 4v14a3 3 0 0 1 3-3h7z"></path><line x1="12" y1="6" x2="12" y2="12"></line></svg>'
-            color = 'rgba(245, 158, 11, 0.2)'
-        elif log.activity_type == 'material_deleted':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M2 3h6a4 4 0 0 1 4 4v14a3 3 0 0 0-3-3H2z"></path><path d="M22 3h-6a4 4 0 0 0-4 4v14a3 3 0 0 1 3-3h7z"></path><line x1="3" y1="20" x2="21" y2="20"></line></svg>'
-            color = 'rgba(239, 68, 68, 0.2)'
-        elif log.activity_type == 'reorder_created':
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><path d="M20 16v-6a2 2 0 0 0-2-2H6a2 2 0 0 0-2 2v6"></path><rect x="4" y="14" width="16" height="6" rx="2"></rect><line x1="12" y1="6" x2="12" y2="12"></line></svg>'
-            color = 'rgba(245, 158, 11, 0.2)'
-        else:
-            # Default icon for other activities
-            icon = '<svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2"><circle cx="12" cy="12" r="10"></circle></svg>'
-            color = 'rgba(107, 114, 128, 0.2)'
-        
-        recent_activities.append({
-            'description': log.description,
-            'timestamp': log.created_at.strftime('%b %d'),
-            'icon': icon,
-            'icon_color': color,
-            'category': log.activity_type.split('_')[0]
-        })
-    
+    # Calculate stats (materialized counters, see core/counters.py)
+    counters = get_counters()
+
     context = {
-        'total_clients': total_clients,
-        'total_orders': total_orders,
-        'total_materials': total_materials,
-        'low_stock_materials': low_stock_materials,
-        'out_of_stock_materials': out_of_stock_materials,
-        'total_invoices': total_invoices,
-        'unpaid_invoices': unpaid_invoices,
-        'recent_activities': recent_activities,
+        'total_clients': counters['clients_total'],
+        'total_orders': counters['orders_total'],
+        'total_materials': counters['materials_total'],
+        'low_stock_materials': counters['materials_below_threshold'],
+        'out_of_stock_materials': counters['materials_out_of_stock'],
+        'total_invoices': counters['orders_total'],
+        'unpaid_invoices': counters['orders_unpaid'],
+        # Rendered once per ActivityLog write (core/activity.py)
+        'activity_feed': recent_feed(),
     }
     
     return render(request, 'main.html', context)
@@ -199,9 +126,10 @@ def home(request):
 @login_required
 def client_dashboard(request):
     # === CALCULATE STATS ===
-    total_clients = Client.objects.count()
-    active_clients = Client.objects.filter(is_active=True).count()
-    inactive_clients = Client.objects.filter(is_active=False).count()
+    counters = get_counters()
+    total_clients = counters['clients_total']
+    active_clients = counters['clients_active']
+    inactive_clients = counters['clients_inactive']
 
     # Clients created this month
     now = datetime.now()
@@ -226,7 +154,7 @@ def client_dashboard(request):
         client.delete()
         
         # activity log
-        ActivityLog.objects.create(
+        log_activity(
             activity_type = 'client_deleted',
             description = f'Client deleted : {client_name}',
             user = request.user,
@@ -251,7 +179,7 @@ def client_dashboard(request):
             
             #activity log
             if action == "added":
-                ActivityLog.objects.create(
+                log_activity(
                     activity_type = 'client_created',
                     description = f'New client created : {client.name}',
                         user = request.user,
@@ -259,7 +187,7 @@ def client_dashboard(request):
                 )
             
             else:
-                ActivityLog.objects.create(
+                log_activity(
                     activity_type = 'client_updated',
                     description =  f'Client Updated : {client.name}',
                     user = request.user,
@@ -271,15 +199,30 @@ def client_dashboard(request):
     else:
         form = ClientForm()
 
-        # === FILTER & SEARCH LOGIC ===
-    clients = Client.objects.all()
-    search = request.GET.get('search')
-    status = request.GET.get('status')
+    # === FILTER, SEARCH & PAGINATION (keyset on created_at, id) ===
+    clients = filter_clients(request.GET)
+    try:
+        page = keyset_page(clients, request.GET.get('cursor'), get_page_size(request), sort_fields(clients))
+    except ValueError:
+        page = keyset_page(clients, None, get_page_size(request), sort_fields(clients))
+        
+    return render(request, 'client.html', {
+        'clients': page.items,
+        'next_cursor': page.next_cursor,
+        'next_query': page_query(request, page.next_cursor) if page.next_cursor else '',
+        'form': form,
+        'total_clients': total_clients,
+        'active_clients': active_clients,
+        'inactive_clients': inactive_clients,
+        'this_month_clients': this_month_clients,
+    })
+
 
-    # === FILTER & SEARCH LOGIC ===
+def filter_clients(params):
+    """Clients matching the dashboard's search box and status filter"""
     clients = Client.objects.all()
-    search = request.GET.get('search')
-    status = request.GET.get('status')
+    search = params.get('search')
+    status = params.get('status')
 
     # === SEARCH LOGIC ===
     if search:
@@ -287,11 +230,18 @@ def client_dashboard(request):
         # 1. Name starts with 'search' (e.g., "a" finds "Ahmed")
         # 2. Name contains " search" (e.g., " Baig" finds "Saad Baig")
         # 3. Company starts with 'search' (e.g., "Ham" finds "Hamdard")
-        query_filter = (
-            Q(name__istartswith=search) | 
-            Q(name__icontains=" " + search) | 
-            Q(company__istartswith=search)
-        )
+        # Answered by the FTS index (core/search.py) where available
+        matches = search_index.matches(Client, search, ('name', 'secondary'))
+        if matches is not None:
+            query_filter = Q(id__in=matches)
+            # Best match first: a name hit before a company hit
+            clients = clients.annotate(relevance=search_index.relevance(Client, search, ('name', 'secondary')))
+        else:
+            query_filter = (
+                Q(name__istartswith=search) | 
+                Q(name__icontains=" " + search) | 
+                Q(company__istartswith=search)
+            )
         
         # If search is a number (e.g., "31"), also check Client ID
         if search.isdigit():
@@ -304,40 +254,88 @@ def client_dashboard(request):
         clients = clients.filter(is_active=True)
     elif status == 'inactive':
         clients = clients.filter(is_active=False)
-        
-    return render(request, 'client.html', {
-        'clients': clients,
-        'form': form,
-        'total_clients': total_clients,
-        'active_clients': active_clients,
-        'inactive_clients': inactive_clients,
-        'this_month_clients': this_month_clients,
+    return clients
+
+
+@login_required
+def client_page_api(request):
+    """Next page of the client table, for infinite scroll on the client dashboard"""
+    clients = filter_clients(request.GET)
+    try:
+        page = keyset_page(clients, request.GET.get('cursor'), get_page_size(request), sort_fields(clients))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'html': render_to_string('client_rows.html', {'clients': page.items}, request=request),
+        'clients': [
+            {
+                'id': client.id,
+                'name': client.name,
+                'avatar': client.avatar_thumbnail_url,
+                'created_at': client.created_at.isoformat(),
+            }
+            for client in page.items
+        ],
+        'next_cursor': page.next_cursor,
+        'next_query': page_query(request, page.next_cursor) if page.next_cursor else None,
     })
+
+
+@login_required
+def client_avatar(request, client_id):
+    """Thumbnail of a client's avatar (rendered once, then served from storage)"""
+    client = get_object_or_404(Client, id=client_id)
+    fmt = request.GET.get('format', 'jpeg')
+    if not client.avatar or fmt not in AVATAR_VARIANTS:
+        raise Http404("Client has no avatar")
+    try:
+        name = get_or_create_thumbnail(client.avatar, fmt)
+    except (OSError, ValueError):
+        # Missing or unreadable original
+        raise Http404("Avatar not available")
+
+    response = FileResponse(default_storage.open(name, 'rb'), content_type=f'image/{fmt}')
+    # The URL carries a version of the avatar, so it can be cached for good
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
     
     
-@login_required
-def order_dashboard(request):
+def filter_orders(params):
+    """Orders matching the dashboard's status filter and search box"""
     orders = Order.objects.select_related('client').all()  # Efficient query
 
-    status_filter = request.GET.get('status')
+    status_filter = params.get('status')
     if status_filter:
         orders = orders.filter(status=status_filter)
     # ====================================
     # === SEARCH LOGIC ===
-    search_query = request.GET.get('search', '')
+    search_query = params.get('search', '')
     if search_query:
         # Search ONLY in Order ID and Fabric Type (Quantity handled below)
-        query_filter = (
-            Q(order_id__icontains=search_query) |
-            Q(fabric_type__istartswith=search_query) 
-            # REMOVED: Q(client__name__icontains=search_query) to prevent false matches
-        )
+        # Client names are indexed too, but left out to prevent false matches
+        matches = search_index.matches(Order, search_query, ('name', 'secondary'))
+        if matches is not None:
+            query_filter = Q(id__in=matches)
+            orders = orders.annotate(relevance=search_index.relevance(Order, search_query, ('name', 'secondary')))
+        else:
+            query_filter = (
+                Q(order_id__icontains=search_query) |
+                Q(fabric_type__istartswith=search_query) 
+                # REMOVED: Q(client__name__icontains=search_query) to prevent false matches
+            )
         
         # If the user types numbers, also check Quantity AND Client ID
         if search_query.isdigit():
             query_filter |= Q(quantity=int(search_query)) | Q(client__id=int(search_query))
             
         orders = orders.filter(query_filter)
+    return orders
+
+
+@login_required
+def order_dashboard(request):
+    orders = filter_orders(request.GET)
     
     #Handles delete
     if request.method == "POST" and "delete_order" in request.POST:
@@ -347,7 +345,7 @@ def order_dashboard(request):
         order.delete()
         
         # ✅ ADD ACTIVITY LOG FOR ORDER DELETION
-        ActivityLog.objects.create(
+        log_activity(
             activity_type='order_deleted',
             description=f'Order deleted: #{order_id_str}',
             user=request.user,
@@ -367,7 +365,7 @@ def order_dashboard(request):
             form.save()
             
             # ✅ ADD ACTIVITY LOG FOR ORDER UPDATE
-            ActivityLog.objects.create(
+            log_activity(
                 activity_type='order_updated',
                 description=f'Order updated: #{order.order_id} status changed to {order.status}',
                 user=request.user,
@@ -382,21 +380,31 @@ def order_dashboard(request):
     
        # === REAL-TIME STATS ===
     
+    counters = get_counters()
+
     # 1. Total Orders: Count everything
-    total_orders = Order.objects.all().count()
+    total_orders = counters['orders_total']
     
     # 2. Pending: Count ALL orders EXCEPT 'completed'
     # This includes: Sample Preparing, Production Starts, Quality Checking, Ready for Shipment, and Shipped
-    pending = Order.objects.exclude(status='completed').count()
+    pending = counters['orders_pending']
     
     # 3. Shipped: Count orders with specific status 'shipped'
-    shipped = Order.objects.filter(status='shipped').count()
+    shipped = counters['orders_shipped']
     
     # 4. Completed: Count orders with specific status 'completed'
-    completed = Order.objects.filter(status='completed').count()
+    completed = counters['orders_completed']
+
+    # === PAGINATION (keyset on created_at, id) ===
+    try:
+        page = keyset_page(orders, request.GET.get('cursor'), get_page_size(request), sort_fields(orders))
+    except ValueError:
+        page = keyset_page(orders, None, get_page_size(request), sort_fields(orders))
 
     return render(request, 'orders.html', {
-        'orders': orders,
+        'orders': page.items,
+        'next_cursor': page.next_cursor,
+        'next_query': page_query(request, page.next_cursor) if page.next_cursor else '',
         'form': form,
         'total_orders': total_orders,
         'pending': pending,
@@ -404,6 +412,31 @@ def order_dashboard(request):
         'completed': completed,
     })
     
+@login_required
+def order_page_api(request):
+    """Next page of the order table, for "Load more" on the order dashboard"""
+    orders = filter_orders(request.GET)
+    try:
+        page = keyset_page(orders, request.GET.get('cursor'), get_page_size(request), sort_fields(orders))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'html': render_to_string('order_rows.html', {'orders': page.items}, request=request),
+        'orders': [
+            {
+                'id': order.id,
+                'order_id': order.order_id,
+                'client_id': order.client_id,
+                'status': order.status,
+                'created_at': order.created_at.isoformat(),
+            }
+            for order in page.items
+        ],
+        'next_cursor': page.next_cursor,
+        'next_query': page_query(request, page.next_cursor) if page.next_cursor else None,
+    })
+    
 def add_order_for_client(request, client_id):
     client = get_object_or_404(Client, id=client_id)
     
@@ -416,7 +449,7 @@ def add_order_for_client(request, client_id):
             order.save()
             
             # ✅ ADD ACTIVITY LOG FOR NEW ORDER
-            ActivityLog.objects.create(
+            log_activity(
                 activity_type='order_created',
                 description=f'New order created: #{order.order_id} for {client.name}',
                 user=request.user,
@@ -445,7 +478,7 @@ def inventory_dashboard(request):
                 Material.objects.filter(id=material_id).delete()
                 
                 #Activity
-                ActivityLog.objects.create(
+                log_activity(
                     activity_type = 'material_deleted',
                     description = f'Material deleted : {material.name}',
                     user = request.user,
@@ -470,7 +503,7 @@ def inventory_dashboard(request):
                 material.save()
                 
                 #ACTIvity
-                ActivityLog.objects.create(
+                log_activity(
                     activity_type = 'material_updated',
                     description = f'Material Updated : {material.name}',
                     user = request.user,
@@ -498,7 +531,7 @@ def inventory_dashboard(request):
                 material.save()
                 
                 #Activity
-                ActivityLog.objects.create(
+                log_activity(
                     activity_type = 'material_record',
                     description = f'New Material added : {material.name}',
                     user = request.user,
@@ -522,7 +555,13 @@ def inventory_dashboard(request):
 
     # Apply search
     if search_query:
-        materials = materials.filter(name__icontains=search_query)
+        matches = search_index.matches(Material, search_query, ('name',))
+        if matches is not None:
+            materials = materials.filter(id__in=matches).annotate(
+                relevance=search_index.relevance(Material, search_query, ('name',)),
+            ).order_by('-relevance', 'id')
+        else:
+            materials = materials.filter(name__icontains=search_query)
 
     # Apply status filter
     if status_filter == 'out_of_stock':
@@ -534,13 +573,13 @@ def inventory_dashboard(request):
 
     # Compute stats based on **filtered** materials (optional)
     # Or keep stats for ALL materials — your choice
-    all_materials = Material.objects.all()
-    total_materials = all_materials.count()
-    out_of_stock = all_materials.filter(quantity=0).count()
+    counters = get_counters()
+    total_materials = counters['materials_total']
+    out_of_stock = counters['materials_empty']
     # In Stock = everything with quantity > 0
-    in_stock = all_materials.filter(quantity__gt=0).count()
+    in_stock = counters['materials_in_stock']
     # Low Stock = subset of in_stock
-    low_stock = all_materials.filter(quantity__gt=0, quantity__lt=F('threshold')).count()
+    low_stock = counters['materials_low_stock']
 
     # Add computed fields for each material (for cards)
     for mat in materials:
@@ -612,30 +651,38 @@ def finance_dashboard(request):
                 order = Order.objects.get(id=order_id)
 
                 if new_total_paid < 0:
+                    metrics.PAYMENTS.inc(result='rejected')
                     messages.error(request, "Paid amount cannot be negative.")
                 elif new_total_paid > order.payment:
+                    metrics.PAYMENTS.inc(result='rejected')
                     messages.error(request, f"Paid amount cannot exceed total invoice amount (${order.payment}).")
                 else:
-                    # ✅ DELETE all existing invoices
-                    Invoice.objects.filter(order=order).delete()
-
-                    # ✅ ALWAYS create a new invoice — even if $0
-                    Invoice.objects.create(
-                        order=order,
-                        amount=new_total_paid,
-                        payment_method='cash'  # or omit if you remove payment_method
-                    )
-                    
-                    # ✅ ADD ACTIVITY LOG
-                    ActivityLog.objects.create(
-                        activity_type='payment_recorded',
-                        description=f'Payment recorded: ${new_total_paid} for order #{order.order_id}',
-                        user=request.user,
-                        order_id=order.id
-                    )
-
+                    # The payment and its log entry are saved together or not at all
+                    with transaction.atomic():
+                        # ✅ DELETE all existing invoices
+                        Invoice.objects.filter(order=order).delete()
+
+                        # ✅ ALWAYS create a new invoice — even if $0
+                        Invoice.objects.create(
+                            order=order,
+                            amount=new_total_paid,
+                            payment_method='cash'  # or omit if you remove payment_method
+                        )
+
+                        # ✅ ADD ACTIVITY LOG
+                        log_activity(
+                            activity_type='payment_recorded',
+                            description=f'Payment recorded: ${new_total_paid} for order #{order.order_id}',
+                            user=request.user,
+                            order_id=order.id,
+                            critical=True,
+                        )
+
+                    metrics.PAYMENTS.inc(result='recorded')
+                    metrics.PAYMENT_AMOUNT.inc(float(new_total_paid))
                     messages.success(request, "Payment updated successfully.")
             except (Order.DoesNotExist, ValueError, Exception) as e:
+                metrics.PAYMENTS.inc(result='error')
                 messages.error(request, f"Error: {str(e)}")
     
             return redirect('finance_dashboard')
@@ -644,36 +691,46 @@ def finance_dashboard(request):
     status_filter = request.GET.get('status', '').strip()
         
     
-    client_invoices = Order.objects.select_related('client').prefetch_related('invoices').annotate(
-        total_paid=Coalesce(Sum('invoices__amount'), 0, output_field=DecimalField()),
-        db_remaining=F('payment') - Coalesce(Sum('invoices__amount'), 0, output_field=DecimalField())
-    )
+    # Balances come from the order's ledger columns (core/ledger.py)
+    client_invoices = Order.objects.select_related('client').annotate(latest_invoice_id=latest_invoice_id()).order_by('-created_at', '-id')
     
     # Apply search filter
     if search_query:
-        client_invoices = client_invoices.filter(
-            Q(client__name__icontains=search_query) |
-            Q(client__id__icontains=search_query) |
-            Q(order_id__icontains=search_query)
-        )
+        matches = search_index.matches(Order, search_query, ('name', 'related'))
+        if matches is not None:
+            query_filter = Q(id__in=matches)
+            if search_query.isdigit():
+                query_filter |= Q(client__id=int(search_query))
+            client_invoices = client_invoices.filter(query_filter).annotate(
+                relevance=search_index.relevance(Order, search_query, ('name', 'related')),
+            )
+        else:
+            client_invoices = client_invoices.filter(
+                Q(client__name__icontains=search_query) |
+                Q(client__id__icontains=search_query) |
+                Q(order_id__icontains=search_query)
+            )
     
     # Apply status filter
-    if status_filter:
-        if status_filter == 'paid':
-            client_invoices = client_invoices.filter(db_remaining__lte=0)
-        elif status_filter == 'partial':
-            client_invoices = client_invoices.filter(db_remaining__gt=0, total_paid__gt=0)
-        elif status_filter == 'pending':
-            client_invoices = client_invoices.filter(total_paid=0)
+    if status_filter in (Order.PAYMENT_PAID, Order.PAYMENT_PARTIAL, Order.PAYMENT_PENDING):
+        client_invoices = client_invoices.filter(payment_state=status_filter)
 
     # ✅ Calculate stats AFTER client_invoices is defined
     # Calculate stats
     total_invoices = client_invoices.count()
-    paid_invoices = client_invoices.filter(db_remaining__lte=0).count()
+    paid_invoices = client_invoices.filter(payment_state=Order.PAYMENT_PAID).count()
     unpaid_invoices = total_invoices - paid_invoices
 
+    # === PAGINATION (keyset on created_at, id) ===
+    try:
+        page = keyset_page(client_invoices, request.GET.get('cursor'), get_page_size(request), sort_fields(client_invoices))
+    except ValueError:
+        page = keyset_page(client_invoices, None, get_page_size(request), sort_fields(client_invoices))
+
     context = {
-    'client_invoices': client_invoices,
+    'client_invoices': page.items,
+    'next_cursor': page.next_cursor,
+    'next_query': page_query(request, page.next_cursor) if page.next_cursor else '',
     'vendor_bills': [],
     'total_invoices': total_invoices,
     'paid_invoices': paid_invoices,
@@ -714,11 +771,7 @@ def finance_dashboard(request):
 
        
 
-    # ✅ Use a DIFFERENT name for the annotation
-    client_invoices = Order.objects.select_related('client').prefetch_related('invoices').annotate(
-        total_paid=Coalesce(Sum('invoices__amount'), 0, output_field=DecimalField()),
-        db_remaining=F('payment') - Coalesce(Sum('invoices__amount'), 0, output_field=DecimalField())
-    )
+    client_invoices = Order.objects.select_related('client').annotate(latest_invoice_id=latest_invoice_id()).order_by('-created_at', '-id')
     context = {
         'client_invoices': client_invoices,
         'vendor_bills': [],
@@ -726,24 +779,29 @@ def finance_dashboard(request):
     return render(request, 'finance.html', context)
 
 def client_search_api(request):
+    """
+    Typeahead for client pickers. Answered from the in-memory prefix index
+    (core/typeahead.py); callers should send at least 2 characters and can
+    rely on the browser cache for repeated keystrokes.
+    """
     query = request.GET.get('q', '')
     if len(query) < 2:
         return JsonResponse([], safe=False)
-    
-    clients = Client.objects.filter(
-        Q(name__icontains=query) | Q(email__icontains=query)
-    )[:10]  # Limit to 10 results
 
+    with metrics.SEARCH_SECONDS.time():
+        matches = typeahead.search(query, limit=10)
     results = [
         {
-            'id': client.id,
-            'display': f"CL-{client.id} – {client.name}",
-            'name': client.name,
-            'email': client.email,
+            'id': client_id,
+            'display': f"CL-{client_id} – {name}",
+            'name': name,
+            'email': email,
         }
-        for client in clients
+        for client_id, name, email in matches
     ]
-    return JsonResponse(results, safe=False)
+    response = JsonResponse(results, safe=False)
+    patch_cache_control(response, private=True, max_age=getattr(settings, 'TYPEAHEAD_MAX_AGE', 30))
+    return response
 
 @require_http_methods(["GET"])
 def get_material_vendors(request, material_id):
@@ -760,20 +818,23 @@ def reorder_dashboard(request):
     status_filter = request.GET.get('status','').strip()
     
     materials = Material.objects.filter(quantity__lte=F('threshold'))
-    total_reorder_materials = materials.count()
-    low_stock_materials_count = materials.filter(
-        quantity__gt=0, 
-    ).count()
-    out_of_stock_materials_count = materials.filter(
-        quantity__lte=0
-    ).count()
+    counters = get_counters()
+    total_reorder_materials = counters['materials_below_threshold']
+    low_stock_materials_count = counters['materials_reorder_low_stock']
+    out_of_stock_materials_count = counters['materials_out_of_stock']
     
     #  Get materials below threshold AND apply search
     
     if search_query:
-        materials = materials.filter(
-            Q(name__icontains=search_query)
-        )
+        matches = search_index.matches(Material, search_query, ('name',))
+        if matches is not None:
+            materials = materials.filter(id__in=matches).annotate(
+                relevance=search_index.relevance(Material, search_query, ('name',)),
+            )
+        else:
+            materials = materials.filter(
+                Q(name__icontains=search_query)
+            )
     
     #Status Filter
     if status_filter:
@@ -783,7 +844,10 @@ def reorder_dashboard(request):
             materials = materials.filter(quantity__gt=0)
             
     
-    low_stock_materials = materials.order_by('quantity')
+    # Vendors are listed on every row
+    # Best search match first, then the emptiest
+    ordering = ('-relevance', 'quantity') if 'relevance' in materials.query.annotations else ('quantity',)
+    low_stock_materials = materials.order_by(*ordering).prefetch_related('vendors')
 
     if request.method == 'POST':
         material_id = request.POST.get('material_id')
@@ -823,13 +887,14 @@ def reorder_dashboard(request):
             )
 
             # ✅ ADD ACTIVITY LOG FOR REORDER
-            ActivityLog.objects.create(
+            log_activity(
                 activity_type='reorder_created',
                 description=f'Reorder placed: {order_quantity} {material.unit} of {material.name} from {vendor.name}',
                 user=request.user,
                 reorder_id=reorder.id,  # ✅ Use the captured reorder ID
                 material_id=material.id
             )
+            metrics.REORDERS.inc()
 
             messages.success(request, f"✅ Reorder placed: {order_quantity} {material.unit} of {material.name} from {vendor.name}")
             return redirect('reorder_dashboard')
@@ -853,10 +918,7 @@ def view_invoice(request, invoice_id):
     invoice = get_object_or_404(Invoice, id=invoice_id)
     order = invoice.order  # ✅ Get related order
 
-    # ✅ Calculate total paid and remaining
-    total_paid = order.invoices.aggregate(total=models.Sum('amount'))['total'] or 0
-    remaining = order.payment - total_paid
-    
+
     bank_name , iban = get_bank_details(invoice_id)
 
     # ✅ Generate random bank + IBAN
@@ -881,95 +943,118 @@ def view_invoice(request, invoice_id):
     context = {
         'invoice': invoice,
         'order': order,  # ✅ Needed for client/order info
-        'paid_amount': total_paid,  # ✅ For Payment Summary
-        'remaining_amount': remaining,  # ✅ For Remaining & Due Amount
+        'paid_amount': order.paid_amount,  # ✅ For Payment Summary
+        'remaining_amount': order.remaining_amount,  # ✅ For Remaining & Due Amount
         'bank_name': bank_name,  # ✅ For Bank Details
         'iban': iban,  # ✅ For Bank Details
     }
 
     return render(request, 'invoice_detail.html', context)
 
+@login_required
 def download_invoice_pdf(request, invoice_id):
-    invoice = get_object_or_404(Invoice, id=invoice_id)
-    order = invoice.order
-
-    # ✅ Calculate paid & remaining (same as view_invoice)
-    total_paid = order.invoices.aggregate(total=models.Sum('amount'))['total'] or 0
-    remaining = order.payment - total_paid
-    
-    bank_name , iban = get_bank_details(invoice_id)
-    
-    # # ✅ Generate bank + IBAN (same as view_invoice)
-    # banks = [
-    #     "Global Trust Bank",
-    #     "Penta Financial Services",
-    #     "Horizon Capital Bank",
-    #     "Summit National Bank",
-    #     "Vertex Banking, Ltd."
-    # ]
-    # ibans = [
-    #     "DE89370400440532013000",
-    #     "FR1420041010050500013M02606",
-    #     "GB29NWBK60161331926819",
-    #     "IT60X0542811101000000123456",
-    #     "ES9121000418450200051332"
-    # ]
-    # bank_name = random.choice(banks)
-    # iban = random.choice(ibans)
+    invoice = get_object_or_404(Invoice.objects.select_related('order__client'), id=invoice_id)
+
+    # 🔸 Same template and context as the web view (view_invoice)
+    html_content = invoice_html(invoice)
+
+    # The HTML hash is both the cache key and the ETag: a browser that already
+    # has this exact invoice gets a 304 without anything being rendered
+    key = pdf_cache.cache_key(html_content)
+    etag = quote_etag(key)
+    cached = pdf_cache.get(invoice, key)
+    last_modified = cached[1].timestamp() if cached else None
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        metrics.PDF_DOWNLOADS.inc(result='not_modified')
+        return not_modified
+
+    if not cached:
+        metrics.PDF_DOWNLOADS.inc(result='queued')
+        # Rendering can take seconds; hand it to the worker (run_pdf_worker)
+        # and let the browser poll pdf_job_status until the PDF is cached
+        job = enqueue(invoice, base_url=request.build_absolute_uri())
+        status_url = reverse('pdf_job_status', args=[job.id])
+        if request.headers.get('Accept', '').startswith('application/json'):
+            return JsonResponse({'job_id': job.id, 'status_url': status_url}, status=202)
+        return render(request, 'pdf_job.html', {
+            'invoice': invoice,
+            'job': job,
+            'status_url': status_url,
+        }, status=202)
+
+    metrics.PDF_DOWNLOADS.inc(result='cached')
+    pdf_data, rendered_at = cached
+    response = HttpResponse(pdf_data, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{pdf_filename(invoice)}"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(rendered_at.timestamp())
+    # Revalidate every time; the ETag makes that a cheap 304
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-    # ✅ PASS FULL CONTEXT (critical!)
-    context = {
-        'invoice': invoice,
-        'order': order,
-        'paid_amount': total_paid,
-        'remaining_amount': remaining,
-        'bank_name': bank_name,
-        'iban': iban,
+@login_required
+def pdf_job_status(request, job_id):
+    job = get_object_or_404(PDFJob, id=job_id)
+    data = {
+        'job_id': job.id,
+        'status': job.status,
+        'attempts': job.attempts,
+        'error': job.last_error,
     }
+    if job.status == PDFJob.DONE:
+        data['download_url'] = reverse('download_invoice_pdf', args=[job.invoice_id])
+    return JsonResponse(data)
 
-    # 🔸 Use the SAME template as your web view!
-    # If your web uses 'invoice_detail.html', use that — NOT 'invoice_pdf.html'
-    html_content = render_to_string('invoice_detail.html', context)
-
-    # Rest of your WeasyPrint logic (unchanged)
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as html_file:
-        html_file.write(html_content)
-        html_path = html_file.name
-
-    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
-        pdf_path = pdf_file.name
-
+@login_required
+def export_invoice_pdfs(request):
+    """
+    Stream the PDFs of every invoice matching ?start=&end= (YYYY-MM-DD,
+    inclusive) and ?client=<id> as one ZIP, sent while it is being rendered
+    """
     try:
-        WEASYPRINT_PATH = r"D:\project1\weasyprint-windows\dist\weasyprint.exe"
-        result = subprocess.run(
-            [WEASYPRINT_PATH, html_path, pdf_path],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-
-        if result.returncode != 0:
-            print("WeasyPrint Error:", result.stderr)
-            messages.error(request, "Failed to generate PDF.")
-            return redirect('finance_dashboard')
-
-        with open(pdf_path, 'rb') as f:
-            pdf_data = f.read()
+        start = parse_date(request.GET.get('start', ''))
+        end = parse_date(request.GET.get('end', ''))
+        client_id = int(request.GET['client']) if request.GET.get('client') else None
+    except ValueError:
+        messages.error(request, "Invalid export filter.")
+        return redirect('finance_dashboard')
 
-        response = HttpResponse(pdf_data, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="Invoice_INV-{invoice.id}.pdf"'
-        return response
+    invoices = export_queryset(start=start, end=end, client_id=client_id)
+    response = StreamingHttpResponse(
+        stream_zip(invoices, base_url=request.build_absolute_uri('/')),
+        content_type='application/zip',
+    )
+    filename = f"invoices_{start or 'all'}_{end or 'all'}.zip"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@user_passes_test(lambda user: user.is_staff)
+def perf_dashboard(request):
+    """Slowest endpoints and most repeated SQL from the sampled request profiles"""
+    profiles = profiling.profiles()
+    return render(request, 'perf.html', {
+        'profile_count': len(profiles),
+        'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', 0),
+        'endpoints': profiling.slowest_endpoints(profiles),
+        'repeated_queries': profiling.repeated_queries(profiles),
+    })
 
-    except subprocess.TimeoutExpired:
-        messages.error(request, "PDF generation timed out.")
-        return redirect('finance_dashboard')
-    except FileNotFoundError:
-        messages.error(request, "WeasyPrint executable not found.")
-        return redirect('finance_dashboard')
-    finally:
-        for path in [html_path, pdf_path]:
-            if os.path.exists(path):
-                os.remove(path)
+def metrics_endpoint(request):
+    """
+    Prometheus scrape target (core/metrics.py). Open to staff sessions and
+    to scrapers sending METRICS_TOKEN as ``Authorization: Bearer <token>``;
+    to anyone only with METRICS_PUBLIC.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    allowed = (
+        getattr(settings, 'METRICS_PUBLIC', False)
+        or request.user.is_staff
+        or (token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'))
+    )
+    if not allowed:
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 def admin_login(request):
     """
@@ -990,12 +1075,15 @@ def admin_login(request):
         
         if user is not None:
             if user.is_staff:  # Ensure only staff/admin users can login
+                metrics.LOGINS.inc(result='success')
                 login(request, user)
                 messages.success(request, f"Welcome back, {user.username}!")
                 return redirect('main_dashboard')  # Make sure this URL name matches your main dashboard
             else:
+                metrics.LOGINS.inc(result='denied')
                 messages.error(request, "Access denied. Admin privileges required.")
         else:
+            metrics.LOGINS.inc(result='invalid')
             messages.error(request, "Invalid username or password.")
     
     return render(request, 'admin_login.html')
\ No newline at end of file
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -82,6 +84,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # On disk rather than in memory so the threaded tests (core.tests)
+        # exercise SQLite's real locking
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -129,6 +134,96 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 
+# Seconds an unused avatar file is kept after it was last uploaded or shared
+# (core/avatars.py), so a save still in flight never loses its file
+AVATAR_GC_GRACE = 3600
+
 # settings.py
 LOGIN_URL = 'admin_login'  # Name of your login URL
-LOGIN_REDIRECT_URL = 'main_dashboard'  # Where to go after successful login
\ No newline at end of file
+LOGIN_REDIRECT_URL = 'main_dashboard'  # Where to go after successful login
+
+# Rows per page on the paginated dashboard tables (?page_size= overrides, up to the max)
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 200
+
+# Invoice PDF rendering (core/pdf.py). PDF_RENDERER is a dotted path to a
+# PDFRenderer; unset = in-process WeasyPrint if installed, else the CLI below.
+PDF_RENDERER = None
+WEASYPRINT_BINARY = 'weasyprint'
+PDF_RENDER_TIMEOUT = 30
+
+# Rendered invoice PDFs (core/pdf_cache.py); kept out of MEDIA_ROOT so they
+# are never served without the login check
+PDF_CACHE_DIR = BASE_DIR / 'cache' / 'invoice_pdfs'
+
+# Bulk invoice export: worker processes (default: one per CPU), one pool per
+# process shared by all exports, and how many renders each worker may have
+# queued per export before the ZIP stream waits for results
+PDF_EXPORT_WORKERS = None
+PDF_EXPORT_WINDOW = 2
+
+# Invoice PDF job queue (core/pdf_jobs.py, `manage.py run_pdf_worker`).
+# Failed renders are retried after PDF_JOB_RETRY_DELAY seconds, doubling
+# each time up to PDF_JOB_MAX_RETRY_DELAY; a job still "running" after
+# PDF_JOB_STALE_AFTER seconds is assumed abandoned and queued again.
+PDF_JOB_MAX_ATTEMPTS = 5
+PDF_JOB_RETRY_DELAY = 10
+PDF_JOB_MAX_RETRY_DELAY = 600
+PDF_JOB_STALE_AFTER = 300
+PDF_JOB_POLL_INTERVAL = 1
+
+# Client typeahead (core/typeahead.py): seconds between checks for client
+# edits made by other processes, and how long browsers may reuse an answer
+TYPEAHEAD_RECHECK = 1.0
+TYPEAHEAD_MAX_AGE = 30
+
+# Request profiling (core/profiling.py, staff page at /perf/): the share of
+# requests measured, and how many recent profiles are kept in the
+# PROFILING_CACHE cache alias
+PROFILING_SAMPLE_RATE = 0.05
+PROFILING_KEEP = 1000
+PROFILING_CACHE = 'profiling'
+# Sampled responses carry a Server-Timing header for staff only, unless
+# this is True (it tells anyone how much SQL a page runs)
+PROFILING_SERVER_TIMING_PUBLIC = False
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Per process; use a shared backend to see every worker on /perf/
+    'profiling': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'profiling',
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+# Prometheus metrics at /metrics (core/metrics.py). Set METRICS_DIR to a
+# directory shared by all processes when running more than one (gunicorn
+# workers, run_pdf_worker, the export pool); under gunicorn, call
+# core.metrics.mark_process_dead(worker.pid) from its child_exit hook.
+# Staff sessions can read it, and scrapers that send METRICS_TOKEN as
+# "Authorization: Bearer <token>"; METRICS_PUBLIC = True opens it to anyone.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1.0
+METRICS_TOKEN = None
+METRICS_PUBLIC = False
+
+# Seconds a rendered activity feed stays cached (core/activity.py); writes
+# bump the feed version in the database, so no process reuses an old one
+ACTIVITY_FEED_TIMEOUT = 300
+
+# Batched activity log writes (core/activity.py): a batch is written when
+# this many entries are queued or after the interval (seconds); at most
+# ACTIVITY_LOG_MAX_QUEUE entries are held while the database is unavailable
+ACTIVITY_LOG_BATCH_SIZE = 100
+ACTIVITY_LOG_FLUSH_INTERVAL = 2.0
+ACTIVITY_LOG_MAX_QUEUE = 10000
+
+# Activity log retention (core/activity_archive.py, `manage.py
+# archive_activity`): entries older than this many days move to per-month
+# directories of gzip JSON-lines files here, with per-day counts kept in
+# ActivityRollup
+ACTIVITY_RETENTION_DAYS = 90
+ACTIVITY_ARCHIVE_DIR = BASE_DIR / 'archive' / 'activity'
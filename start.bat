@@ -1,5 +1,7 @@
 @echo off
 cd /d D:\project1
 call venv\Scripts\activate
+rem Invoice PDFs are rendered by this worker, not by the web server
+start "PDF worker" cmd /k python manage.py run_pdf_worker
 python manage.py runserver
-pause
\ No newline at end of file
+pause
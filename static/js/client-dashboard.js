@@ -76,6 +76,38 @@ if (avatarUrl) {
     });
   });
   
+  // INFINITE SCROLL - fetch the next page when "Load more" scrolls into view
+  // (the link still works as a plain next-page link without JavaScript)
+  const loadMore = document.getElementById('load-more-clients');
+  if (loadMore) {
+    let loading = false;
+    const loadNextPage = function () {
+      if (loading) return;
+      loading = true;
+      fetch(loadMore.dataset.apiUrl + loadMore.getAttribute('href'))
+        .then(response => response.json())
+        .then(data => {
+          document.getElementById('clients-tbody').insertAdjacentHTML('beforeend', data.html);
+          if (data.next_query) {
+            loadMore.setAttribute('href', '?' + data.next_query);
+            loading = false;
+          } else {
+            observer.disconnect();
+            loadMore.remove();
+          }
+        })
+        .catch(() => { window.location = loadMore.getAttribute('href'); });
+    };
+    const observer = new IntersectionObserver(entries => {
+      if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+    }, { rootMargin: '200px' });
+    observer.observe(loadMore);
+    loadMore.addEventListener('click', function (e) {
+      e.preventDefault();
+      loadNextPage();
+    });
+  }
+
   // SEARCH - REMOVED AUTO-SUBMIT TO PREVENT RELOAD
   // Users must press Enter or click the status filter to submit
   const searchInput = document.querySelector('input[name="search"]');